@@ -20,12 +20,22 @@ from 	lib.basic_retrieval_helpers 	import 	*
 from 	lib.plotutils 					import 	*
 from 	lib.preprocessing_lib 			import 	*
 from 	lib.prob_fuse_lib 				import 	*
-import 	subprocess
+from 	lib.run_cache_lib 				import 	*
+from 	lib.trec_eval_lib 				import 	*
+from 	lib.instrumentation_lib 		import 	*
+from 	lib.compression_lib 			import 	*
 import 	pprint
 import 	operator
 import 	datetime
+import 	functools
 
 def main():
+	# the time and the counters (lines, docs, files, bytes) of every step and of the functions they call
+	# are written here, in json (see lib/instrumentation_lib.py); None to turn the instrumentation off
+	instrumentation_report = "output/instrumentation.json"
+	if instrumentation_report is not None:
+		enable_instrumentation()
+
 	select = -1
 	while (select!='0' and select!='1'):
 		print("Welcome!")
@@ -52,56 +62,59 @@ def main():
 
 		print("Computing...")
 		start_time = datetime.datetime.now()
+		stage = begin_stage("combine", with_io=True)
 
 		# initalizing in/outs/params
 		input_folder 	= "input/ten_models"
 		output_folder 	= "output/base_combinations/"
 		tmp_folder = output_folder + "/tmp/"
-		comb_techniques = [combMNZ, combSUM, combMAX, combMIN, combANZ, combMED]
+		# set to True to aggregate the runs through tmp files (one per topic) instead of in memory
+		spill_to_disk = False
+		# set to True to read the runs in lock-step, one topic at a time: the memory holds a single topic of each run
+		# (for runs that don't fit in it; spill_to_disk and the run cache are not used)
+		streaming = False
+		# the runs are parsed once and kept in a binary cache, shared with step (2); None to parse the text every time
+		run_cache_folder = "output/cache/runs"
+		# how the scores of each run are normalized before fusing them: "min_max", "max", "sum", "z_score" or "rank"
+		# (see lib/normalization_lib.py)
+		normalization = "min_max"
+		# how many documents are kept for each topic of the fused runs
+		output_depth = default_run_depth
+		# decimals of the scores in the fused runs; None to write them in full (str(score))
+		output_precision = None
+		# ".gz", ".bz2" or ".xz" to write the fused runs compressed (e.g. combSUM.res.gz), None for plain text
+		output_compression = None
+		run_parser = parse_res_file_interned if run_cache_folder is None else functools.partial(parse_res_file_cached_interned, cache_folder=run_cache_folder)
 
 
 		check_folders_exist(input_folder)
 		# prepare output folder to avoid overwriting or mixing results
 		# this will wipe out all previous outputs inside our folder
 		clean_out_files(output_folder)
-		clean_tmp_files(tmp_folder)
 		run_files = get_res_files(input_folder)
 		
-		tempfilepaths = []
-		for filepath in run_files:
-			topics_docs_scores = parse_res_file(filepath)
-
-			for topic_id in topics_docs_scores:
-				topics_docs_scores[topic_id] = normalize_scores(topics_docs_scores[topic_id], "min_max")
-				# aggregates the documents/scores by topic
-				tempfilepaths.append( append_entries_to_file_by_topic(topic_id, topics_docs_scores[topic_id], tmp_folder) )
-
-		tempfilepaths = list(set(tempfilepaths)) # remove duplicates from list
-		tempfilepaths.sort() # not needed but nicer
-
-		# done reading run entries of all 10 models and aggregating them by topic
-
-		for topic_file in tempfilepaths:
-			# the following is a dict {document: [score351, score351, ..., score400]}
-			docs_scores_aggregated = parse_aggregated_topic(topic_file)
+		# reading run entries of all the models and aggregating them by topic;
+		# each element is a triple (topic_id, interned doc ids, matrix with a row of scores per document)
+		spill_folder = tmp_folder if spill_to_disk else None
+		if streaming:
+			topic_matrices = iterate_streamed_topic_score_matrices(run_files, normalization)
+		else:
+			topic_matrices = iterate_topic_score_matrices(run_files, normalization, spill_folder, run_parser)
 
-			# extract topic_id from file name
-			topic_id = topic_file.split("/")
-			topic_id = topic_id[-1].split(".")
-			topic_id = topic_id[0]
+		# the six fused runs stay open until the last topic
+		with open_run_writers(output_folder, comb_technique_names, output_precision, compression=output_compression) as writers:
+			for topic_id, doc_ids, matrix in topic_matrices:
 
-			for comb_technique in comb_techniques:
-				# apply the desired comb technique to the aggregated scores
-				new_run = apply_comb_to_aggregated_docs_scores(docs_scores_aggregated, comb_technique)
-				
-				# prepare tuple with trec format
-				formatted_run = format_as_trec_run(new_run, topic_id)
+				# apply all the comb techniques to the aggregated scores at once
+				new_runs = apply_all_combs_to_score_matrix(doc_ids, matrix, output_depth)
 
-				# append new_run to file
-				append_run_to_res_file(output_folder, comb_technique.__name__, formatted_run)
+				for comb_technique_name, new_run in new_runs.items():
+					# append new_run to its file, in trec format
+					write_ranking_to_run(writers[comb_technique_name], new_run, topic_id, interned=not streaming)
 
-			# Topic done!
+				# Topic done!
 
+		end_stage(stage)
 		elapsed_time = datetime.datetime.now() - start_time
 		print()
 		print("Base tecniques are now done! Output files are in '" + output_folder + "'")
@@ -128,11 +141,14 @@ def main():
 
 		print("Preprocessing files...")
 		start_time = datetime.datetime.now()
+		stage = begin_stage("preprocess", with_io=True)
 
 		# init updates
 		input_folder 	= "input/ten_models"
 		ground_truth	= "input/qrels.trec7.txt"
 		output_folder 	= "output/preprocessed_scores"
+		# binary cache of the runs, shared with step (1); None to parse the text every time
+		run_cache_folder = "output/cache/runs"
 
 		# verifying and extracting inputs
 		check_ground_truth_exist(ground_truth)
@@ -145,8 +161,9 @@ def main():
 
 		# our .res files (obviously) don't have the ground truth for each document extracted.
 		# therefore, we must create our own set of input files compatible with the probFuse algorithm.
-		# then, we extract the ground truth from the file in a proper data structure.
-		gndt = extract_ground_truth(ground_truth)
+		# then, we extract the ground truth from the file in a proper data structure:
+		# an index of the qrels, built once and kept in output/cache/qrels (see qrels_lib)
+		gndt = load_qrels_index(ground_truth)
 
 		# then, we extract all the ten runs, properly, but we're just interested at the couple
 		# doc/relevance, rather than its score, etc.
@@ -160,10 +177,11 @@ def main():
 
 			# removes everything but the number of the run.
 			# what we want, for example, is just "1", so that we can give the correct output name just below
-			run_name = filepath[20:].split('/')[0]
+			run_name = get_run_name(filepath)
 			# this will write our "new" input file in the output folder, such that it'll be like: topic_id, doc_id, rel/notrel.
-			evaluate_run(filepath, gndt, output_folder+"/"+run_name+"_preprocessed.txt")
+			evaluate_run(filepath, gndt, output_folder+"/"+run_name+"_preprocessed.npz", run_cache_folder)
 
+		end_stage(stage)
 		elapsed_time = datetime.datetime.now() - start_time
 		print()
 		print("Preprocessing is done! Output files are in '" + output_folder + "'")
@@ -194,7 +212,14 @@ def main():
 
 		input_folder 	= "output/preprocessed_scores"
 		param_folder 	= "input/Xtparams.txt"
+		# how many processes run the sweep, and its seed (None: a new random one, which is printed)
+		n_workers 		= os.cpu_count()
+		seed 			= None
 		output_folder 	= "output/probfuse/"
+		# decimals of the scores in the fused runs; None to write them in full (str(score))
+		output_precision = None
+		# ".gz", ".bz2" or ".xz" to write the fused runs compressed, None for plain text
+		output_compression = None
 
 		x_choices, t_choices = extract_params(param_folder)
 		clean_out_files(output_folder)
@@ -207,34 +232,26 @@ def main():
 		select = input("Ready to go? (press Enter to go) ")
 		# quick check on folder existence and its content
 		check_relevances_exist(input_folder)
-		time_summation = datetime.timedelta()
-		# x is the number of segmentes
-		for x in x_choices:
-			# t is the training set size, as a percentage of the queries
-			for t in t_choices:
-				# For each ProbFuse configuration, we want to try ProbFuseAll and ProbFuseJudged
-				for judge in [True, False]:
-					# calling the core function
-					if judge:
-						string_judge = "ProbFuseJudged"
-					else:
-						string_judge = "ProbFuseAll"
-					start_time 		= datetime.datetime.now()
-					print ("Combinining with parameters: N_SEGMENTS="+str(x)+", TRAINING_TOPICS="+str(t*50)+", "+string_judge)
-					prob_fuse(input_folder, output_folder+string_judge+"_"+str(x)+"_"+str(t)+".res", x, t, judge)
-					elapsed_time 	= datetime.datetime.now() - start_time
-					time_summation += elapsed_time
+		start_time = datetime.datetime.now()
+		stage = begin_stage("probfuse_sweep", with_io=True)
+		# the pre-processed files are read only once and the whole grid of
+		# (x, t, ProbFuseJudged/ProbFuseAll) configurations is evaluated against them.
+		# x is the number of segmentes, t is the training set size, as a percentage of the queries
+		# the configurations run in parallel on n_workers processes; fix the seed to reproduce a sweep
+		prob_fuse_sweep(input_folder, output_folder, x_choices, t_choices, [True, False], n_workers=n_workers, seed=seed, out_precision=output_precision, out_compression=output_compression)
+		end_stage(stage)
+		elapsed_time = datetime.datetime.now() - start_time
 
 		print()
 		print("ProbFuse2006 done! Output files are in '" + output_folder + "'")
-		print("Elapsed time: ", time_summation)
+		print("Elapsed time: ", elapsed_time)
 		print()
 	
 	select = -1
 	while (select!='0' and select!='4'):
 		print("Step (4): Evaluations")
 		print("If you already had done this, you're allowed to skip this step;")
-		print("REMEMBER: it is mandatory that you've already compiled trec_eval")
+		print("(the built-in evaluator is used, unless you choose the compiled trec_eval in RUNME.py)")
 		print("\t0: skip the base combination tecniques;")
 		print("\t4: evaluate every run done until now (ten runs, base combs and prob fuse);")
 
@@ -251,41 +268,50 @@ def main():
 		print("Computing...")
 
 		start_time = datetime.datetime.now()
+		stage = begin_stage("evaluate", with_io=True)
 		input_folders	= ["input/ten_models", "output/probfuse", "output/base_combinations"]
 		output_folders	= ["output/trec_evals/ten_models/", "output/trec_evals/probfuse/", "output/trec_evals/base_combinations/"]
 		ground_truth	= "input/qrels.trec7.txt"
+		# the built-in evaluator (see trec_eval_lib); put "./trec_eval.9.0/trec_eval" here to run the real trec_eval instead
+		trec_eval_command = native_trec_eval_command
+
+		# how many evaluations run at the same time
+		n_workers 		= os.cpu_count()
+		# evaluations already done on the same runs and qrels are read from here (None to always evaluate)
+		eval_cache_folder = default_eval_cache_folder
 
 		# this path is required to run this script. Better check if it's there.
 		for output_folder in output_folders:
 			clean_out_files(output_folder)
 
+		# couples (run to evaluate, its evaluation file)
+		jobs = []
 		for i in range(3):
 			# Recursive file extract, looks for ".res" files only.
-			file_list = [os.path.join(dp, f) for dp, dn, fn in os.walk(os.path.expanduser(input_folders[i])) for f in fn if f.endswith('.res')]
+			file_list = [os.path.join(dp, f) for dp, dn, fn in os.walk(os.path.expanduser(input_folders[i])) for f in fn if has_extension(f, '.res')]
 
 			for file in sorted(file_list):
-				instruction = "./trec_eval.9.0/trec_eval "+ground_truth+" "+file
-				instruction = instruction.strip()
-				args = instruction.split(' ')
-				result = subprocess.run(args, stdout=subprocess.PIPE).stdout.decode('utf-8')
 				# If we're analyizing the ten runs, it is wise to choose "runX" as name
 				# If we don't do this, we can occour in some overwriting
 				if (i==0):
 					out_file = (file.split('/')[-2])
 				# all other cases are ok.
 				else:
-					out_file = (file.split('/')[-1])[:-4]
+					out_file = strip_compression_extension(file.split('/')[-1])[:-4]
+
+				jobs.append( (file, output_folders[i]+out_file+"_eval.txt") )
 
-				if not os.path.isdir(output_folders[i]):
-					os.makedirs(os.path.dirname(output_folders[i]), exist_ok=True)
+		# up to n_workers evaluations run concurrently, each result is written as soon as it's ready
+		failures = evaluate_files_parallel(jobs, trec_eval_command, ground_truth, n_workers, eval_cache_folder)
 
-				print ("Evaluating "+out_file)
-				f = open(output_folders[i]+out_file+"_eval.txt","w+")
-				f.write(result)
-				f.close()
+		for file, error in failures:
+			print("Evaluation failed: "+error)
+		end_stage(stage)
 		elapsed_time = datetime.datetime.now()-start_time
 		print()
 		print("Evaluations are done! You can find them in  'output/trec_evals'")
+		if len(failures) > 0:
+			print(str(len(failures))+" of "+str(len(jobs))+" evaluations failed, see the errors above.")
 		print("Elapsed time: ", elapsed_time)
 		print()
 
@@ -308,6 +334,7 @@ def main():
 		print()
 	else:
 		print("Computing...")
+		stage = begin_stage("select_best", with_io=True)
 		
 		input_folder 	= "output/trec_evals"
 
@@ -336,7 +363,13 @@ def main():
 		print("The best ProbFuse perfomance can be found in the following model: ")
 		maximum = max(maps.items(), key=operator.itemgetter(1))
 		print(maximum[0], maximum[1])
+		end_stage(stage)
+
+	if instrumentation_report is not None:
+		write_instrumentation_report(instrumentation_report)
+		print("Instrumentation report: "+instrumentation_report)
 
+	if (select=='5'):
 		input("Press Enter exit...")
 
 
@@ -3,6 +3,7 @@
 
 # helper functions to keep code organized
 from lib.basic_retrieval_helpers import *
+from lib.run_cache_lib import parse_res_file_cached_interned
 
 def main():
 	# define folders used
@@ -10,56 +11,52 @@ def main():
 	output_folder_path = "output/ten_models"
 	output_tmp_folder_path = output_folder_path + "/tmp/"
 
-	# comb techniques
-	comb_techniques = [combMNZ, combSUM, combMAX, combMIN, combANZ, combMED]
-
-	# check input/ten_models if there are folders "run" from 1 to 10 and get .res files 
+	# set to True to aggregate the runs through tmp files (one per topic) instead of in memory
+	spill_to_disk = False
+	# set to False to parse the .res text files every time instead of using their binary cache
+	use_run_cache = True
+	# set to True to read the runs in lock-step, one topic at a time, writing each topic before reading the next:
+	# the memory holds a single topic of each run, for runs that don't fit in it (spill_to_disk and use_run_cache are not used)
+	streaming = False
+	# how the scores of each run are normalized before fusing them: "min_max", "max", "sum", "z_score" or "rank"
+	# (see lib/normalization_lib.py)
+	normalization = "min_max"
+	# how many documents are kept for each topic of the fused runs
+	output_depth = default_run_depth
+	# decimals of the scores in the fused runs; None to write them in full (str(score))
+	output_precision = None
+	# ".gz", ".bz2" or ".xz" to write the fused runs compressed (e.g. combSUM.res.gz), None for plain text
+	output_compression = None
+
+	# check input/ten_models for the run folders ("run1", "run2", ...) and get their .res files
 	check_folders_exist(input_folder_path)
 	res_files = get_res_files(input_folder_path)
 
-	# clean tmp files
-	clean_tmp_files(output_tmp_folder_path)
-
 	print("Reading res files...")
-	
-	# iterate the ten models
-	tempfilepaths = []
-	for filepath in res_files:
-		topics_docs_scores = parse_res_file(filepath)
-
-		for topic_id in topics_docs_scores:
-			topics_docs_scores[topic_id] = normalize_scores(topics_docs_scores[topic_id], "min_max")
 
-			# save
-			tempfilepaths.append( append_entries_to_file_by_topic(topic_id, topics_docs_scores[topic_id], output_tmp_folder_path) )
-
-	tempfilepaths = list(set(tempfilepaths)) # remove duplicates from list
-	tempfilepaths.sort() # not needed but nicer
-
-	print("Done reading run entries of all 10 models and aggregating them by topic")
+	# iterate the runs, normalizing and aggregating their entries by topic
+	spill_folder = output_tmp_folder_path if spill_to_disk else None
+	run_parser = parse_res_file_cached_interned if use_run_cache else parse_res_file_interned
+	if streaming:
+		topic_matrices = iterate_streamed_topic_score_matrices(res_files, normalization)
+	else:
+		topic_matrices = iterate_topic_score_matrices(res_files, normalization, spill_folder, run_parser)
 
 	# prepare output folder to avoid overwriting or mixing results
 	output_res_folder = prepare_res_file_output_folder(output_folder_path)
 
-	for topic_file in tempfilepaths:
-		docs_scores_aggregated = parse_aggregated_topic(topic_file)
-
-		# extract topic_id from file name
-		topic_id = topic_file.split("/")
-		topic_id = topic_id[-1].split(".")
-		topic_id = topic_id[0]
+	# the six fused runs stay open until the last topic
+	with open_run_writers(output_res_folder, comb_technique_names, output_precision, compression=output_compression) as writers:
+		for topic_id, doc_ids, matrix in topic_matrices:
 
-		for comb_technique in comb_techniques:
-			# apply the desired comb technique to the aggregated scores
-			new_run = apply_comb_to_aggregated_docs_scores(docs_scores_aggregated, comb_technique)
-			
-			# prepare tuple with trec format
-			formatted_run = format_as_trec_run(new_run, topic_id)
+			# apply all the comb techniques to the aggregated scores at once
+			new_runs = apply_all_combs_to_score_matrix(doc_ids, matrix, output_depth)
 
-			# append new_run to file
-			append_run_to_res_file(output_res_folder, comb_technique.__name__, formatted_run)
+			for comb_technique_name, new_run in new_runs.items():
+				# append new_run to its file, in trec format
+				write_ranking_to_run(writers[comb_technique_name], new_run, topic_id, interned=not streaming)
 
-		print("Done topic: " + str(topic_id) + "\r", end=" ")
+			print("Done topic: " + str(topic_id) + "\r", end=" ")
 
 	print()
 	print("Fusion ranking done! Output files are in '" + output_folder_path + "'")
@@ -3,12 +3,26 @@
 
 # helper functions to keep code organized
 from lib.prob_fuse_lib import *
+from lib.instrumentation_lib import *
 
 def main():
 	# define folders used
 	input_folder_path = "output/preprocessed_scores" # generated by preprocess.py
 	output_folder_path = "output/probfuse/"
 	param_file = "input/Xtparams.txt"
+	# how many processes run the sweep, and its seed (None: a new random one, which is printed)
+	n_workers = os.cpu_count()
+	seed = None
+	# how many training splits to draw for each configuration: repetition r is written in output/probfuse_r/
+	n_repetitions = 1
+	# decimals of the scores in the fused runs; None to write them in full (str(score))
+	output_precision = None
+	# ".gz", ".bz2" or ".xz" to write the fused runs compressed (e.g. ProbFuseAll_25_0.5.res.gz), None for plain text
+	output_compression = None
+	# the time and the counters of the sweep, per configuration, are written here in json; None to turn them off
+	instrumentation_report = "output/instrumentation_probfuse.json"
+	if instrumentation_report is not None:
+		enable_instrumentation()
 
 	x_choices, t_choices = extract_params(param_file)
 
@@ -20,19 +34,14 @@ def main():
 	# quick check on folder existence and its content
 	check_relevances_exist(input_folder_path)
 
-	# x is the number of segmentes
-	for x in x_choices:
-		# t is the training set size, as a percentage of the queries
-		for t in t_choices:
-			# For each ProbFuse configuration, we want to try ProbFuseAll and ProbFuseJudged
-			for judge in [True, False]:
-				# calling the core function
-				if judge:
-					string_judge = "ProbFuseJudged"
-				else:
-					string_judge = "ProbFuseAll"
-				print ("Combinining with parameters: N_SEGMENTS="+str(x)+", TRAINING_TOPICS="+str(t*50)+", "+string_judge)
-				prob_fuse(input_folder_path, output_folder_path+string_judge+"_"+str(x)+"_"+str(t)+".res", x, t, judge)
+	# the pre-processed files are read only once and the whole grid of
+	# (x, t, ProbFuseJudged/ProbFuseAll) configurations is evaluated against them.
+	# x is the number of segmentes, t is the training set size, as a percentage of the queries
+	# the configurations run in parallel on n_workers processes; fix the seed to reproduce a sweep
+	with instrumented_stage("probfuse_sweep", with_io=True):
+		prob_fuse_sweep(input_folder_path, output_folder_path, x_choices, t_choices, [True, False], n_workers=n_workers, seed=seed, n_repetitions=n_repetitions, out_precision=output_precision, out_compression=output_compression)
+	if instrumentation_report is not None:
+		write_instrumentation_report(instrumentation_report)
 
 	print()
 	print("ProbFuse2006 done! Output files are in '" + output_folder_path + "'")
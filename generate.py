@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# helper functions to keep code organized
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from lib.synthetic_lib import *
+
+def main():
+	# define folders used: the synthetic collection has its own, so the real one in input/ is never touched.
+	# to use it, point the other scripts at these paths (e.g. make_pipeline_config(runs_folder="input/synthetic/ten_models", ...))
+	input_folder_path = "input/synthetic/ten_models"
+	qrels_path = "input/synthetic/qrels.txt"
+	param_file = "input/synthetic/Xtparams.txt"
+	# set to True to replace a collection already written in these paths
+	overwrite = False
+	# ".gz", ".bz2" or ".xz" to write the runs compressed (e.g. model1.res.gz), None for plain text
+	compression = None
+	# how many processes write the runs
+	n_workers = os.cpu_count()
+
+	# the shape of the collection (see lib/synthetic_lib.py)
+	collection = make_synthetic_collection(
+		n_runs = 10,
+		n_topics = 50,
+		first_topic = 351,
+		depth = 1000,
+		min_depth = None,				# e.g. 200 to draw the depth of each run and topic between 200 and depth
+		pool_size = 4000,				# documents of each topic: the overlap between the runs grows with depth/pool_size
+		relevance_density = 0.02,		# fraction of the pool of each topic that is relevant
+		judged_depth = 100,				# documents of each run judged in the qrels
+		score_distribution = "normal",	# "normal", "exponential" or "uniform"
+		min_quality = 0.8,				# the boost of the relevant documents in the ranking of a run, drawn in this range
+		max_quality = 2.0,
+		run_correlation = 0.7,			# how much of the ranking noise the runs share
+		seed = 0,
+	)
+	x_choices = [2, 25, 150]
+	t_choices = [.5, .2]
+
+	# nothing is written until every path has been checked
+	if not overwrite:
+		if os.path.isdir(input_folder_path) and len(os.listdir(input_folder_path)) > 0:
+			raise Exception(input_folder_path+" is not empty: set overwrite = True in generate.py to replace its runs")
+		for path in [qrels_path, param_file]:
+			if os.path.exists(path):
+				raise Exception(path+" already exists: set overwrite = True in generate.py to replace it")
+	if os.path.isdir(input_folder_path):
+		# every run folder is read by the other scripts: the old runs must go, not only the ones written again
+		shutil.rmtree(input_folder_path)
+
+	run_paths = [input_folder_path+"/run"+str(run)+"/model"+str(run)+".res"+(compression or "") for run in range(1, collection["n_runs"]+1)]
+	print("Writing "+str(len(run_paths))+" runs of "+str(len(collection["topics"]))+" topics in "+input_folder_path+"...")
+	with ProcessPoolExecutor(max_workers=n_workers) as executor:
+		futures = [executor.submit(write_synthetic_run, collection, run+1, path) for run, path in enumerate(run_paths)]
+		for future in futures:
+			future.result()
+
+	print("Writing the qrels in "+qrels_path+"...")
+	write_synthetic_qrels(collection, qrels_path)
+	write_xt_params(param_file, x_choices, t_choices)
+
+	print("Synthetic collection done!")
+
+if __name__ == '__main__':
+   main()
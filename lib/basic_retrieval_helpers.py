@@ -8,12 +8,39 @@ import sys
 import shutil
 import statistics
 import datetime
-
-
-# check that the input folder exists
-def check_folders_exist(path, prefix="run", run_number=10):
+import heapq
+import numpy as np
+from itertools import chain
+from lib.doc_ids_lib import *
+from lib.tokenizer_lib import parse_run_columns, group_lines_by_topic, get_topic_score_range_dict
+from lib.instrumentation_lib import instrumented, add_counters
+from lib.run_writer_lib import *
+from lib.compression_lib import has_extension, open_text_file
+from lib.normalization_lib import *
+
+# number of documents kept for each topic of a fused run, to make it comparable
+# with the original runs (each of 1000 entries)
+default_run_depth = 1000
+
+
+# return the sorted numbers of the run folders in path, named prefix+number (e.g. run1, run2, ..., run120)
+def get_run_numbers(path, prefix="run"):
+	numbers = []
+	for f in os.listdir(path):
+		if f.startswith(prefix) and f[len(prefix):].isdigit() and os.path.isdir(path+"/"+f):
+			numbers.append(int(f[len(prefix):]))
+	return sorted(numbers)
+
+# check that the input folder exists, with the folders of the runs in it:
+# exactly prefix1 ... prefix<run_number> if run_number is given, otherwise at least one
+def check_folders_exist(path, prefix="run", run_number=None):
 	if not os.path.isdir(path):
-		raise Exception("We expect a folder "+path+" which contains the 10 folders with the runs.")
+		raise Exception("We expect a folder "+path+" which contains the folders with the runs ("+prefix+"1, "+prefix+"2, ...).")
+
+	if run_number is None:
+		if len(get_run_numbers(path, prefix)) == 0:
+			raise Exception("No run folder found in "+path+": the runs should be in "+prefix+"1, "+prefix+"2, ...")
+		return
 
 	for i in range(1,run_number+1):
 		if not os.path.isdir(path+"/"+prefix+str(i)):
@@ -23,99 +50,76 @@ def check_relevances_exist(path):
 	if not os.path.exists(path):
 		raise Exception("Expecting a folder which has the evaluations. Check README for info.")
 
-# return a list with the paths of the ten .res files
-def get_res_files(path, prefix="run", run_number=10, ends_with=".res"):
+# return a list with the paths of the .res files of the runs, in order of run number:
+# those of the run folders prefix1 ... prefix<run_number>, or of every run folder if run_number is None
+def get_res_files(path, prefix="run", run_number=None, ends_with=".res"):
 	res_files = []
-	for i in range(1,run_number+1):
-		file_list = [f for f in os.listdir(path+"/"+prefix+str(i)) if f.endswith(ends_with)]
+	run_numbers = get_run_numbers(path, prefix) if run_number is None else range(1,run_number+1)
+	for i in run_numbers:
+		# compressed runs too, e.g. BM25.res.gz (see compression_lib)
+		file_list = [f for f in os.listdir(path+"/"+prefix+str(i)) if has_extension(f, ends_with)]
 		#if len(file_list) != 1:
 		#	raise Exception('There should be only one .res file in each run directory')
 		for f in file_list:
 			res_files.append( path+"/"+prefix+str(i)+"/"+f )
 	return res_files
 
+# the name of the run of a .res file: the number of its run folder (e.g. "3" for input/ten_models/run3/BM25.res)
+def get_run_name(path_to_file, prefix="run"):
+	folder = os.path.basename(os.path.dirname(os.path.abspath(path_to_file)))
+	if folder.startswith(prefix):
+		return folder[len(prefix):]
+	return folder
+
 def get_res_files_in_folder(folder, ends_with=".txt"):
 	res_files = []
-	file_list = [f for f in os.listdir(folder+"/") if f.endswith(ends_with)]
+	file_list = [f for f in os.listdir(folder+"/") if has_extension(f, ends_with)]
 	file_list = [folder+"/"+f for f in file_list]
 	return file_list
 
 
 # return a dict with a key for each topic which contains a list with doc_id and scores
-def parse_res_file(path_to_file):
-	buckets = {} # a dict of lists
-	with open(path_to_file) as fp:
-		for line in fp:
-			line = line.strip() # split the words ignoring whitespaces
-			# a line contains: topic_id Q0 doc_id rank score model
-			elements = line.split()
-			topic_id 	= elements[0]
-			q0 			= elements[1]
-			doc_id 		= elements[2]
-			rank 		= int(elements[3]) # note: rank starts from 0
-			score 		= float(elements[4]) # python floats are double
-			model 		= elements[5]
-
-			extracted_tuple = (doc_id, score)
+# (the file is split in columns at once, see tokenizer_lib.parse_run_columns)
+# with_score_ranges=True also returns a dict {topic_id: (min score, max score)}, found in the same pass
+@instrumented()
+def parse_res_file(path_to_file, with_score_ranges=False):
+	# a line contains: topic_id Q0 doc_id rank score model
+	columns = parse_run_columns(path_to_file, number_docs=False)
+	doc_names = columns["doc_names"]
+	scores = columns["scores"]
 
-			if len(elements) != 6:
-				raise Exception("Found a line in '"+path_to_file+"' with "+str(len(elements))+" elements, 6 expected: "+line )
+	buckets = {} # a dict of lists
+	for topic_id, lines in zip(columns["topic_ids"].tolist(), group_lines_by_topic(columns["topics"], len(columns["topic_ids"]))):
+		buckets[topic_id] = list(zip([doc_names[line] for line in lines.tolist()], scores[lines].tolist()))
 
-			if topic_id in buckets:
-				buckets[topic_id].append( extracted_tuple )
-			else:
-				buckets[topic_id] = [ extracted_tuple ]
+	n_lines = len(doc_names)
+	add_counters(lines=n_lines, docs=n_lines, files_opened=1, bytes_read=os.path.getsize(path_to_file))
+	if with_score_ranges:
+		return buckets, get_topic_score_range_dict(columns["topic_ids"], columns["topic_min"], columns["topic_max"])
 	return buckets
 
 # normalize given scores in 'topic_tuples' which is a list of tuples
 # return the same tuples with the new normalized score
-# normalization_method can be 'min_max' (default) or 'max'
-def normalize_scores(topic_tuples, normalization_method = "min_max"):
-	normalization_methods = ['max', 'min_max']
-	new_tuples = []
-
+# normalization_method can be 'min_max' (default), 'max', 'sum', 'z_score' or 'rank' (see normalization_lib)
+# score_range: the (min, max) of the scores if they're known already (e.g. topic_min and topic_max of
+# tokenizer_lib.parse_run_columns), so that they're not searched again
+# constant_scores: what to do if the scores can't be normalized (e.g. all equal): "fill" or "error" (see normalization_lib)
+def normalize_scores(topic_tuples, normalization_method = "min_max", score_range = None, constant_scores = "fill"):
 	score_position_in_tuple = 1 # we expect the score to be in the second position in the tuple
 	assert(len(topic_tuples) > 0)
-	assert(normalization_method in normalization_methods)
-
-	# init min and max with first score value
-	score_min = topic_tuples[0][score_position_in_tuple]
-	score_max = topic_tuples[0][score_position_in_tuple]
-
-	# let's find the min and max score
-	for tup in topic_tuples:
-		# update max value found
-		if tup[score_position_in_tuple] > score_max:
-			score_max = tup[score_position_in_tuple]
-		# update min value found
-		if tup[score_position_in_tuple] < score_min:
-			score_min = tup[score_position_in_tuple]
 
-	assert(score_max >= score_min)
+	scores = np.fromiter((float(tup[score_position_in_tuple]) for tup in topic_tuples), dtype=np.float64, count=len(topic_tuples))
+	new_scores = normalize_score_array(scores, normalization_method, score_range, constant_scores).tolist()
 
-	# if the normalization method is max it means we assume the minimum score is zero
-	# max normalization
-	if normalization_method == normalization_methods[0]:
-		score_min = 0.0
-	# otherwise we use score_min and score_max as we did
-
-	# to be sure we are not using integers
-	score_max = float(score_max)
-	score_min = float(score_min)
-
-	# calculate the new scores
-	for tup in topic_tuples:
-		tup_current = list(tup) # maybe not the most efficient way
-		tup_current[score_position_in_tuple] = normalize_score(tup_current[score_position_in_tuple], score_max, score_min)
-		# print("new score: ", tup_current[score_position_in_tuple], " old_score: ", tup[score_position_in_tuple])
-		new_tuples.append( tuple(tup_current) )
-
-	return new_tuples
+	# the same tuples, with the new score in place of the old one
+	return [tuple(tup[:score_position_in_tuple]) + (new_score,) + tuple(tup[score_position_in_tuple+1:]) for tup, new_score in zip(topic_tuples, new_scores)]
 
 
 # normalize score given following the paper Lee95 formula for min_max normalization
 # to achieve max normalization set score_min to zero
 def normalize_score(score, score_max, score_min):
+	if score_max == score_min:
+		raise Exception("Cannot normalize a score with max == min ("+str(score_max)+"): see normalization_lib for the constant scores")
 	return float(score - score_min) / float(score_max - score_min)
 
 
@@ -168,20 +172,328 @@ def parse_aggregated_topic(path_to_file):
 	return bucket
 
 
+# same as parse_res_file, but the doc ids are interned (see doc_ids_lib) and each topic is a couple of arrays
+#
+# RETURNS: a dict {topic_id: (doc_ids, scores)}, doc_ids a numpy int32 array and scores a float64 one, in file order
+# (and the score ranges, with_score_ranges=True, as parse_res_file)
+@instrumented()
+def parse_res_file_interned(path_to_file, with_score_ranges=False):
+	columns = parse_run_columns(path_to_file, number_docs=False)
+	doc_ids = intern_doc_ids(columns["doc_names"])
+	scores = columns["scores"]
+
+	buckets = {}
+	for topic_id, lines in zip(columns["topic_ids"].tolist(), group_lines_by_topic(columns["topics"], len(columns["topic_ids"]))):
+		buckets[topic_id] = (doc_ids[lines], scores[lines])
+
+	n_lines = len(doc_ids)
+	add_counters(lines=n_lines, docs=n_lines, files_opened=1, bytes_read=os.path.getsize(path_to_file))
+	if with_score_ranges:
+		return buckets, get_topic_score_range_dict(columns["topic_ids"], columns["topic_min"], columns["topic_max"])
+	return buckets
+
+
+# same as normalize_scores, on a numpy array of scores (the scores of a single topic: to normalize
+# all the topics of a run at once, see normalization_lib.normalize_run_topics)
+def normalize_score_array(scores, normalization_method = "min_max", score_range = None, constant_scores = "fill"):
+	assert(len(scores) > 0)
+	score_ranges = None if score_range is None else ([score_range[0]], [score_range[1]])
+	return normalize_segments(scores, [0], normalization_method, constant_scores, score_ranges)
+
+
+# turn the entries of a topic, coming from many runs, into a docs x runs matrix:
+# the same matrix build_score_matrix gives for the dict {doc_id: [scores]} of those entries.
+#
+# doc_ids, scores: the entries of all the runs, concatenated in the order of the runs
+#
+# RETURNS: the doc ids (one per row, in order of first appearance) and the matrix
+def build_interned_score_matrix(doc_ids, scores):
+	row_doc_ids, rows = group_by_first_appearance(doc_ids)
+
+	# an entry goes in the first free column of its row, like appending it to the list of the doc
+	columns, counts = get_positions_in_groups(rows, len(row_doc_ids))
+
+	n_columns = int(counts.max()) if len(counts) > 0 else 0
+	matrix = np.full( (len(row_doc_ids), n_columns), np.nan )
+	matrix[rows, columns] = scores
+
+	return row_doc_ids, matrix
+
+
+# yield a triple (topic_id, doc_ids, matrix) for each topic, sorted by topic_id: every run is read,
+# its scores are normalized topic by topic and aggregated in the score matrix of the topic
+# (see build_interned_score_matrix), the docs of the matrix rows are in doc_ids (interned).
+# parser is the function used to read a run (e.g. run_cache_lib.parse_res_file_cached_interned), called as
+# parser(filepath, with_score_ranges=True): the score ranges of the topics are not searched again to normalize them.
+# if spill_folder is given, the normalized entries are spilled to spill_folder/<topic>.txt
+# and read back one topic at a time: slower, but useful when the runs don't fit in memory.
+# all the topics of a run are normalized at once (see normalization_lib), constant_scores is the same of normalize_scores.
+def iterate_topic_score_matrices(run_files, normalization_method="min_max", spill_folder=None, parser=parse_res_file_interned, constant_scores="fill"):
+	if spill_folder is None:
+		entries = {}
+		for filepath in run_files:
+			run, score_ranges = parser(filepath, with_score_ranges=True)
+			topics_docs_scores = normalize_run_topics(run, normalization_method, constant_scores, score_ranges)
+
+			for topic_id in topics_docs_scores:
+				doc_ids, scores = topics_docs_scores[topic_id]
+				if not topic_id in entries:
+					entries[topic_id] = []
+				entries[topic_id].append( (doc_ids, scores) )
+
+		for topic_id in sorted(entries, key=topic_sort_key):
+			doc_ids = np.concatenate([e[0] for e in entries[topic_id]])
+			scores = np.concatenate([e[1] for e in entries[topic_id]])
+			row_doc_ids, matrix = build_interned_score_matrix(doc_ids, scores)
+			yield topic_id, row_doc_ids, matrix
+		return
+
+	clean_tmp_files(spill_folder)
+
+	tempfilepaths = []
+	for filepath in run_files:
+		run, score_ranges = parser(filepath, with_score_ranges=True)
+		topics_docs_scores = normalize_run_topics(run, normalization_method, constant_scores, score_ranges)
+
+		for topic_id in topics_docs_scores:
+			doc_ids, scores = topics_docs_scores[topic_id]
+			topic_tuples = zip(get_doc_names(doc_ids), scores.tolist())
+			tempfilepaths.append( (topic_id, append_entries_to_file_by_topic(topic_id, topic_tuples, spill_folder)) )
+
+	tempfilepaths = sorted(set(tempfilepaths), key=lambda t: topic_sort_key(t[0])) # remove duplicates from list
+
+	for topic_id, topic_file in tempfilepaths:
+		doc_names, matrix = build_score_matrix(parse_aggregated_topic(topic_file))
+		yield topic_id, intern_doc_ids(doc_names), matrix
+
+
+# the order of the topics in the fused runs: numeric topic ids by their value (e.g. 99 before 100),
+# then the other ones alphabetically
+def topic_sort_key(topic_id):
+	if topic_id.isdigit():
+		return (0, int(topic_id), topic_id)
+	return (1, 0, topic_id)
+
+
+# yield the topics of a run one at a time, in file order: a triple (topic_id, doc names, scores) for each topic,
+# the doc names in rank order and the scores in a numpy array. only one topic is in memory at any time.
+# TREC runs are grouped by topic: a topic found again after other topics is an error.
+def iterate_res_file_topic_blocks(path_to_file):
+	seen_topics = set()
+	topic_id = None
+	doc_names = []
+	scores = []
+	# a generator can't be a stage: its lines are counted (a topic at a time) in the stages that consume it
+	add_counters(files_opened=1, bytes_read=os.path.getsize(path_to_file))
+	with open_text_file(path_to_file) as fp:
+		for line in fp:
+			# a line contains: topic_id Q0 doc_id rank score model
+			elements = line.split()
+			if len(elements) != 6:
+				raise Exception("Found a line in '"+path_to_file+"' with "+str(len(elements))+" elements, 6 expected: "+line.strip() )
+
+			if elements[0] != topic_id:
+				if topic_id is not None:
+					add_counters(lines=len(doc_names))
+					yield topic_id, doc_names, np.array(scores, dtype=np.float64)
+				if elements[0] in seen_topics:
+					raise Exception("The run '"+path_to_file+"' is not grouped by topic: topic "+elements[0]+" is found again after other topics")
+				topic_id = elements[0]
+				seen_topics.add(topic_id)
+				doc_names = []
+				scores = []
+
+			doc_names.append(elements[2])
+			scores.append(float(elements[4]))
+
+	if topic_id is not None:
+		add_counters(lines=len(doc_names))
+		yield topic_id, doc_names, np.array(scores, dtype=np.float64)
+
+
+# read the next topic of a run (see iterate_merged_topic_blocks) and push it in the heap of the merge
+def push_next_topic_block(heap, readers, position, run_files, previous_key=None):
+	block = next(readers[position], None)
+	if block is None:
+		return
+	key = topic_sort_key(block[0])
+	if previous_key is not None and key <= previous_key:
+		raise Exception("The topics of '"+run_files[position]+"' are not sorted: topic "+block[0]+" comes after topic "+previous_key[2])
+	heapq.heappush(heap, (key, position, block))
+
+
+# k-way merge of the topics of many runs: the runs are read in lock-step, one topic at a time, and each topic
+# is yielded as soon as every run has been read past it. only one topic of each run is in memory at any time,
+# no matter how large the runs are.
+# each run must list its topics in the order of topic_sort_key, as TREC runs do.
+#
+# RETURNS: a generator of couples (topic_id, blocks), in the order of topic_sort_key, where blocks is the list of
+# (position of the run in run_files, doc names, scores) of the runs that have retrieved the topic, in the order of run_files
+def iterate_merged_topic_blocks(run_files, block_reader=iterate_res_file_topic_blocks):
+	readers = [block_reader(path) for path in run_files]
+	heap = []
+	for position in range(len(readers)):
+		push_next_topic_block(heap, readers, position, run_files)
+
+	while len(heap) > 0:
+		key = heap[0][0]
+		blocks = []
+		# the blocks of the same topic come out of the heap in order of position
+		while len(heap) > 0 and heap[0][0] == key:
+			_, position, block = heapq.heappop(heap)
+			blocks.append( (position, block[1], block[2]) )
+
+		yield key[2], blocks
+
+		for position, doc_names, scores in blocks:
+			push_next_topic_block(heap, readers, position, run_files, key)
+
+
+# same as iterate_topic_score_matrices, but streaming: the runs are merged topic by topic (see iterate_merged_topic_blocks),
+# so the memory holds one topic of each run, whatever the size of the collection.
+# the doc ids are not interned (the table would end up keeping every doc name of the collection): the docs of the
+# matrix rows are a numpy array of doc names, to be written with format_ranking_as_trec_run(..., interned=False).
+def iterate_streamed_topic_score_matrices(run_files, normalization_method="min_max", constant_scores="fill"):
+	for topic_id, blocks in iterate_merged_topic_blocks(run_files):
+		doc_names = np.array(list(chain.from_iterable(block[1] for block in blocks)))
+		# each run has a block of the topic: they're all normalized at once, each one on its own scores
+		starts = np.cumsum([0] + [len(block[2]) for block in blocks[:-1]])
+		scores = normalize_segments(np.concatenate([block[2] for block in blocks]), starts, normalization_method, constant_scores)
+		row_doc_names, matrix = build_interned_score_matrix(doc_names, scores)
+		yield topic_id, row_doc_names, matrix
+
+
 # apply the passed function to the dict of doc_id => list of scores
-def apply_comb_to_aggregated_docs_scores(docs_scores_aggregated, comb_technique):
+# only the best 'depth' documents are kept
+@instrumented()
+def apply_comb_to_aggregated_docs_scores(docs_scores_aggregated, comb_technique, depth=default_run_depth):
 	new_run = []
 	new_score_position_in_tuple = 1
+	add_counters(docs=len(docs_scores_aggregated))
 	for doc_id, scores in docs_scores_aggregated.items():
 		new_score = float( comb_technique(scores) )
 		new_tuple = ( doc_id, new_score, comb_technique.__name__  )
 		new_run.append(new_tuple)
 
-	new_run.sort( key=lambda x: float(x[new_score_position_in_tuple]), reverse=True)
-
-	# we truncate the new_run to the top 1000 documents retrieved in order
-	# to make it comparable with the original runs (each of 1000 entries)
-	return new_run[:1000]
+	# we truncate the new_run to the top 'depth' documents retrieved in order
+	# to make it comparable with the original runs (each of 1000 entries).
+	# nlargest gives the same result of a full (stable) sort, without sorting everything
+	return heapq.nlargest(depth, new_run, key=lambda x: float(x[new_score_position_in_tuple]))
+
+
+# return the indices of the 'k' highest scores, sorted by decreasing score.
+# argpartition finds the k-th best score in linear time and only the documents scoring at least
+# as much are sorted; ties are broken by position (lower index first), as a stable sort would do.
+def top_k_indices(scores, k):
+	n = len(scores)
+	if k <= 0:
+		return np.zeros(0, dtype=np.int64)
+	if k >= n:
+		return np.argsort(-scores, kind="stable")
+
+	negated = -scores
+	threshold = negated[ np.argpartition(negated, k-1)[k-1] ]
+	# every document with a score equal to the threshold survives, so that ties are resolved below
+	survivors = np.flatnonzero(negated <= threshold)
+	order = np.argsort(negated[survivors], kind="stable")[:k]
+	return survivors[order]
+
+
+# names of the comb techniques computed together by apply_all_combs_to_aggregated_docs_scores
+comb_technique_names = ["combMNZ", "combSUM", "combMAX", "combMIN", "combANZ", "combMED"]
+
+# turn the dict {doc_id: [scores]} of a topic into a docs x runs matrix.
+# a document that hasn't been retrieved by every run has fewer scores than the number of columns:
+# those missing entries are NaN, so that they can't be confused with a real score of zero.
+#
+# RETURNS: the list of doc_ids (one per row) and the matrix
+def build_score_matrix(docs_scores_aggregated):
+	doc_ids = list(docs_scores_aggregated)
+	scores_lists = list(docs_scores_aggregated.values())
+
+	lengths = np.fromiter(map(len, scores_lists), dtype=np.int64, count=len(scores_lists))
+	n_columns = int(lengths.max()) if len(lengths) > 0 else 0
+	flat_scores = np.fromiter(chain.from_iterable(scores_lists), dtype=np.float64, count=int(lengths.sum()))
+
+	matrix = np.full( (len(doc_ids), n_columns), np.nan )
+	# boolean mask of the real entries; filling it row by row keeps the order of each list
+	matrix[ np.arange(n_columns) < lengths[:, None] ] = flat_scores
+
+	return doc_ids, matrix
+
+
+# compute all the six comb techniques on the score matrix of a topic in a single pass.
+# the results are the same of combMNZ, combSUM, combMAX, combMIN, combANZ and combMED applied to each doc:
+# missing entries are simply ignored, as they are not in the lists of parse_aggregated_topic.
+#
+# RETURNS: a dict {comb_technique_name: array of the new scores, one per row}
+def comb_score_matrix(matrix):
+	present = ~np.isnan(matrix)
+	n_present = present.sum(axis=1)
+	filled = np.where(present, matrix, 0.0)
+
+	# summing column by column gives exactly the same floats of sum() on the lists
+	score_sum = np.zeros(matrix.shape[0])
+	for column in filled.T:
+		score_sum += column
+
+	number_of_non_zero_occurrences = np.count_nonzero(filled != 0.0, axis=1)
+
+	# NaNs are sorted at the end of each row, so the median is taken within the first n_present entries
+	sorted_matrix = np.sort(matrix, axis=1)
+	rows = np.arange(matrix.shape[0])
+	low = sorted_matrix[rows, (n_present - 1) // 2]
+	high = sorted_matrix[rows, n_present // 2]
+
+	score_anz = np.zeros(matrix.shape[0])
+	np.divide(score_sum, number_of_non_zero_occurrences, out=score_anz, where=number_of_non_zero_occurrences != 0)
+
+	return {
+		"combMNZ": score_sum * number_of_non_zero_occurrences,
+		"combSUM": score_sum,
+		"combMAX": np.nanmax(matrix, axis=1),
+		"combMIN": np.nanmin(matrix, axis=1),
+		"combANZ": score_anz,
+		"combMED": (low + high) / 2.0,
+	}
+
+
+# vectorized alternative to calling apply_comb_to_aggregated_docs_scores once per technique:
+# builds the score matrix of the topic once and computes the six comb techniques on it.
+# only the best 'depth' documents of each technique are kept.
+#
+# RETURNS: a dict {comb_technique_name: new_run}, each new_run is the same list of tuples
+# (doc_id, new_score, comb_technique_name) returned by apply_comb_to_aggregated_docs_scores
+def apply_all_combs_to_aggregated_docs_scores(docs_scores_aggregated, depth=default_run_depth):
+	doc_ids, matrix = build_score_matrix(docs_scores_aggregated)
+	new_scores = comb_score_matrix(matrix)
+
+	new_runs = {}
+	for comb_technique_name in comb_technique_names:
+		scores = new_scores[comb_technique_name]
+		# only the top 'depth' documents are selected and sorted; documents with the same score
+		# stay in insertion order, like list.sort() does
+		ranking = top_k_indices(scores, depth)
+		new_runs[comb_technique_name] = [ (doc_ids[i], float(scores[i]), comb_technique_name) for i in ranking ]
+
+	return new_runs
+
+
+# same as apply_all_combs_to_aggregated_docs_scores, on the score matrix of a topic (see iterate_topic_score_matrices)
+#
+# RETURNS: a dict {comb_technique_name: (doc_ids, scores)}, the best 'depth' documents sorted by decreasing score
+@instrumented()
+def apply_all_combs_to_score_matrix(doc_ids, matrix, depth=default_run_depth):
+	add_counters(docs=len(doc_ids))
+	new_scores = comb_score_matrix(matrix)
+
+	new_runs = {}
+	for comb_technique_name in comb_technique_names:
+		scores = new_scores[comb_technique_name]
+		ranking = top_k_indices(scores, depth)
+		new_runs[comb_technique_name] = (doc_ids[ranking], scores[ranking])
+
+	return new_runs
 
 
 # add needed fields to the tuples of doc_id and scores to be saved in a res file
@@ -197,15 +509,36 @@ def format_as_trec_run(run, topic_id):
 		formatted_run.append(formatted_row)
 	return formatted_run
 
-# append run to res file
+# same as format_as_trec_run, for a run made of the arrays (doc_ids, scores) of apply_all_combs_to_score_matrix:
+# here the interned doc ids are turned back into their names (interned=False if doc_ids are the names already)
+def format_ranking_as_trec_run(ranking, topic_id, model_name, interned=True):
+	doc_ids, scores = ranking
+	doc_names = get_doc_names(doc_ids) if interned else doc_ids.tolist()
+	run = [ (doc_name, score, model_name) for doc_name, score in zip(doc_names, scores.tolist()) ]
+	return format_as_trec_run(run, topic_id)
+
+# writes a ranking (doc_ids, scores) of apply_all_combs_to_score_matrix as topic topic_id of a run being written
+# (a TrecRunWriter, see run_writer_lib), without building its tuples: interned=False if doc_ids are the names already
+def write_ranking_to_run(writer, ranking, topic_id, interned=True):
+	doc_ids, scores = ranking
+	doc_names = get_doc_names(doc_ids) if interned else doc_ids.tolist()
+	writer.write_topic(topic_id, doc_names, scores)
+
+# append run to res file (it's opened again for every call: to write many topics, see run_writer_lib.open_run_writers)
+@instrumented()
 def append_run_to_res_file(output_folder, comb_technique, formatted_run):
 	output_file = output_folder + comb_technique + ".res"
 
+	lines = []
+	for tup in formatted_run:
+		line = " ".join(str(x) for x in tup)
+		lines.append(line.strip() + "\n")
+	text = "".join(lines)
+
 	# append to file
 	with open(output_file, "a") as myfile:
-		for tup in formatted_run:
-			line = " ".join(str(x) for x in tup)
-			myfile.write(line.strip() + "\n")
+		myfile.write(text)
+	add_counters(lines=len(lines), files_opened=1, bytes_written=len(text))
 
 
 # create an ad hoc folder to store results without overwriting existing ones
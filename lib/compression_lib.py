@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# transparent compression of the files we read and write: runs, qrels, pre-processed runs and fused runs.
+#
+# the codec of a file comes from its extension: ".gz" (gzip), ".bz2" (bzip2) and ".xz" (lzma), the standard
+# library ones; any other file is plain text. a compressed file keeps the extension of its content before
+# the one of the codec, e.g. BM25.res.gz or qrels.trec7.txt.xz (see has_extension).
+#
+# a compressed file is read through a thread that decompresses it one chunk at a time, a few chunks ahead of the
+# reader: the codecs release the GIL while they decompress, so decompressing the next chunk overlaps with parsing
+# the last one. only those few chunks are in memory, not the whole decompressed file.
+# a compressed file is written through the codec as it is, in the blocks the writer passes it.
+
+import io
+import os
+import bz2
+import gzip
+import lzma
+import queue
+import shutil
+import tempfile
+import threading
+import contextlib
+
+# {extension: the module of its codec}
+compression_codecs = {".gz": gzip, ".bz2": bz2, ".xz": lzma}
+# the options of each codec when it writes: gzip and bzip2 compress at level 9 by default, slow for large runs
+compression_write_options = {".gz": {"compresslevel": 6}, ".bz2": {"compresslevel": 6}, ".xz": {"preset": 6}}
+# bytes decompressed at a time, and how many of these chunks can wait for the reader
+default_chunk_size = 1 << 22
+default_chunks_ahead = 4
+
+
+# RETURNS: the extension of the codec of path (".gz", ".bz2" or ".xz"), or None for a plain file
+def get_compression(path):
+	for extension in compression_codecs:
+		if path.endswith(extension):
+			return extension
+	return None
+
+
+# RETURNS: path without the extension of its codec, e.g. "BM25.res" for "BM25.res.gz"
+def strip_compression_extension(path):
+	compression = get_compression(path)
+	return path if compression is None else path[:-len(compression)]
+
+
+# RETURNS: True if path ends with extension, compressed or not: has_extension("BM25.res.gz", ".res") is True
+def has_extension(path, extension):
+	return strip_compression_extension(path).endswith(extension)
+
+
+# yields the decompressed content of a compressed file, in chunks of at most chunk_size bytes.
+# the chunks are decompressed by another thread, at most chunks_ahead of them before the one being consumed;
+# the thread stops as soon as the chunks are not wanted anymore (the generator is closed, or garbage collected)
+def iterate_decompressed_chunks(path, chunk_size=default_chunk_size, chunks_ahead=default_chunks_ahead):
+	codec = compression_codecs[get_compression(path)]
+	chunks = queue.Queue(maxsize=chunks_ahead)
+	stop = threading.Event()
+
+	def put(item):
+		while not stop.is_set():
+			try:
+				chunks.put(item, timeout=0.1)
+				return
+			except queue.Full:
+				pass
+
+	def decompress():
+		try:
+			with codec.open(path, "rb") as fp:
+				while not stop.is_set():
+					chunk = fp.read(chunk_size)
+					put(chunk)
+					# an empty chunk is the end of the file
+					if len(chunk) == 0:
+						return
+		except Exception as e:
+			put(e)
+
+	thread = threading.Thread(target=decompress, name="decompress "+path, daemon=True)
+	thread.start()
+	try:
+		while True:
+			chunk = chunks.get()
+			if isinstance(chunk, Exception):
+				raise Exception("Can't decompress '"+path+"': "+str(chunk))
+			if len(chunk) == 0:
+				return
+			yield chunk
+	finally:
+		stop.set()
+		thread.join()
+
+
+# yields the content of a file, plain or compressed, in chunks that end with a newline (but for the last one,
+# if the file doesn't end with a newline): a chunk holds whole lines only
+def iterate_line_chunks(path, chunk_size=default_chunk_size):
+	fp = None
+	if get_compression(path) is None:
+		fp = open(path, "rb")
+		chunks = iter(lambda: fp.read(chunk_size), b"")
+	else:
+		chunks = iterate_decompressed_chunks(path, chunk_size)
+
+	try:
+		rest = b""
+		for chunk in chunks:
+			end = chunk.rfind(b"\n")
+			if end < 0:
+				rest += chunk
+				continue
+			yield rest + chunk[:end+1]
+			rest = chunk[end+1:]
+		if len(rest) > 0:
+			yield rest
+	finally:
+		if fp is None:
+			chunks.close()
+		else:
+			fp.close()
+
+
+# a readable binary stream over iterate_decompressed_chunks, to read a compressed file like a plain one
+class DecompressedStream(io.RawIOBase):
+
+	def __init__(self, path, chunk_size=default_chunk_size):
+		self.chunks = iterate_decompressed_chunks(path, chunk_size)
+		self.chunk = b""
+		self.position = 0
+
+	def readable(self):
+		return True
+
+	def readinto(self, buffer):
+		while self.position >= len(self.chunk):
+			self.chunk = next(self.chunks, b"")
+			self.position = 0
+			if len(self.chunk) == 0:
+				return 0
+		n = min(len(buffer), len(self.chunk) - self.position)
+		buffer[:n] = self.chunk[self.position:self.position+n]
+		self.position += n
+		return n
+
+	def close(self):
+		if not self.closed:
+			self.chunks.close()
+		super().close()
+
+
+# opens a file in binary ("rb", "wb" or "ab"), compressed or not. the codec comes from the extension of name,
+# path itself by default (name is the final name of a file written under a temporary one, e.g. "x.res.gz.tmp")
+#
+# RETURNS: the file object
+def open_binary_file(path, mode="rb", buffering=-1, name=None):
+	compression = get_compression(path if name is None else name)
+	if compression is None:
+		return open(path, mode, buffering=buffering)
+
+	if "r" in mode:
+		return io.BufferedReader(DecompressedStream(path), buffer_size=default_chunk_size)
+	return compression_codecs[compression].open(path, mode, **compression_write_options[compression])
+
+
+# opens a file in text mode ("r", "w" or "a"), compressed or not, e.g. with open_text_file(path) as fp: for line in fp: ...
+#
+# RETURNS: the file object
+def open_text_file(path, mode="r"):
+	if get_compression(path) is None:
+		return open(path, mode)
+	return io.TextIOWrapper(open_binary_file(path, mode.replace("t", "")+"b"))
+
+
+# RETURNS: the whole (decompressed) content of a file, bytes
+def read_file_bytes(path):
+	if get_compression(path) is None:
+		with open(path, "rb") as fp:
+			return fp.read()
+	return b"".join(iterate_decompressed_chunks(path))
+
+
+# the path of a plain copy of a file, for the programs that can't read it compressed (e.g. trec_eval):
+#   with decompressed_path(run_file) as plain_run_file: ...
+# a plain file is given as it is; the copy of a compressed one is removed at the end
+@contextlib.contextmanager
+def decompressed_path(path):
+	if get_compression(path) is None:
+		yield path
+		return
+
+	fd, plain_path = tempfile.mkstemp(suffix="_"+os.path.basename(strip_compression_extension(path)))
+	try:
+		with os.fdopen(fd, "wb") as writer, open_binary_file(path) as reader:
+			shutil.copyfileobj(reader, writer, default_chunk_size)
+		yield plain_path
+	finally:
+		os.remove(plain_path)
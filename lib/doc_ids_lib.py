@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# the doc-id interning table shared by parsing, fusion and ProbFuse.
+#
+# every document name (e.g. "FBIS3-10082") gets a dense int32 id the first time it's read, so that
+# all the later stages work on integer arrays instead of hashing the same strings again and again;
+# the names are restored only when a TREC run is written (see get_doc_names).
+#
+# the table is global to the process: the ids of a process mean nothing in another one,
+# so they must never be written to disk or passed between processes.
+
+import numpy as np
+
+# {"ids": {doc_name: doc_id}, "names": [doc_name of id 0, of id 1, ...]}
+doc_id_table = {"ids": {}, "names": []}
+
+
+# RETURNS: the id of a document name, a new one if it has never been seen
+def intern_doc_id(doc_name):
+	ids = doc_id_table["ids"]
+	doc_id = ids.get(doc_name)
+	if doc_id is None:
+		doc_id = len(ids)
+		ids[doc_name] = doc_id
+		doc_id_table["names"].append(doc_name)
+	return doc_id
+
+
+# RETURNS: a numpy int32 array with the id of each document name of the list
+def intern_doc_ids(doc_names):
+	ids = doc_id_table["ids"]
+	names = doc_id_table["names"]
+
+	# most of the names are usually known already: look them all up at once, then add the new ones
+	doc_ids = list(map(ids.get, doc_names))
+	if None in doc_ids:
+		for i, doc_id in enumerate(doc_ids):
+			if doc_id is None:
+				doc_name = doc_names[i]
+				doc_id = ids.get(doc_name)
+				if doc_id is None:
+					doc_id = len(names)
+					ids[doc_name] = doc_id
+					names.append(doc_name)
+				doc_ids[i] = doc_id
+	return np.array(doc_ids, dtype=np.int32)
+
+
+def get_doc_name(doc_id):
+	return doc_id_table["names"][doc_id]
+
+
+# RETURNS: the list of the names of the ids in doc_ids (any iterable or numpy array of ids)
+def get_doc_names(doc_ids):
+	names = doc_id_table["names"]
+	if isinstance(doc_ids, np.ndarray):
+		doc_ids = doc_ids.tolist()
+	return [names[doc_id] for doc_id in doc_ids]
+
+
+# group the entries of doc_ids by document, numbering the documents in order of first appearance
+# (the same order in which they would be inserted in a dict).
+#
+# RETURNS: the ids of the documents, one per group, and for each entry the index of its group
+def group_by_first_appearance(doc_ids):
+	unique_ids, first, inverse = np.unique(doc_ids, return_index=True, return_inverse=True)
+	order = np.argsort(first, kind="stable")
+	group_of_unique = np.empty(len(order), dtype=np.int64)
+	group_of_unique[order] = np.arange(len(order))
+	return unique_ids[order], group_of_unique[inverse.reshape(-1)]
+
+
+# the position of each entry within its group, counting in order of appearance
+# (the index it would have if the entries were appended to a list per group).
+#
+# RETURNS: the position of each entry, and how many entries each of the n_groups groups has
+def get_positions_in_groups(groups, n_groups):
+	counts = np.bincount(groups, minlength=n_groups)
+	by_group = np.argsort(groups, kind="stable")
+	positions = np.empty(len(groups), dtype=np.int64)
+	positions[by_group] = np.arange(len(groups)) - np.repeat(np.cumsum(counts) - counts, counts)
+	return positions, counts
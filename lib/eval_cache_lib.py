@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# content addressed cache of the trec_eval outputs.
+#
+# an evaluation is identified by the sha1 of the run, the sha1 of the qrels and the version of the
+# evaluator: renaming or touching a run doesn't invalidate it, changing a single byte does.
+# the whole output of trec_eval (every measure) is stored once, in a json file named after the key,
+# so any later lookup of any measure of the same run is served from here.
+#
+# the cache is bounded: when its files exceed max_bytes the least recently used ones are deleted
+# (a cache hit refreshes the mtime of its file, which is used as the "last used" time).
+
+import os
+import json
+import hashlib
+import threading
+from lib.run_cache_lib import file_sha1
+
+default_eval_cache_folder = "output/cache/evals"
+default_eval_cache_max_bytes = 64 * 1024 * 1024
+
+# sha1 of the files already hashed by this process: {abs_path: ((size, mtime), sha1)}
+hashed_files = {}
+# the evaluations may run on many threads (see trec_eval_lib.evaluate_files_parallel)
+eval_cache_lock = threading.Lock()
+
+
+# sha1 of a file, computed again only if its size or mtime changed since the last call
+def get_memoized_sha1(path):
+	abs_path = os.path.abspath(path)
+	stat = os.stat(abs_path)
+	fingerprint = (stat.st_size, stat.st_mtime_ns)
+	with eval_cache_lock:
+		if abs_path in hashed_files and hashed_files[abs_path][0] == fingerprint:
+			return hashed_files[abs_path][1]
+
+	sha1 = file_sha1(abs_path)
+	with eval_cache_lock:
+		hashed_files[abs_path] = (fingerprint, sha1)
+	return sha1
+
+
+# the key of the evaluation of res_file against qrels_file made by evaluator_version
+def get_evaluation_key(res_file, qrels_file, evaluator_version):
+	key = get_memoized_sha1(res_file) + "_" + get_memoized_sha1(qrels_file) + "_" + evaluator_version
+	return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def get_evaluation_path(key, cache_folder=default_eval_cache_folder):
+	return cache_folder + "/" + key + ".json"
+
+
+# RETURNS: the cached trec_eval output for key, or None if it's not in the cache
+def load_cached_evaluation(key, cache_folder=default_eval_cache_folder):
+	path = get_evaluation_path(key, cache_folder)
+	try:
+		with open(path) as fp:
+			entry = json.load(fp)
+		# mark the entry as recently used
+		os.utime(path)
+	except (OSError, ValueError):
+		# missing, evicted meanwhile by another process or half written: evaluate again
+		return None
+	return entry["output"]
+
+
+# store the output of an evaluation, then evict the least recently used entries if needed
+def store_evaluation(key, output, cache_folder=default_eval_cache_folder, max_bytes=default_eval_cache_max_bytes, description=None):
+	os.makedirs(cache_folder, exist_ok=True)
+	entry = {"output": output}
+	if description is not None:
+		entry["description"] = description
+
+	# write then rename, so that a reader never finds a half written entry
+	path = get_evaluation_path(key, cache_folder)
+	tmp_path = path + "." + str(os.getpid()) + "_" + str(threading.get_ident()) + ".tmp"
+	with open(tmp_path, "w") as fp:
+		json.dump(entry, fp)
+	os.replace(tmp_path, path)
+
+	evict_evaluation_cache(cache_folder, max_bytes)
+
+
+# delete the least recently used entries until the cache takes at most max_bytes
+def evict_evaluation_cache(cache_folder=default_eval_cache_folder, max_bytes=default_eval_cache_max_bytes):
+	with eval_cache_lock:
+		entries = []
+		total_bytes = 0
+		for name in os.listdir(cache_folder):
+			if not name.endswith(".json"):
+				continue
+			try:
+				stat = os.stat(cache_folder + "/" + name)
+			except OSError:
+				continue
+			entries.append( (stat.st_mtime_ns, stat.st_size, name) )
+			total_bytes += stat.st_size
+
+		entries.sort()
+		for mtime, size, name in entries:
+			if total_bytes <= max_bytes:
+				break
+			try:
+				os.remove(cache_folder + "/" + name)
+			except OSError:
+				pass
+			total_bytes -= size
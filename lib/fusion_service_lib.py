@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# a long running ProbFuse service: it fuses, on the fly, the ranked lists that N retrieval systems
+# have returned for a single query (e.g. behind a metasearch engine).
+#
+# the model is trained offline (see prob_fuse_lib.ProbFuse) and loaded only once;
+# then every request is scored in memory, with the same segments of the batch ProbFuse.
+#
+#   POST /fuse    {"topic": "401", "k": 10, "runs": {"1": ["doc", "doc", ...], "2": [...], ...}}
+#                 -> {"topic": "401", "ranking": [["doc", score], ...], "took_ms": 1.2}
+#                 "topic" is optional and just echoed back, "k" defaults to the depth of the service
+#   GET /health   -> the runs, the number of segments and the algorithm of the model
+#
+# the service speaks a minimal HTTP/1.1 (keep-alive connections, bodies with a Content-Length)
+# over TCP or over a Unix socket; malformed requests get a 400 with {"error": "..."}.
+# a request line longer than max_line_bytes gets a 400, a longer header line or more than max_request_headers
+# headers a 431: then the connection is closed, as the rest of the request can't be told from the next one.
+
+import os
+import json
+import time
+import asyncio
+from lib.prob_fuse_lib import ProbFuse, score_ranked_lists
+
+# the model served by this process (see load_service_model)
+service_state = {}
+
+# bodies larger than this are refused, before reading them
+max_request_bytes = 64 * 1024 * 1024
+# the longest request line or header line (the limit of the stream readers), and the most headers of a request
+max_line_bytes = 64 * 1024
+max_request_headers = 100
+
+http_reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+	431: "Request Header Fields Too Large"}
+
+
+# loads the ProbFuse model saved in model_file (see ProbFuse.save) in service_state; the weights of the
+# segments of every run are computed here once, and the segments of each list length once over all the requests.
+# the runs of a request are named as in the model, e.g. "1" for the run of 1_preprocessed.npz.
+# depth: how many documents are returned when a request doesn't say it
+def load_service_model(model_file, depth=1000):
+	model = ProbFuse.load(model_file)
+	segment_weights = model.get_segment_weights()
+
+	service_state["n_segments"] = model.n_segments
+	service_state["judged"] = model.judged
+	service_state["topic_dim"] = model.topic_dim
+	service_state["segment_weights"] = {str(run_idx): segment_weights[run_idx] for run_idx in segment_weights}
+	service_state["rank_segments"] = {}
+	service_state["depth"] = depth
+
+
+# RETURNS: the ranked lists of a /fuse request, checked, as {run: [doc names]}
+def parse_ranked_lists(request):
+	runs = request.get("runs")
+	if not isinstance(runs, dict) or len(runs) == 0:
+		raise Exception("Expecting 'runs': an object with the ranked list of each run, like {\"1\": [\"doc\", ...]}")
+
+	# unknown runs are refused by score_ranked_lists
+	for run in runs:
+		if not isinstance(runs[run], list) or not all(isinstance(doc, str) for doc in runs[run]):
+			raise Exception("The ranked list of run '"+run+"' should be a list of doc names")
+	return runs
+
+
+# RETURNS: the response to a /fuse request, a dict
+def fuse_request(body):
+	start = time.perf_counter()
+	try:
+		request = json.loads(body)
+	except ValueError as e:
+		raise Exception("The body is not valid json: "+str(e))
+	if not isinstance(request, dict):
+		raise Exception("Expecting a json object, got: "+type(request).__name__)
+
+	k = request.get("k", service_state["depth"])
+	if not isinstance(k, int) or isinstance(k, bool) or k < 0:
+		raise Exception("'k' should be a non negative integer, got: "+str(k))
+
+	ranking = score_ranked_lists(service_state["segment_weights"], service_state["n_segments"], parse_ranked_lists(request),
+		k, service_state["topic_dim"], service_state["rank_segments"])
+
+	return {
+		"topic": request.get("topic"),
+		"ranking": ranking,
+		"took_ms": (time.perf_counter()-start)*1000,
+	}
+
+
+# RETURNS: the status and the (json) payload of the response to a request
+def handle_request(method, path, body):
+	if path == "/fuse":
+		if method != "POST":
+			return 405, {"error": "use POST for /fuse"}
+		try:
+			return 200, fuse_request(body)
+		except Exception as e:
+			return 400, {"error": str(e)}
+
+	if path == "/health":
+		if method != "GET":
+			return 405, {"error": "use GET for /health"}
+		return 200, {
+			"runs": sorted(service_state["segment_weights"]),
+			"n_segments": service_state["n_segments"],
+			"judged": service_state["judged"],
+		}
+
+	return 404, {"error": "unknown path "+path}
+
+
+def write_response(writer, status, payload, keep_alive):
+	body = json.dumps(payload).encode("utf-8")
+	head = "HTTP/1.1 "+str(status)+" "+http_reasons[status]+"\r\n"
+	head += "Content-Type: application/json\r\n"
+	head += "Content-Length: "+str(len(body))+"\r\n"
+	head += "Connection: "+("keep-alive" if keep_alive else "close")+"\r\n\r\n"
+	writer.write(head.encode("latin-1") + body)
+
+
+# RETURNS: the next line of the request (bytes, b"" at the end of the stream), or None if it exceeds the limit of the reader
+async def read_request_line(reader):
+	try:
+		return await reader.readline()
+	except (ValueError, asyncio.LimitOverrunError):
+		# readline turns the LimitOverrunError of a line longer than the limit into a ValueError
+		return None
+
+
+# serves the requests of a connection, one after the other, until the client closes it
+async def handle_connection(reader, writer):
+	try:
+		while True:
+			request_line = await read_request_line(reader)
+			if request_line is None:
+				write_response(writer, 400, {"error": "the request line exceeds "+str(max_line_bytes)+" bytes"}, False)
+				break
+			if not request_line:
+				break
+			parts = request_line.decode("latin-1").split()
+			if len(parts) != 3:
+				write_response(writer, 400, {"error": "malformed request line"}, False)
+				break
+			method, target, version = parts
+
+			headers = {}
+			n_headers = 0
+			error = None
+			while True:
+				line = await read_request_line(reader)
+				if line is None:
+					error = "a header line exceeds "+str(max_line_bytes)+" bytes"
+					break
+				if line in (b"\r\n", b"\n", b""):
+					break
+				n_headers += 1
+				if n_headers > max_request_headers:
+					error = "more than "+str(max_request_headers)+" headers"
+					break
+				name, _, value = line.decode("latin-1").partition(":")
+				headers[name.strip().lower()] = value.strip()
+			if error is not None:
+				write_response(writer, 431, {"error": error}, False)
+				break
+
+			length = headers.get("content-length", "0")
+			if not length.isdigit():
+				write_response(writer, 400, {"error": "bad Content-Length: "+length}, False)
+				break
+			if int(length) > max_request_bytes:
+				write_response(writer, 413, {"error": "the body exceeds "+str(max_request_bytes)+" bytes"}, False)
+				break
+			body = await reader.readexactly(int(length))
+
+			keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+			status, payload = handle_request(method, target.split("?")[0], body)
+			write_response(writer, status, payload, keep_alive)
+			await writer.drain()
+			if not keep_alive:
+				break
+	except (asyncio.IncompleteReadError, ConnectionError):
+		# the client went away in the middle of a request
+		pass
+	finally:
+		writer.close()
+
+
+async def serve_forever(host, port, unix_socket=None):
+	if unix_socket is None:
+		server = await asyncio.start_server(handle_connection, host, port, limit=max_line_bytes)
+		print("ProbFuse service listening on http://"+host+":"+str(port))
+	else:
+		# a socket file left there by a previous run would make the bind fail
+		if os.path.exists(unix_socket):
+			os.remove(unix_socket)
+		server = await asyncio.start_unix_server(handle_connection, path=unix_socket, limit=max_line_bytes)
+		print("ProbFuse service listening on the Unix socket "+unix_socket)
+
+	async with server:
+		await server.serve_forever()
+
+
+# loads the model once, then serves the requests until the process is stopped.
+# unix_socket: if it's given, the service listens on this Unix socket instead of host:port
+def run_fusion_service(model_file, host="127.0.0.1", port=8080, unix_socket=None, depth=1000):
+	load_service_model(model_file, depth)
+	print("Loaded the ProbFuse model '"+model_file+"': "+str(len(service_state["segment_weights"]))+" runs, "+str(service_state["n_segments"])+" segments")
+
+	try:
+		asyncio.run(serve_forever(host, port, unix_socket))
+	except KeyboardInterrupt:
+		print("Bye!")
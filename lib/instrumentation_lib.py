@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# timing and counters of the stages of the pipeline, written to a json report.
+#
+# a stage is either a step of a script (begin_stage/end_stage, or the instrumented_stage context) or a call of
+# a hot function (the instrumented decorator). for every stage it records the calls, the wall and CPU time and
+# the counters the code adds while the stage is running (add_counters: lines, docs, files opened, bytes read and
+# written, ...). the stages can be nested: the times are inclusive and a counter goes to every running stage.
+# a stage inherits the configuration of the enclosing one (e.g. x and t of a ProbFuse configuration), so the
+# report has a row for each stage and configuration.
+#
+# the CPU time of a stage is the one of its thread, but for the coarse stages (with_io=True): their CPU time is
+# the one of the whole process and of its finished child processes, so that a stage that works on a pool of
+# threads or processes (e.g. the evaluations or the ProbFuse sweep) counts the CPU of its workers too.
+#
+# the instrumentation is off until enable_instrumentation is called: then the decorated functions only pay
+# a check of the flag. the records of other processes come back through run_instrumented, the counters of
+# other threads through run_in_stage_context.
+
+import os
+import sys
+import json
+import time
+import threading
+import datetime
+import functools
+import contextlib
+try:
+	import resource
+except ImportError:
+	# not on Windows: there the CPU of the child processes is not counted
+	resource = None
+
+# {"enabled": bool, "records": {(stage, config as json): record}}
+instrumentation = {"enabled": False, "records": {}}
+instrumentation_lock = threading.Lock()
+# the stages running on each thread, innermost last
+running_stages = threading.local()
+
+
+def enable_instrumentation():
+	instrumentation["enabled"] = True
+
+
+def is_instrumentation_enabled():
+	return instrumentation["enabled"]
+
+
+def reset_instrumentation():
+	with instrumentation_lock:
+		instrumentation["records"] = {}
+
+
+def get_running_stages():
+	if not hasattr(running_stages, "stack"):
+		running_stages.stack = []
+	return running_stages.stack
+
+
+# bytes read and written by this process so far, from /proc/self/io (only on Linux; None elsewhere)
+def get_process_io():
+	try:
+		with open("/proc/self/io") as fp:
+			io = dict(line.split(":") for line in fp.read().splitlines())
+		return int(io["rchar"]), int(io["wchar"])
+	except (OSError, KeyError, ValueError):
+		return None
+
+
+# CPU seconds of this process and of its child processes that have ended (and have been waited for)
+def get_process_cpu_time():
+	cpu = time.process_time()
+	if resource is not None:
+		children = resource.getrusage(resource.RUSAGE_CHILDREN)
+		cpu += children.ru_utime + children.ru_stime
+	return cpu
+
+
+# starts a stage on this thread; its configuration is the one of the enclosing stage, updated with config.
+# with_io=True also records the bytes read and written by the whole process during the stage, and takes the CPU
+# time of the whole process and of its children instead of the one of this thread (coarse stages only:
+# reading them costs a few system calls)
+#
+# RETURNS: the running stage, to pass to end_stage (None if the instrumentation is off)
+def begin_stage(name, with_io=False, **config):
+	if not instrumentation["enabled"]:
+		return None
+
+	stack = get_running_stages()
+	stage_config = dict(stack[-1]["config"]) if len(stack) > 0 else {}
+	stage_config.update(config)
+	stage = {
+		"name": name,
+		"config": stage_config,
+		"counters": {},
+		"io": get_process_io() if with_io else None,
+		"cpu_clock": get_process_cpu_time if with_io else time.thread_time,
+		"wall": time.perf_counter(),
+	}
+	stage["cpu"] = stage["cpu_clock"]()
+	stack.append(stage)
+	return stage
+
+
+# ends a stage started by begin_stage and adds it to the records of its (stage, configuration)
+def end_stage(stage):
+	if stage is None:
+		return
+	wall = time.perf_counter() - stage["wall"]
+	cpu = stage["cpu_clock"]() - stage["cpu"]
+
+	counters = stage["counters"]
+	if stage["io"] is not None:
+		io = get_process_io()
+		if io is not None:
+			counters["process_bytes_read"] = counters.get("process_bytes_read", 0) + io[0] - stage["io"][0]
+			counters["process_bytes_written"] = counters.get("process_bytes_written", 0) + io[1] - stage["io"][1]
+
+	stack = get_running_stages()
+	if stage in stack:
+		stack.remove(stage)
+
+	add_record(stage["name"], stage["config"], 1, wall, cpu, counters)
+
+
+def add_record(name, config, calls, wall, cpu, counters):
+	key = (name, json.dumps(config, sort_keys=True))
+	with instrumentation_lock:
+		record = instrumentation["records"].get(key)
+		if record is None:
+			record = {"stage": name, "config": config, "calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "counters": {}}
+			instrumentation["records"][key] = record
+		record["calls"] += calls
+		record["wall_seconds"] += wall
+		record["cpu_seconds"] += cpu
+		for counter in counters:
+			record["counters"][counter] = record["counters"].get(counter, 0) + counters[counter]
+
+
+# adds to the counters of every stage running on this thread, e.g. add_counters(lines=1000, files_opened=1)
+def add_counters(**counters):
+	if not instrumentation["enabled"]:
+		return
+	for stage in get_running_stages():
+		for counter in counters:
+			stage["counters"][counter] = stage["counters"].get(counter, 0) + counters[counter]
+
+
+# the same of begin_stage and end_stage, as a context: with instrumented_stage("combine"): ...
+@contextlib.contextmanager
+def instrumented_stage(name, with_io=False, **config):
+	stage = begin_stage(name, with_io, **config)
+	try:
+		yield stage
+	finally:
+		end_stage(stage)
+
+
+# decorator that makes every call of a function a stage, named after the function unless name is given
+# (don't use it on generators: the stage would end before the first element is produced)
+def instrumented(name=None):
+	def decorate(function):
+		stage_name = function.__name__ if name is None else name
+
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			if not instrumentation["enabled"]:
+				return function(*args, **kwargs)
+			stage = begin_stage(stage_name)
+			try:
+				return function(*args, **kwargs)
+			finally:
+				end_stage(stage)
+		return wrapper
+	return decorate
+
+
+# runs function(*args) in another process (e.g. as the task of a ProcessPoolExecutor) with the instrumentation on,
+# and sends its records back with the result. the records of the worker are reset first: a forked worker
+# would otherwise send back the records of its parent too.
+# config=None: the configuration of the enclosing stage of the caller, inherited by the stages of the worker
+#
+# RETURNS: the result of the function and the records, to pass to merge_instrumentation_records
+def run_instrumented(function, args, config=None):
+	enable_instrumentation()
+	reset_instrumentation()
+	running_stages.stack = [{"name": None, "config": dict(config or {}), "counters": {}}]
+	try:
+		result = function(*args)
+	finally:
+		running_stages.stack = []
+	with instrumentation_lock:
+		records = list(instrumentation["records"].values())
+	return result, records
+
+
+# the stages running on this thread, to pass to run_in_stage_context on another thread
+#
+# RETURNS: a list of the running stages (None if the instrumentation is off)
+def get_stage_context():
+	if not instrumentation["enabled"]:
+		return None
+	return list(get_running_stages())
+
+
+# RETURNS: the configuration of the innermost stage running on this thread (e.g. to pass to run_instrumented)
+def get_stage_config():
+	stack = get_running_stages()
+	return dict(stack[-1]["config"]) if len(stack) > 0 else {}
+
+
+# runs function(*args) on this thread (e.g. as the task of a ThreadPoolExecutor) as part of the stages of another
+# thread, given by get_stage_context: its stages inherit the configuration of the innermost one, and its counters
+# are added to all of them when the function returns
+#
+# RETURNS: the result of the function
+def run_in_stage_context(context, function, *args):
+	if not context:
+		return function(*args)
+	root = {"name": None, "config": dict(context[-1]["config"]), "counters": {}}
+	running_stages.stack = [root]
+	try:
+		return function(*args)
+	finally:
+		running_stages.stack = []
+		with instrumentation_lock:
+			for stage in context:
+				for counter in root["counters"]:
+					stage["counters"][counter] = stage["counters"].get(counter, 0) + root["counters"][counter]
+
+
+# adds the records of another process (see run_instrumented) to the records of this one
+def merge_instrumentation_records(records):
+	for record in records:
+		add_record(record["stage"], record["config"], record["calls"], record["wall_seconds"], record["cpu_seconds"], record["counters"])
+
+
+# RETURNS: the report of everything recorded so far, a dict ready for json
+def get_instrumentation_report():
+	with instrumentation_lock:
+		records = [dict(record) for record in instrumentation["records"].values()]
+
+	for record in records:
+		if record["wall_seconds"] > 0:
+			for counter in ("lines", "docs"):
+				if counter in record["counters"]:
+					record[counter+"_per_second"] = record["counters"][counter] / record["wall_seconds"]
+	records.sort(key=lambda r: (r["stage"], json.dumps(r["config"], sort_keys=True)))
+
+	return {
+		"created": datetime.datetime.now().isoformat(),
+		"argv": sys.argv,
+		"python": sys.version.split()[0],
+		"cpu_count": os.cpu_count(),
+		"stages": records,
+	}
+
+
+# writes the report in a json file (under a temporary name, then renamed)
+def write_instrumentation_report(path):
+	if os.path.dirname(path) != "":
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path+".tmp", 'w') as fp:
+		json.dump(get_instrumentation_report(), fp, indent=1)
+	os.replace(path+".tmp", path)
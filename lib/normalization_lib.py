@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# the score normalizations applied to the runs before they're fused (CombX).
+#
+# the scores of a run are normalized topic by topic, but all the topics of a run at once: the scores are a single
+# array in which each topic is a segment of consecutive entries (given by the index where it starts), and the
+# statistics of every segment (min, max, sum, ...) come from one numpy reduction over the whole array.
+#
+# the methods, for the scores s of a topic:
+#   max       s / max(s)                                  (Lee95, assuming the minimum score is zero)
+#   min_max   (s - min(s)) / (max(s) - min(s))            (Lee95)
+#   sum       (s - min(s)) / sum(s - min(s))              (Montague & Aslam 2001: the minimum goes to 0, the sum to 1)
+#   z_score   (s - mean(s)) / std(s)                      (Montague & Aslam 2001, "ZMUV": zero mean, unit variance)
+#   rank      1 - r / n, r the rank of the entry (from 0, by decreasing score) and n the entries of the topic
+#             (the scores are ignored: the best document gets 1 and the last one 1/n; ties keep the order of the run)
+#
+# a topic whose scores can't be normalized (all equal; for max, a max score of zero) would divide by zero:
+# with constant_scores="fill" (the default) all its documents get the same score, the one of the best document
+# of a regular topic (1 for max and min_max, 1/n for sum) or the mean for z_score (0);
+# with constant_scores="error" it's an error, as it was before any of this.
+
+import numpy as np
+from lib.instrumentation_lib import instrumented, add_counters
+
+normalization_methods = ["max", "min_max", "sum", "z_score", "rank"]
+constant_score_policies = ["fill", "error"]
+
+
+# RETURNS: the number of entries of each segment of an array of n entries, segments starting at starts
+def get_segment_sizes(starts, n):
+	return np.diff(np.append(starts, n))
+
+
+# normalizes the scores of many topics at once, each one on its own statistics.
+#
+# scores: a numpy array with the scores of all the topics, the entries of each topic are consecutive
+# starts: the index in scores of the first entry of each topic, increasing (a topic has at least one entry)
+# normalization_method: one of normalization_methods
+# constant_scores: what to do with a topic that can't be normalized, "fill" or "error" (see above)
+# score_ranges: the (mins, maxs) arrays of the topics if they're known already (e.g. topic_min and topic_max
+#   of tokenizer_lib.parse_run_columns), so that they're not searched again (max, min_max and sum only)
+#
+# RETURNS: a numpy array with the normalized scores, in the order of scores (float64, or the float dtype of scores)
+@instrumented()
+def normalize_segments(scores, starts, normalization_method="min_max", constant_scores="fill", score_ranges=None):
+	if not normalization_method in normalization_methods:
+		raise Exception("Unknown normalization method '"+str(normalization_method)+"', expected one of "+str(normalization_methods))
+	if not constant_scores in constant_score_policies:
+		raise Exception("Unknown policy for the constant scores '"+str(constant_scores)+"', expected one of "+str(constant_score_policies))
+
+	# the scores keep their precision (e.g. float32 scores stay float32): the statistics are computed
+	# in float64 and rounded to the precision of the scores, as the Python floats of the old normalize_score_array were
+	scores = np.asarray(scores)
+	if not np.issubdtype(scores.dtype, np.floating):
+		scores = scores.astype(np.float64)
+	starts = np.asarray(starts, dtype=np.int64)
+	sizes = get_segment_sizes(starts, len(scores))
+	if len(scores) == 0 or np.any(sizes <= 0):
+		raise Exception("Cannot normalize an empty topic")
+	add_counters(docs=len(scores))
+
+	if normalization_method == "rank":
+		return normalize_segment_ranks(scores, starts, sizes)
+
+	if normalization_method == "z_score":
+		means = np.add.reduceat(scores, starts, dtype=np.float64) / sizes
+		centered = scores - np.repeat(means.astype(scores.dtype), sizes)
+		divisors = np.sqrt(np.add.reduceat(np.square(centered, dtype=np.float64), starts) / sizes)
+		# a constant topic has a zero deviation: its scores are all at the mean
+		fill_values = np.zeros(len(starts))
+		shifted = centered
+	else:
+		if score_ranges is not None:
+			mins, maxs = np.asarray(score_ranges[0], dtype=np.float64), np.asarray(score_ranges[1], dtype=np.float64)
+		else:
+			mins = np.minimum.reduceat(scores, starts).astype(np.float64)
+			maxs = np.maximum.reduceat(scores, starts).astype(np.float64)
+		# max normalization assumes the minimum score is zero
+		if normalization_method == "max":
+			mins = np.zeros(len(starts))
+		shifted = scores - np.repeat(mins.astype(scores.dtype), sizes)
+
+		if normalization_method == "sum":
+			divisors = np.add.reduceat(shifted, starts, dtype=np.float64)
+			fill_values = 1.0 / sizes
+		else:
+			divisors = maxs - mins
+			fill_values = np.ones(len(starts))
+
+	constant = divisors == 0
+	if not np.any(constant):
+		return shifted / np.repeat(divisors.astype(scores.dtype), sizes)
+
+	if constant_scores == "error":
+		topic = int(np.flatnonzero(constant)[0])
+		if normalization_method == "z_score" or normalization_method == "sum":
+			raise Exception("Cannot normalize scores all equal to "+str(scores[starts[topic]])+" (topic at position "+str(topic)+")")
+		raise Exception("Cannot normalize scores with max == min ("+str(maxs[topic])+") (topic at position "+str(topic)+")")
+
+	# the constant topics are divided by 1 and then overwritten
+	normalized = shifted / np.repeat(np.where(constant, 1.0, divisors).astype(scores.dtype), sizes)
+	normalized[np.repeat(constant, sizes)] = np.repeat(fill_values[constant], sizes[constant])
+	return normalized
+
+
+# the rank normalization of normalize_segments
+def normalize_segment_ranks(scores, starts, sizes):
+	segments = np.repeat(np.arange(len(starts)), sizes)
+	# by topic, then by decreasing score; lexsort is stable, so the ties keep the order of the run
+	order = np.lexsort((-scores, segments))
+	ranks = np.arange(len(scores)) - np.repeat(starts, sizes)
+
+	normalized = np.empty(len(scores), dtype=scores.dtype)
+	normalized[order] = 1.0 - ranks / np.repeat(sizes, sizes)
+	return normalized
+
+
+# normalizes every topic of a run at once
+#
+# run: a dict {topic_id: (doc_ids, scores)}, as the parsers of the runs give it (e.g. parse_res_file_interned)
+# score_ranges: a dict {topic_id: (min score, max score)} of the topics of run, if the parser found them already
+#
+# RETURNS: the same dict, with the normalized scores (views of a single array)
+def normalize_run_topics(run, normalization_method="min_max", constant_scores="fill", score_ranges=None):
+	if len(run) == 0:
+		return {}
+	topic_ids = list(run)
+	score_arrays = [run[topic_id][1] for topic_id in topic_ids]
+	sizes = [len(scores) for scores in score_arrays]
+	starts = np.cumsum([0] + sizes[:-1])
+
+	if score_ranges is not None:
+		score_ranges = ([score_ranges[topic_id][0] for topic_id in topic_ids], [score_ranges[topic_id][1] for topic_id in topic_ids])
+	normalized = normalize_segments(np.concatenate(score_arrays), starts, normalization_method, constant_scores, score_ranges)
+	return {topic_id: (run[topic_id][0], scores) for topic_id, scores in zip(topic_ids, np.split(normalized, starts[1:]))}
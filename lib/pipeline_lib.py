@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# the steps of RUNME.py as a headless pipeline: a graph of stages, each one run again only when something it
+# depends on has changed.
+#
+#   combine      the runs                               -> the six base combinations
+#   preprocess   the runs, the qrels                    -> the pre-processed runs
+#   probfuse     the pre-processed runs, Xtparams.txt   -> the fused runs of the sweep
+#   evaluate     the runs, both fusions, the qrels      -> the trec_eval outputs
+#   select_best  the trec_eval outputs                  -> a json with every MAP and the best models
+#
+# the key of a stage is the sha1 of its parameters and of the content of its input files, the outputs of the
+# stages before it included. a stage runs again only when its key has changed or its outputs aren't there
+# anymore (or have changed); a stage that runs again and writes the very same outputs doesn't make the
+# following ones run. the sha1 of a file is computed again only when its size or mtime changes, so checking
+# an unchanged pipeline costs a stat of each file.
+#
+# the parameters, the inputs and the outputs of every stage are kept in a json state file, written after each stage:
+# a stage that fails is not recorded, so it runs again next time (and the stages after it don't run at all).
+
+import os
+import json
+import hashlib
+import datetime
+import functools
+from lib.basic_retrieval_helpers import *
+from lib.preprocessing_lib import evaluate_run
+from lib.prob_fuse_lib import clean_out_files, extract_params, prob_fuse_sweep, get_repetition_folder, check_relevances_exist, reset_sweep_data
+from lib.run_cache_lib import file_sha1, parse_res_file_cached_interned
+from lib.qrels_lib import load_qrels_index
+from lib.trec_eval_lib import native_trec_eval_command, get_evaluator_version, evaluate_files_parallel
+from lib.eval_cache_lib import default_eval_cache_folder
+from lib.instrumentation_lib import instrumented_stage
+from lib.compression_lib import has_extension, strip_compression_extension
+
+default_pipeline_state = "output/pipeline_state.json"
+
+# bump this when the format of the state file changes: every stage will run again
+pipeline_state_version = 1
+
+
+# the configuration of the pipeline: the same folders and parameters of RUNME.py, each can be overridden.
+#
+# seed: seed of the ProbFuse sweep. It can't be None: the fused runs must only depend on the inputs,
+#   or the sweep (and everything after it) would run again every time
+# n_workers: processes of the sweep and threads of the evaluations; not part of any key, the outputs don't depend on it
+# normalization: how the scores of the runs are normalized before CombX (see normalization_lib)
+# output_precision: decimals of the scores in the fused runs (see run_writer_lib), None to write them in full
+# output_compression: ".gz", ".bz2" or ".xz" to write the fused runs compressed (see compression_lib), None for plain text
+# run_cache_folder, eval_cache_folder: the binary cache of the runs and the evaluation cache, None to not use them
+#
+# RETURNS: a dict with the configuration
+def make_pipeline_config(**overrides):
+	config = {
+		"runs_folder": "input/ten_models",
+		"qrels_file": "input/qrels.trec7.txt",
+		"params_file": "input/Xtparams.txt",
+		"base_combinations_folder": "output/base_combinations/",
+		"preprocessed_folder": "output/preprocessed_scores",
+		"probfuse_folder": "output/probfuse/",
+		"evals_folder": "output/trec_evals/",
+		"best_file": "output/best_models.json",
+		"normalization": "min_max",
+		"output_depth": default_run_depth,
+		"output_precision": None,
+		"output_compression": None,
+		"topic_dim": None,
+		"judged_choices": [True, False],
+		"n_repetitions": 1,
+		"seed": 2006,
+		"trec_eval_command": native_trec_eval_command,
+		"n_workers": os.cpu_count(),
+		"run_cache_folder": "output/cache/runs",
+		"eval_cache_folder": default_eval_cache_folder,
+	}
+	for name in overrides:
+		if not name in config:
+			raise Exception("Unknown pipeline parameter '"+name+"', expected one of "+str(sorted(config)))
+		config[name] = overrides[name]
+
+	if config["seed"] is None:
+		raise Exception("The pipeline needs a fixed seed for the ProbFuse sweep: with a random one it would never be up to date")
+	return config
+
+
+# RETURNS: the state of the pipeline, {"version", "files": {path: {size, mtime_ns, sha1}}, "stages": {stage: record}}
+def load_pipeline_state(path):
+	if os.path.isfile(path):
+		with open(path) as fp:
+			state = json.load(fp)
+		if state.get("version") == pipeline_state_version:
+			return state
+	return {"version": pipeline_state_version, "files": {}, "stages": {}}
+
+
+# writes the state (under a temporary name, then renamed: an interrupted pipeline never leaves half a state)
+def write_pipeline_state(state, path):
+	if os.path.dirname(path) != "":
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path+".tmp", 'w') as fp:
+		json.dump(state, fp, indent=1, sort_keys=True)
+	os.replace(path+".tmp", path)
+
+
+# sha1 of a file, computed again only if its size or mtime changed since it was recorded in the state
+#
+# RETURNS: the sha1, or None if the file doesn't exist
+def get_state_file_sha1(state, path):
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return None
+
+	known = state["files"].get(path)
+	if known is not None and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+		return known["sha1"]
+
+	sha1 = file_sha1(path)
+	state["files"][path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": sha1}
+	return sha1
+
+
+# RETURNS: {path: sha1} of the given files; a missing input is an error
+def get_input_digests(state, paths):
+	digests = {}
+	for path in paths:
+		sha1 = get_state_file_sha1(state, path)
+		if sha1 is None:
+			raise Exception("Missing input file: "+path)
+		digests[path] = sha1
+	return digests
+
+
+# every file inside folder (and its sub-folders), sorted
+def list_folder_files(folder):
+	return sorted(os.path.join(dp, f) for dp, dn, fn in os.walk(folder) for f in fn)
+
+
+def get_stage_key(name, version, params, inputs):
+	description = json.dumps({"stage": name, "version": version, "params": params, "inputs": inputs}, sort_keys=True)
+	return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+
+# the stages; each one is run by a function (config, upstream) -> its output files, where upstream is
+# {stage: its output files} for the stages in "after"
+
+
+def run_combine_stage(config, upstream):
+	output_folder = config["base_combinations_folder"]
+	clean_out_files(output_folder)
+
+	run_files = get_res_files(config["runs_folder"])
+	if config["run_cache_folder"] is None:
+		run_parser = parse_res_file_interned
+	else:
+		run_parser = functools.partial(parse_res_file_cached_interned, cache_folder=config["run_cache_folder"])
+
+	with open_run_writers(output_folder, comb_technique_names, config["output_precision"], compression=config["output_compression"]) as writers:
+		for topic_id, doc_ids, matrix in iterate_topic_score_matrices(run_files, config["normalization"], None, run_parser):
+			new_runs = apply_all_combs_to_score_matrix(doc_ids, matrix, config["output_depth"])
+			for comb_technique_name, new_run in new_runs.items():
+				write_ranking_to_run(writers[comb_technique_name], new_run, topic_id)
+
+	return list_folder_files(output_folder)
+
+
+def run_preprocess_stage(config, upstream):
+	output_folder = config["preprocessed_folder"]
+	clean_out_files(output_folder+"/")
+
+	gndt = load_qrels_index(config["qrels_file"])
+	for filepath in get_res_files(config["runs_folder"]):
+		evaluate_run(filepath, gndt, output_folder+"/"+get_run_name(filepath)+"_preprocessed.npz", config["run_cache_folder"])
+
+	return list_folder_files(output_folder)
+
+
+def run_probfuse_stage(config, upstream):
+	x_choices, t_choices = extract_params(config["params_file"])
+	check_relevances_exist(config["preprocessed_folder"])
+	# the stage runs because something upstream changed: the sweep must not reuse the data of an earlier
+	# run of the pipeline in this process (e.g. a loop calling run_pipeline), it reads the pre-processed runs again
+	reset_sweep_data()
+	for r in range(1, config["n_repetitions"]+1):
+		clean_out_files(get_repetition_folder(config["probfuse_folder"], r))
+
+	out_paths = prob_fuse_sweep(config["preprocessed_folder"], config["probfuse_folder"], x_choices, t_choices, config["judged_choices"],
+		config["topic_dim"], config["output_depth"], config["n_workers"], config["seed"], config["n_repetitions"], config["output_precision"], config["output_compression"])
+
+	return sorted(out_paths.values())
+
+
+# the evaluation of a run goes in a folder named after the folder of the run: the single runs (input/ten_models/run3/...)
+# in ten_models/run3_eval.txt, as in RUNME.py, the fusions in base_combinations/, probfuse/, probfuse_2/, ...
+def get_evaluation_file(config, res_file, single_run):
+	if single_run:
+		return os.path.join(config["evals_folder"], os.path.basename(os.path.normpath(config["runs_folder"])), res_file.split('/')[-2]+"_eval.txt")
+	return os.path.join(config["evals_folder"], os.path.basename(os.path.dirname(res_file)), strip_compression_extension(os.path.basename(res_file))[:-4]+"_eval.txt")
+
+
+def run_evaluate_stage(config, upstream):
+	clean_out_files(config["evals_folder"])
+
+	jobs = [(res_file, get_evaluation_file(config, res_file, True)) for res_file in get_res_files(config["runs_folder"])]
+	for stage in ("combine", "probfuse"):
+		jobs += [(res_file, get_evaluation_file(config, res_file, False)) for res_file in upstream[stage] if has_extension(res_file, ".res")]
+
+	failures = evaluate_files_parallel(jobs, config["trec_eval_command"], config["qrels_file"], config["n_workers"], config["eval_cache_folder"])
+	if len(failures) > 0:
+		raise Exception(str(len(failures))+" of "+str(len(jobs))+" evaluations failed, the first one: "+failures[0][1])
+
+	return sorted(out_file for res_file, out_file in jobs)
+
+
+def run_select_best_stage(config, upstream):
+	# plotutils loads matplotlib: only when this stage runs, so that checking an up to date pipeline stays instant
+	from lib.plotutils import extract_features, map_filter
+
+	# {"folder/model": features}, e.g. "probfuse/ProbFuseAll_25_0.5"
+	feature_per_file = {}
+	for file in upstream["evaluate"]:
+		method_name = os.path.relpath(file, config["evals_folder"])[:-len("_eval.txt")]
+		feature_per_file[method_name] = extract_features(file)
+	maps = map_filter(feature_per_file)
+
+	probfuse_folder = os.path.basename(os.path.normpath(config["probfuse_folder"]))
+	probfuse_maps = {name: maps[name] for name in maps if name.split('/')[0].startswith(probfuse_folder)}
+
+	best = {"maps": maps}
+	best["best"] = max(maps.items(), key=lambda item: item[1]) if len(maps) > 0 else None
+	best["best_probfuse"] = max(probfuse_maps.items(), key=lambda item: item[1]) if len(probfuse_maps) > 0 else None
+
+	if os.path.dirname(config["best_file"]) != "":
+		os.makedirs(os.path.dirname(config["best_file"]), exist_ok=True)
+	with open(config["best_file"], 'w') as fp:
+		json.dump(best, fp, indent=1, sort_keys=True)
+	print("The best model is "+str(best["best"])+", the best ProbFuse one "+str(best["best_probfuse"]))
+
+	return [config["best_file"]]
+
+
+# the graph of the stages, in an order where every stage comes after the ones in its "after".
+# "inputs" are the files a stage reads besides the outputs of the stages in "after", "params" the parameters
+# its outputs depend on; bump "version" when the code of a stage changes what it writes.
+pipeline_stages = [
+	{
+		"name": "combine", "version": 1, "after": [],
+		"inputs": lambda config: get_res_files(config["runs_folder"]),
+		"params": lambda config: {"normalization": config["normalization"], "output_depth": config["output_depth"],
+			"output_precision": config["output_precision"], "output_compression": config["output_compression"]},
+		"run": run_combine_stage,
+	},
+	{
+		"name": "preprocess", "version": 1, "after": [],
+		"inputs": lambda config: get_res_files(config["runs_folder"]) + [config["qrels_file"]],
+		"params": lambda config: {},
+		"run": run_preprocess_stage,
+	},
+	{
+		"name": "probfuse", "version": 1, "after": ["preprocess"],
+		"inputs": lambda config: [config["params_file"]],
+		"params": lambda config: {"seed": config["seed"], "n_repetitions": config["n_repetitions"], "judged_choices": config["judged_choices"],
+			"topic_dim": config["topic_dim"], "output_depth": config["output_depth"], "output_precision": config["output_precision"],
+			"output_compression": config["output_compression"]},
+		"run": run_probfuse_stage,
+	},
+	{
+		"name": "evaluate", "version": 1, "after": ["combine", "probfuse"],
+		"inputs": lambda config: get_res_files(config["runs_folder"]) + [config["qrels_file"]],
+		"params": lambda config: {"evaluator": get_evaluator_version(config["trec_eval_command"])},
+		"run": run_evaluate_stage,
+	},
+	{
+		"name": "select_best", "version": 1, "after": ["evaluate"],
+		"inputs": lambda config: [],
+		"params": lambda config: {},
+		"run": run_select_best_stage,
+	},
+]
+
+
+# RETURNS: the names of the stages to bring up to date for targets (None: all of them), with the stages they depend on, in order
+def get_stages_to_check(targets=None):
+	stages = {stage["name"]: stage for stage in pipeline_stages}
+	if targets is None:
+		targets = list(stages)
+
+	needed = set()
+	pending = list(targets)
+	while len(pending) > 0:
+		name = pending.pop()
+		if not name in stages:
+			raise Exception("Unknown pipeline stage '"+str(name)+"', expected one of "+str(list(stages)))
+		if not name in needed:
+			needed.add(name)
+			pending += stages[name]["after"]
+
+	return [stage["name"] for stage in pipeline_stages if stage["name"] in needed]
+
+
+# why a stage has to run, comparing its record in the state with its current key and outputs
+#
+# RETURNS: the reason, or None if the stage is up to date
+def get_stale_reason(state, record, key, params, inputs):
+	if record is None:
+		return "never run"
+	if record["key"] == key:
+		for path in record["outputs"]:
+			if get_state_file_sha1(state, path) != record["outputs"][path]:
+				return "output "+path+" missing or changed"
+		return None
+
+	if record["params"] != params:
+		return "parameters changed"
+	changed = [path for path in inputs if record["inputs"].get(path) != inputs[path]]
+	removed = [path for path in record["inputs"] if not path in inputs]
+	if len(changed)+len(removed) > 0:
+		return str(len(changed)+len(removed))+" input files changed (e.g. "+(changed+removed)[0]+")"
+	return "stage version changed"
+
+
+# brings the stages in targets (None: all) and those they depend on up to date, running only the stale ones.
+#
+# config: the output of make_pipeline_config
+# targets: names of stages, e.g. ["probfuse"] to stop after the sweep
+# force=None: names of stages to run even if they're up to date (the stages after them run only if their outputs change)
+# state_path: the json file with the state of the pipeline
+#
+# RETURNS: a dict {stage: "skipped" or "ran"}
+def run_pipeline(config, targets=None, force=None, state_path=default_pipeline_state):
+	if force is None:
+		force = []
+	stages = {stage["name"]: stage for stage in pipeline_stages}
+	state = load_pipeline_state(state_path)
+	outcome = {}
+
+	for name in get_stages_to_check(targets):
+		stage = stages[name]
+		params = stage["params"](config)
+		inputs = get_input_digests(state, stage["inputs"](config))
+		for upstream_name in stage["after"]:
+			inputs.update(state["stages"][upstream_name]["outputs"])
+		key = get_stage_key(name, stage["version"], params, inputs)
+
+		record = state["stages"].get(name)
+		reason = "forced" if name in force else get_stale_reason(state, record, key, params, inputs)
+		if reason is None:
+			print("["+name+"] up to date, skipped")
+			outcome[name] = "skipped"
+			continue
+
+		print("["+name+"] running: "+reason)
+		start_time = datetime.datetime.now()
+		# until the stage is done, its old outputs can't be trusted
+		state["stages"].pop(name, None)
+		write_pipeline_state(state, state_path)
+
+		upstream = {upstream_name: sorted(state["stages"][upstream_name]["outputs"]) for upstream_name in stage["after"]}
+		with instrumented_stage(name, with_io=True):
+			output_files = stage["run"](config, upstream)
+
+		state["stages"][name] = {
+			"key": key,
+			"params": params,
+			"inputs": inputs,
+			"outputs": get_input_digests(state, output_files),
+			"finished": datetime.datetime.now().isoformat(),
+		}
+		write_pipeline_state(state, state_path)
+		print("["+name+"] done in "+str(datetime.datetime.now()-start_time))
+		outcome[name] = "ran"
+
+	return outcome
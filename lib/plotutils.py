@@ -7,19 +7,17 @@ import os
 from matplotlib import pyplot as plt
 import numpy as np
 import subprocess
+from lib.trec_eval_lib import native_trec_eval_command, run_trec_eval_cached
+from lib.compression_lib import has_extension
 
 def get_map_scores_for_probfuse(folder_with_res_to_evaluate, trec_eval_command, qrels_file):
 
-	files_to_evaluate = [f for f in os.listdir(folder_with_res_to_evaluate) if f.endswith('.res')]
+	files_to_evaluate = [f for f in os.listdir(folder_with_res_to_evaluate) if has_extension(f, '.res')]
 
 	scores = []
 
 	for res in files_to_evaluate:
-		# command line to evaluate is:
-		# "./path/to/trec_eval  ./qrels.trec7.txt ./path/to/BM25b0.75_1.res"
-		command = [trec_eval_command, qrels_file, folder_with_res_to_evaluate+res ]
-		result = subprocess.run( command, stdout=subprocess.PIPE )
-		output = result.stdout.decode('utf-8') # get result from trec_eval command
+		output = run_trec_eval_cached(folder_with_res_to_evaluate+res, trec_eval_command, qrels_file)
 
 		map_score = get_score_from_trec_eval_output(output, score_name="map")
 
@@ -34,22 +32,14 @@ def get_map_scores_for_probfuse(folder_with_res_to_evaluate, trec_eval_command,
 	return scores
 
 def get_map_score(file_to_evaluate, trec_eval_command, qrels_file):
-	# command line to evaluate is:
-	# "./path/to/trec_eval  ./qrels.trec7.txt ./path/to/BM25b0.75_1.res"
-	command = [trec_eval_command, qrels_file, file_to_evaluate]
-	result = subprocess.run( command, stdout=subprocess.PIPE )
-	output = result.stdout.decode('utf-8') # get result from trec_eval command
+	output = run_trec_eval_cached(file_to_evaluate, trec_eval_command, qrels_file)
 	map_score = get_score_from_trec_eval_output(output, score_name="map")
 	return map_score
 
 def get_map_scores(files_to_evaluate, trec_eval_command, qrels_file):
 	scores = []
 	for res in files_to_evaluate:
-		# command line to evaluate is:
-		# "./path/to/trec_eval  ./qrels.trec7.txt ./path/to/BM25b0.75_1.res"
-		command = [trec_eval_command, qrels_file, folder_with_res_to_evaluate+res ]
-		result = subprocess.run( command, stdout=subprocess.PIPE )
-		output = result.stdout.decode('utf-8') # get result from trec_eval command
+		output = run_trec_eval_cached(folder_with_res_to_evaluate+res, trec_eval_command, qrels_file)
 
 		map_score = get_score_from_trec_eval_output(output, score_name="map")
 
@@ -131,18 +121,15 @@ def get_score_from_trec_eval_output(res_file, score_name="map"):
 
 		score_metric_name = tokens[0].strip()
 		# tokens[1] is 'all' here
-		score_value = float(tokens[2].strip())
-
+		# (the value is parsed only for the wanted metric: e.g. "runid" is not a number)
 		if score_metric_name == score_name:
-			return score_value
+			return float(tokens[2].strip())
 
 	raise Exception("No score metric named", score_name, "found in file: ", res_file)
 
 # return a list of the eleven scores for the interpolated ir curve
 def get_eleven_point_score(res_file, trec_eval_command, qrels_file, return_dict=False):
-	command = [trec_eval_command, qrels_file, res_file ]
-	result = subprocess.run( command, stdout=subprocess.PIPE )
-	output = result.stdout.decode('utf-8') # get result from trec_eval command
+	output = run_trec_eval_cached(res_file, trec_eval_command, qrels_file)
 
 	metric_81 = "ircl_prn." # trec_eval 8.1 name
 	metric_9  = "iprec_at_recall_" # trec_eval 9 name
@@ -160,8 +147,6 @@ def get_eleven_point_score(res_file, trec_eval_command, qrels_file, return_dict=
 			continue
 
 		score_metric_name = tokens[0].strip()
-		# tokens[1] is 'all' here
-		score_value = float(tokens[2].strip())
 
 		this_score_prefix = ""
 		if score_metric_name[:len(metric_81)] == metric_81:
@@ -171,6 +156,9 @@ def get_eleven_point_score(res_file, trec_eval_command, qrels_file, return_dict=
 		else:
 			continue
 
+		# tokens[1] is 'all' here
+		score_value = float(tokens[2].strip())
+
 		scores[ score_metric_name[len(this_score_prefix):] ] = score_value
 		score_names.append(score_metric_name[len(this_score_prefix):])
 		score_values.append(score_value)
@@ -329,7 +317,7 @@ def plot_map_comb(base_input_folder, comb_input_folder, trec_eval_command, qrels
 		file_base = get_eval_files(base_input_folder+"/run"+str(i))
 		my_file = ""
 		for f in file_base:
-			if(f[-4:] == ".res"):
+			if(has_extension(f, ".res")):
 				my_file = f
 		file_base = my_file
 		if(file_base == ""):
@@ -7,7 +7,15 @@ import os
 import sys
 import shutil
 import statistics
+import json
 import datetime
+import numpy as np
+from lib.run_cache_lib import iterate_cached_topic_doc_pairs, get_file_fingerprint
+from lib.doc_ids_lib import *
+from lib.qrels_lib import *
+from lib.tokenizer_lib import parse_run_columns, parse_qrels_text_columns, group_lines_by_topic
+from lib.compression_lib import open_text_file, strip_compression_extension
+from lib.instrumentation_lib import instrumented, add_counters
 
 
 def check_ground_truth_exist(path):
@@ -15,46 +23,167 @@ def check_ground_truth_exist(path):
 		raise Exception("Expecting the ground truth file in the /input folder. Check README for filename info.")
 
 # returns a dict with a key for each topic, which has a list of dicts with a key for each document ((0/1) relevance)
-# gt = {topic: {doc: rel_weight}}
+# gt = {topic: {doc: rel_weight}}, the docs are interned (see doc_ids_lib).
+# the whole file is parsed on every call: evaluate_run uses the indexed qrels of qrels_lib.load_qrels_index instead.
 def extract_ground_truth(path):
-	gt = {}
-	with open(path) as fp:
-		for line in fp:
-			line = line.strip()
-			# each line has: top_id, q0, doc_id, rel_weight. Therefore:
-			el = line.split()
+	# each line has: top_id, q0, doc_id, rel_weight (see tokenizer_lib.parse_qrels_text_columns)
+	columns = parse_qrels_text_columns(path, number_docs=False)
+	topic_names = columns["topic_ids"].tolist()
+	doc_ids = intern_doc_ids(columns["doc_names"])
 
-			if len(el) != 4:
-				raise Exception("Something is wrong in '"+path+"': "+str(len(el))+" elements found, 4 expected: "+line)
+	rel_w = columns["relevances"].astype(str)
 
-			tid 	= el[0].strip()
-			did 	= el[2].strip()
-			rel_w 	= el[3].strip()
+	# a dict per topic, at once: when a doc is judged twice, the last judgment wins
+	gt = {}
+	for tid, lines in zip(topic_names, group_lines_by_topic(columns["topics"], len(topic_names))):
+		gt[tid] = dict(zip(doc_ids[lines].tolist(), rel_w[lines].tolist()))
 
-			if not tid in gt:
-				gt[tid] = {}
+	return gt
 
-			gt[tid][did] = rel_w 
+# the binary pre-processed runs (".npz", see write_preprocessed_matrix) have a row for each topic:
+# the ranks a topic doesn't reach are padded with these codes
+preprocessed_padding_relevance = -2
+preprocessed_padding_doc = -1
 
-	return gt
+# the identity of a run file, kept with what is computed from it (the pre-processed runs, the ProbFuse models):
+# its file name (without the extension of a codec) and, with_hash=True, the size and the sha1 of the file as it is
+#
+# RETURNS: a dict {"file": name, "size": bytes, "sha1": hex digest}
+def get_run_source(run_file, with_hash=True):
+	source = {"file": strip_compression_extension(os.path.basename(run_file))}
+	if with_hash:
+		fingerprint = get_file_fingerprint(run_file)
+		source["size"] = fingerprint["size"]
+		source["sha1"] = fingerprint["sha1"]
+	return source
 
 # this function reads a run and, for each document retuned for each topic, searches for its corresponding ground truth
 # and evaluates if the retrieved document is either relevant, not relevant or neither the two options.
-# then, this function writes down the results in an output file.
-def evaluate_run(run_file, ground_truth, output_file):
-	
-	with open(run_file) as fp:
-		with open(output_file, 'w') as writer:
-			for line in fp:
-				line = line.strip()
-				el = line.split()
-				topic_id 	= el[0]
-				doc_id 		= el[2]
-
-				if not doc_id in ground_truth[topic_id]:
-					relevance = -1 # "i don't know if it's relevant or not"
-				else:
-					relevance = ground_truth[topic_id][doc_id]
-				newline = topic_id+" "+doc_id+" "+str(relevance)
-				
+# then, this function writes down the results in an output file: if its name ends with ".npz" a binary
+# topic x rank matrix (see write_preprocessed_matrix), otherwise "topic doc relevance" text lines.
+# ground_truth is the qrels index of qrels_lib.load_qrels_index: all the documents of the run are joined
+# with it at once.
+# if run_cache_folder is given, the run is read from its binary cache (see run_cache_lib) rather than parsed again.
+@instrumented()
+def evaluate_run(run_file, ground_truth, output_file, run_cache_folder=None):
+
+	if run_cache_folder is None:
+		add_counters(files_opened=1, bytes_read=os.path.getsize(run_file))
+		topic_ids, doc_ids = read_text_topic_doc_columns(run_file)
+	else:
+		topic_ids = []
+		doc_ids = []
+		for topic_id, doc_id in iterate_cached_topic_doc_pairs(run_file, run_cache_folder):
+			topic_ids.append(topic_id)
+			doc_ids.append(doc_id)
+
+	check_topic_ids(np.unique(np.array(topic_ids, dtype=str)), run_file)
+
+	# -1 means "i don't know if it's relevant or not"
+	relevances = lookup_relevances(ground_truth, topic_ids, doc_ids, missing=-1)
+	add_counters(lines=len(topic_ids), docs=len(topic_ids))
+
+	if output_file.endswith(".npz"):
+		write_preprocessed_matrix(output_file, topic_ids, np.array(doc_ids, dtype=np.int32), relevances, get_run_source(run_file))
+	else:
+		with open_text_file(output_file, 'w') as writer:
+			for topic_id, doc_name, relevance in zip(topic_ids, get_doc_names(doc_ids), relevances.tolist()):
+				newline = topic_id+" "+doc_name+" "+str(relevance)
 				writer.write(newline.strip() + "\n"	)
+
+	add_counters(files_opened=1, bytes_written=os.path.getsize(output_file))
+
+# the topics of the pre-processed runs are numbers (ProbFuse sorts them as such, see prob_fuse_lib.read_preprocessed_text),
+# and the .npz files keep them as int32: a topic id that is not one is an error that names it and its run
+#
+# topic_ids: the distinct topic ids (str) of the run run_name
+def check_topic_ids(topic_ids, run_name):
+	limits = np.iinfo(np.int32)
+	for topic_id in topic_ids.tolist():
+		try:
+			valid = limits.min <= int(topic_id) <= limits.max
+		except ValueError:
+			valid = False
+		if not valid:
+			raise Exception("The topic id '"+topic_id+"' of the run '"+run_name+"' is not a number (an int32): the pre-processed runs need numeric topic ids")
+
+# writes a pre-processed run as a numpy .npz file with the arrays:
+#   topics      int32 [n_topics], the topic of each row, in order of appearance in the run
+#   lengths     int32 [n_topics], how many documents the run has retrieved for each topic
+#   relevances  int8 [n_topics, depth], the relevance of the document at each rank: 1, 0 or -1 (not judged);
+#               preprocessed_padding_relevance beyond the length of the topic
+#   docs        int32 [n_topics, depth], the document at each rank, as an index in doc_names;
+#               preprocessed_padding_doc beyond the length of the topic
+#   doc_names   uint8, the doc ids of the run (see encode_doc_names): interned ids can't be written,
+#               they only make sense in a process
+#   source      a json string with the identity of the run file (see get_run_source), only if source is given
+# the file is written under a temporary name and then renamed.
+#
+# topic_ids, doc_ids, relevances: topic (string), interned doc id and relevance of each line of the run, in order
+def write_preprocessed_matrix(output_file, topic_ids, doc_ids, relevances, source=None):
+	topics, rows = group_by_first_appearance(np.array(topic_ids, dtype=str))
+	check_topic_ids(topics, output_file if source is None else source["file"])
+	ranks, lengths = get_positions_in_groups(rows, len(topics))
+	depth = int(lengths.max()) if len(lengths) > 0 else 0
+
+	run_doc_ids, docs = np.unique(doc_ids, return_inverse=True)
+
+	relevance_matrix = np.full( (len(topics), depth), preprocessed_padding_relevance, dtype=np.int8 )
+	relevance_matrix[rows, ranks] = relevances
+	doc_matrix = np.full( (len(topics), depth), preprocessed_padding_doc, dtype=np.int32 )
+	doc_matrix[rows, ranks] = docs.reshape(-1)
+
+	arrays = {"topics": topics.astype(np.int32), "lengths": lengths.astype(np.int32), "relevances": relevance_matrix, "docs": doc_matrix, "doc_names": encode_doc_names(get_doc_names(run_doc_ids))}
+	if source is not None:
+		arrays["source"] = np.array(json.dumps(source, sort_keys=True))
+
+	tmp_file = output_file + ".tmp"
+	with open(tmp_file, "wb") as fp:
+		np.savez(fp, **arrays)
+	os.replace(tmp_file, output_file)
+
+# the doc names of a pre-processed run as a single utf-8 array of bytes, one name per line
+# (far smaller and faster to read than a numpy array of fixed size strings)
+def encode_doc_names(doc_names):
+	return np.frombuffer("\n".join(doc_names).encode("utf-8"), dtype=np.uint8)
+
+def decode_doc_names(encoded):
+	if len(encoded) == 0:
+		return []
+	return encoded.tobytes().decode("utf-8").split("\n")
+
+# reads a pre-processed run written by write_preprocessed_matrix
+#
+# RETURNS: a dict {topic: (docs, relevances)}, docs a numpy int32 array of interned doc ids (see doc_ids_lib)
+# and relevances a numpy int8 array, both in rank order and as long as the topic
+def read_preprocessed_matrix(path):
+	with np.load(path) as data:
+		topics = data["topics"].tolist()
+		lengths = data["lengths"].tolist()
+		relevances = data["relevances"]
+		docs = data["docs"]
+		interned = intern_doc_ids(decode_doc_names(data["doc_names"]))
+
+	preprocessed = {}
+	for row, topic in enumerate(topics):
+		length = lengths[row]
+		preprocessed[topic] = (interned[docs[row, :length]], relevances[row, :length])
+	return preprocessed
+
+# RETURNS: the identity of the run a pre-processed run comes from (see get_run_source), None if it's not known
+# (a text file, or a .npz written before the identity was kept)
+def read_preprocessed_source(path):
+	if not path.endswith(".npz"):
+		return None
+	with np.load(path) as data:
+		if not "source" in data.files:
+			return None
+		return json.loads(str(data["source"]))
+
+# the topic and the (interned) doc of every line of a run, in file order: the run is split in columns at once,
+# see tokenizer_lib.parse_run_columns
+#
+# RETURNS: a numpy array with the topic id (str) of each line and a numpy int32 array with its doc id
+def read_text_topic_doc_columns(run_file):
+	columns = parse_run_columns(run_file, number_docs=False)
+	return columns["topic_ids"][columns["topics"]], intern_doc_ids(columns["doc_names"])
@@ -6,10 +6,22 @@
 
 
 import os
+import json
+import heapq
 import random
 import numpy 		as 		np
 from 	itertools	import 	*
 import shutil
+from 	concurrent.futures 	import 	ProcessPoolExecutor, as_completed
+from 	lib.doc_ids_lib 	import 	*
+from 	lib.basic_retrieval_helpers 	import 	top_k_indices, iterate_merged_topic_blocks, get_run_name
+from 	lib.preprocessing_lib 	import 	read_preprocessed_matrix, read_preprocessed_source, get_run_source
+from 	lib.run_writer_lib 	import 	TrecRunWriter
+from 	lib.compression_lib 	import 	open_text_file
+from 	lib.instrumentation_lib 	import 	instrumented, instrumented_stage, add_counters, run_instrumented, merge_instrumentation_records, is_instrumentation_enabled, get_stage_config
+
+# data shared by the configurations of a sweep, loaded once per process (see load_sweep_data)
+sweep_data = {}
 
 def clean_out_files(output_folder):
 	
@@ -26,9 +38,10 @@ def clean_out_files(output_folder):
 def check_relevances_exist(path):
 	if not os.path.isdir(path):
 		raise Exception("Expecting a folder "+path)
-	n_files = len(os.listdir(path))
-	if n_files != 10:
-		raise Exception("Expecting 10 files like 'rel1.txt' in the relevances folder, got "+str(n_files))
+	# a run may have both its .npz and an old .txt pre-processed file
+	n_runs = len(set(f.split('_')[0] for f in os.listdir(path)))
+	if n_runs == 0:
+		raise Exception("Expecting the pre-processed files of the runs (like '1_preprocessed.npz') in the relevances folder "+path+", found none")
 
 
 
@@ -75,267 +88,782 @@ def extract_params(path):
 # 
 # out: output file
 # scores: dict with the following shape {topic: {doc: its_score__within_the_topic}}
+# depth: how many documents we keep for each topic (=1000, like the original runs)
+# precision=None: decimals of the scores; None to write them in full (see run_writer_lib)
+#
+# The run is written in out.tmp and renamed to out only once it's complete: a sweep that stops
+# in the middle never leaves a truncated run behind.
 #
 # RETURNS: nothing.
-def print_scores_to_file(out, scores):
+@instrumented()
+def print_scores_to_file(out, scores, depth=1000, precision=None):
 
-	with open(out, 'w') as writer:
-		# To properly write down the output, the topics must be ordered from 351 to 400.
+	with TrecRunWriter(out, "ProbFuse2006", precision, atomic=True) as writer:
+		# To properly write down the output, the topics must be ordered (e.g. from 351 to 400).
 		for topic in sorted(scores):
 			# docs contains all the docuents inside this particular topic.
-			i = 0
 			docs = scores[topic]
-			lines = []
 
 			# obviously, we want our documents to be ranked from the highest-scored to the lowest one.
-			for doc in sorted(docs, key=docs.get, reverse=True)[:1000]:
-				lines.append(str(topic)+" Q0 "+doc+" "+str(i)+" "+str(docs[doc])+" ProbFuse2006")
-				i+=1
+			# nlargest only keeps the best 'depth' documents instead of sorting all of them,
+			# and it breaks ties exactly like sorted(..., reverse=True) does.
+			ranking = heapq.nlargest(depth, docs, key=docs.get)
+			writer.write_topic(topic, ranking, [docs[doc] for doc in ranking])
+
+# Same as print_scores_to_file, for the scores of score_preprocessed: {topic: (doc_ids, scores)}.
+# The documents with the same score keep the order they have in doc_ids (like heapq.nlargest does on a dict),
+# and only here the interned doc ids are turned back into their names.
+#
+# RETURNS: nothing.
+@instrumented()
+def print_interned_scores_to_file(out, scores, depth=1000, precision=None):
 
-			for line in lines:
-				writer.write(line.strip()+"\n")
+	with TrecRunWriter(out, "ProbFuse2006", precision, atomic=True) as writer:
+		for topic in sorted(scores):
+			doc_ids, doc_scores = scores[topic]
+			ranking = top_k_indices(doc_scores, depth)
+			writer.write_topic(topic, get_doc_names(doc_ids[ranking]), doc_scores[ranking])
+
+# This function reads the pre-processed files once and keeps them in memory, so that they can be
+# used for every (X, t, judged) configuration without scanning the files again.
+# The binary files written by the pre-processing ("N_preprocessed.npz", see preprocessing_lib.write_preprocessed_matrix)
+# are loaded without any parsing; the old text files ("N_preprocessed.txt") are still read when a run has no .npz.
+# The runs are kept in the order of their index, so that the result doesn't depend on the order of os.listdir.
+#
+# in_path: relative input path, string
+#
+# RETURNS: a dict with shape {run: {topic: (docs, relevances)}}, where docs is a numpy int32 array with the
+# (interned, see doc_ids_lib) documents of the topic in rank order and relevances is a numpy int8 array with their relevance scores:
+# 1 (relevant), 0 (not relevant) or -1 (not graded)
+@instrumented()
+def load_preprocessed_scores(in_path):
 
-# Given the dimension of the topics in our data (=1000) and the number of segments we want to split
-# our data in, this function computes the segment sizes for each segment.
-# Why wouldn't each segment have different lengths? Check the comments in the function if you're interested.
-# 
-# topic_dim: =1000
-# n_segments: the number of segments we split our data in.
+	run_files = get_preprocessed_files(in_path)
+
+	preprocessed = {}
+	for run_idx in sorted(run_files):
+		if run_files[run_idx].endswith(".npz"):
+			preprocessed[run_idx] = read_preprocessed_matrix(in_path+"/"+run_files[run_idx])
+		else:
+			preprocessed[run_idx] = read_preprocessed_text(in_path+"/"+run_files[run_idx])
+		add_counters(files_opened=1, bytes_read=os.path.getsize(in_path+"/"+run_files[run_idx]))
+
+	return preprocessed
+
+# The pre-processed file of each run in in_path: a .npz wins over a .txt of the same run.
 #
-# RETURNS: a vector of shape [seg1size, seg(n_segments)size] containing the sizes we want.
-def compute_segment_sizes(n_segments, topic_dim):
-	# Computing the segment sizes. We're assuming that each topic has constant size (=1000 by default).
-	# This phase is extra delicate and it required a little reasoning on paper sheets.
-	#
-	# If "topic_dim/n_segments" (= segment size) is an integer, then we have no problems whatsoever.
-	#
-	# If "topic_dim/n_segments" is a fractional number, we've got some rounding problems.
-	# (i.e. "1000/150" = 6.66666667 = ...?)
-	# 
-	# We've decided to split the segments as it follows:
-	# The decimal part of that ratio will represents the proportion between "larger" segments and "smaller" ones,
-	# where with "larger" segments we mean those segments which size will be rounded up (ceiling),
-	# and with "smaller" segments we mean those segments which size will be rounded down (floor).
-	# Keeping this ratio between larger and smaller sets will give equilibrium between segments sizes
-	# and it also will prevent silly bugs, like having empty segments (if we only round up(,
-	# or having more segments than we expect (if we only round down).
-	# Also, we decide to just create a segment_sizes VECTOR ([size_of_first_seg, size_of_second_seg, ...])
-	# and return it for future use, because of a performance (time complexity) factor.
-	#
-	# EXAMPLE: X=150 segments; 1000/150 --> 6.666... --> 0.66*150 = 100, number of rounded up segments
-	# (= segments of size 7); (1-0.66)*150 = 50, number of rounded down segments (= segments of size 6)
-	# 
-	# Now, this solution would introduce another rounding problem (e.g. 0.66*150 = 99), so, to prevent this mess,
-	# we get the correct proportion by remembering the reminder (100), rather than 0.66 (=100/150)
-
-	seg_rough_size 	= topic_dim/n_segments
-	rounded_down 	= int(seg_rough_size)
-	# this init might look weird, but it will be fixed below if we have rounding problems
-	# if we don't have any problems, then it's fair to have rounded_up = rounded_down.
-	rounded_up 		= rounded_down
-	# ... we should decide how many rounded up and down segments we want.
-	# the # of "rounded up" segments is exactly the reminder, following the reasoning done above.
-	remainder 		= topic_dim%n_segments
-
-	# if we haven't got any rounding problems, ...
-	if not (remainder==0):
-		# there's not "rounded_up", really: we just replace the variable to make it easier to compute later.
-		rounded_up 	+= 1
-
-	# the following list will be, as discussed, something like: [seg1size, seg2size, ..., seg(n_segments)size]
-	segment_sizes 			=	[rounded_up for x in range(remainder)]
-	segment_sizes.extend		([rounded_down for x in range(n_segments-remainder)])
-
-	return segment_sizes
+# RETURNS: a dict {run: file name}
+def get_preprocessed_files(in_path):
+	run_files = {}
+	for file in sorted(os.listdir(in_path), key=lambda f: f.endswith(".npz")):
+		# extracting the run we're analyizing from the input file:
+		# we need run_idx to be an integer index (e.g. between 1 and 10 for ten runs).
+		run_name = file.strip().split('_')[0]
+		if not run_name.isdigit():
+			raise Exception("Unexpected pre-processed file "+in_path+"/"+file+": its name should start with the number of its run, like '1_preprocessed.npz'")
+		run_files[int(run_name)] = file
+
+	if len(run_files) == 0:
+		raise Exception("Expecting the pre-processed runs in "+in_path+"/, 1 file per run. Got none.")
+	return run_files
+
+# The identity of the .res file each pre-processed run of in_path comes from (see preprocessing_lib.get_run_source).
+#
+# RETURNS: a dict {run: {"file": name, "size": bytes, "sha1": digest}}, None for a run whose source isn't known
+def load_preprocessed_sources(in_path):
+	run_files = get_preprocessed_files(in_path)
+	return {run_idx: read_preprocessed_source(in_path+"/"+run_files[run_idx]) for run_idx in sorted(run_files)}
+
+# Reads a pre-processed text file, with a "topic doc relevance" line for each document of the run.
+#
+# RETURNS: the same dict {topic: (docs, relevances)} of preprocessing_lib.read_preprocessed_matrix
+def read_preprocessed_text(path):
+	docs = {}
+	relevances = {}
+
+	with open_text_file(path) as fp:
+		for line in fp:
+			elements = line.strip().split(' ')
+
+			if not (len(elements)==3):
+				raise Exception("Something's wrong in the pre-processed files. I've got a line with "+str(len(elements))+" elements: "+line)
+
+			topic = int(elements[0])
+			if not topic in docs:
+				docs[topic] = []
+				relevances[topic] = []
+			docs[topic].append(elements[1])
+			relevances[topic].append(int(elements[2]))
+
+	preprocessed = {}
+	for topic in docs:
+		preprocessed[topic] = (intern_doc_ids(docs[topic]), np.array(relevances[topic], dtype=np.int8))
+	return preprocessed
+
+# All the topics of the pre-processed data: the runs don't need to have retrieved documents for the same topics.
+#
+# RETURNS: the sorted list of the topics retrieved by at least one run
+def get_preprocessed_topics(preprocessed):
+	return sorted(set(chain.from_iterable(preprocessed[run_idx] for run_idx in preprocessed)))
+
+# The depth of a topic in a run: how many documents the run has retrieved for it, at most topic_dim.
+def get_topic_depth(n_docs, topic_dim=None):
+	if topic_dim is None:
+		return n_docs
+	return min(n_docs, topic_dim)
+
+# Given the pre-processed data (see load_preprocessed_scores), this function builds, for each run,
+# the cumulative counts of relevant and not relevant documents along the ranks of each topic.
+# With them, the number of relevant documents in any segment [start, end) of a topic is just
+# relevant[topic_row][end] - relevant[topic_row][start]: no matter X, the data is scanned only once.
+#
+# preprocessed: the output of load_preprocessed_scores
+# topic_dim=None: documents beyond topic_dim are not in any segment; None to keep every retrieved document.
+#
+# RETURNS: a dict with shape {run: {"rows": {topic: row}, "depths": depth of each row, "relevant": cumsum, "not_relevant": cumsum}},
+# where the two cumsums are numpy arrays with shape [n_topics, max depth+1] (the first column is zero)
+@instrumented()
+def build_relevance_index(preprocessed, topic_dim=None):
+	relevance_index = {}
+
+	for run_idx in preprocessed:
+		topics = sorted(preprocessed[run_idx])
+		depths = np.array([get_topic_depth(len(preprocessed[run_idx][topic][1]), topic_dim) for topic in topics], dtype=np.int64)
+		width = int(depths.max()) if len(depths) > 0 else 0
+
+		are_rel 	= np.zeros((len(topics), width), dtype=np.int32)
+		arent_rel 	= np.zeros((len(topics), width), dtype=np.int32)
+
+		for row, topic in enumerate(topics):
+			relevances = preprocessed[run_idx][topic][1][:depths[row]]
+			are_rel[row, :len(relevances)] 		= (relevances==1)
+			arent_rel[row, :len(relevances)] 	= (relevances==0)
+
+		# beyond the depth of a topic the cumsums stay constant
+		relevant 		= np.zeros((len(topics), width+1), dtype=np.int32)
+		not_relevant 	= np.zeros((len(topics), width+1), dtype=np.int32)
+		np.cumsum(are_rel, axis=1, out=relevant[:, 1:])
+		np.cumsum(arent_rel, axis=1, out=not_relevant[:, 1:])
+
+		relevance_index[run_idx] = {
+			"rows": {topic: row for row, topic in enumerate(topics)},
+			"depths": depths,
+			"relevant": relevant,
+			"not_relevant": not_relevant,
+		}
+
+	return relevance_index
+
+# The segment boundaries of topics with the given depths (a number, or a numpy array of them).
+# When depth/n_segments is not an integer the segments can't all have the same size: the first depth%n_segments
+# segments have one more document (e.g. 1000 documents in 150 segments: 100 segments of 7 and 50 of 6),
+# so that no segment is empty and there are exactly n_segments of them.
+# Segment s (starting from 0) goes from boundaries[s] (included) to boundaries[s+1] (excluded).
+#
+# RETURNS: a numpy array [0, end_of_seg1, end_of_seg2, ..., depth] for each depth (shape depths.shape + [n_segments+1])
+def compute_segment_boundaries(n_segments, depths):
+	depths = np.asarray(depths, dtype=np.int64)[..., None]
+	segments = np.arange(n_segments+1)
+	return segments * (depths // n_segments) + np.minimum(segments, depths % n_segments)
+
+# The segment (starting from 0) of each rank of a topic with the given depth.
+#
+# RETURNS: a numpy array with depth elements
+def get_rank_segments(n_segments, depth):
+	return np.repeat(np.arange(n_segments), np.diff(compute_segment_boundaries(n_segments, depth)))
+
+# Counts the relevant and not relevant documents in each segment of the training topics of a run,
+# by looking up the segment boundaries of each topic (which depend on its depth in the run)
+# in the cumulative counts of build_relevance_index.
+# A training topic the run hasn't got any document for simply counts zero everywhere.
+#
+# run_index: the entry of a run in the output of build_relevance_index
+# n_segments: number of segments we want to split the data with
+# training_topics: the topics used to train the model
+#
+# RETURNS: three numpy arrays [n_training_topics, n_segments]: the relevant and not relevant counts
+# and the size of each segment
+def count_segment_relevances(run_index, n_segments, training_topics):
+	are_rel 		= np.zeros((len(training_topics), n_segments))
+	arent_rel 		= np.zeros((len(training_topics), n_segments))
+	segment_sizes 	= np.zeros((len(training_topics), n_segments))
+
+	known = [i for i, t in enumerate(training_topics) if t in run_index["rows"]]
+	rows = [run_index["rows"][training_topics[i]] for i in known]
+	if len(rows) == 0:
+		return are_rel, arent_rel, segment_sizes
+
+	boundaries 		= compute_segment_boundaries(n_segments, run_index["depths"][rows])
+	relevant 		= run_index["relevant"][rows]
+	not_relevant 	= run_index["not_relevant"][rows]
+	are_rel[known] 		= np.take_along_axis(relevant, boundaries[:, 1:], 1) - np.take_along_axis(relevant, boundaries[:, :-1], 1)
+	arent_rel[known] 	= np.take_along_axis(not_relevant, boundaries[:, 1:], 1) - np.take_along_axis(not_relevant, boundaries[:, :-1], 1)
+	segment_sizes[known] = np.diff(boundaries, axis=1)
+
+	return are_rel, arent_rel, segment_sizes
+
+# The number of training topics of a split of n_topics topics: int(n_topics*t), at least 1.
+# With no training topics there would be nothing to train on (every probability would be 0/0).
+def get_n_training_topics(n_topics, training_perc):
+	n_training_topics = int(n_topics*training_perc)
+	if n_training_topics == 0:
+		raise ValueError("No training topics: t="+str(training_perc)+" of "+str(n_topics)+" topics gives int("+str(n_topics*training_perc)+") = 0 of them")
+	return n_training_topics
+
+# Same check for the training topics given to train a model (n_training_topics of them).
+def check_n_training_topics(n_training_topics):
+	if n_training_topics == 0:
+		raise ValueError("No training topics: the probability of a segment is its average over the training topics")
+
+# The counting pass of ProbFuse: for each run, how many relevant and not relevant documents
+# each training topic has got in each segment. These counts are everything ProbFuseAll and
+# ProbFuseJudged need, so both algorithms can be trained from the same pass.
+#
+# relevance_index: the output of build_relevance_index
+# n_segments: number of segments we want to split the data with
+# training_topics: the topics used to train the model
+#
+# RETURNS: a dict with shape {run: (are_rel, arent_rel, segment_sizes)}, see count_segment_relevances
+def compute_segment_counts(relevance_index, n_segments, training_topics):
+	segment_counts = {}
+	for run_idx in relevance_index:
+		# counters; they're like: [topic][segment] = count, one row per training topic
+		segment_counts[run_idx] = count_segment_relevances(relevance_index[run_idx], n_segments, training_topics)
+	return segment_counts
+
+# Given the counts of compute_segment_counts, this function computes the probability p of a document
+# in a segment s to be relevant, for each run and for each segment.
+#
+# segment_counts: the output of compute_segment_counts
+# n_segments: number of segments we want to split the data with
+# judged: if you want to perform the probFuseJudged algorithm; =False if you want ProbFuseAll
+#
+# RETURNS: a "probability" dict; shape: {run: {s: p}}
+def probabilities_from_counts(segment_counts, n_segments, judged):
+	probability_dict = {}
+
+	for run_idx in segment_counts:
+		are_rel, arent_rel, segment_sizes = segment_counts[run_idx]
+		n_training_topics = are_rel.shape[0]
+		check_n_training_topics(n_training_topics)
+
+		s = compute_segment_ratios(are_rel, arent_rel, segment_sizes, judged).sum(axis=0)
+
+		# these "+1" are needed to let this dictionary make sense
+		# e.g. "{run1: {seg1: 0.123, seg2: 0.321, ...}, ...}"
+		# something like {run0: {seg0: ...}, ...} would be less readable in our opinion
+		probability_dict[run_idx] = {seg+1: float(s[seg]/n_training_topics) for seg in range(n_segments)}
+
+	return probability_dict
+
+# The contribution of each topic to the probability of each segment: the fraction of relevant documents
+# among the judged ones (ProbFuseJudged) or among all the documents of the segment (ProbFuseAll).
+#
+# are_rel, arent_rel: relevant and not relevant counts, [n_topics, n_segments] (see count_segment_relevances)
+# segment_sizes: numpy array with the size of each segment, [n_topics, n_segments] or just [n_segments]
+# judged: if you want to perform the probFuseJudged algorithm; =False if you want ProbFuseAll
+#
+# RETURNS: a numpy array [n_topics, n_segments]
+def compute_segment_ratios(are_rel, arent_rel, segment_sizes, judged):
+	ratios = np.zeros(are_rel.shape)
+
+	# here's the main difference between ProbFuseAll and ProbFuseJudged:
+	if(judged):
+		# It is likely that rel + not_rel will be > 0, or it would mean
+		# to have ALL documents unjudged in a fixed segment/topic.
+		# rel+not_rel==0 is more likely to happen with high X and low t%:
+		# therefore, we just stay cautious and avoid dividing by zero.
+		judged_docs = are_rel + arent_rel
+		np.divide(are_rel, judged_docs, out=ratios, where=(judged_docs!=0))
+	else:
+		# empty segments (more segments than documents) can't contain relevant documents
+		np.divide(are_rel, segment_sizes, out=ratios, where=(segment_sizes!=0))
+
+	return ratios
+
+# Same as compute_segment_counts + probabilities_from_counts, but for many training splits at once
+# (e.g. the repetitions of a configuration). The segment counts of each topic are computed only once;
+# each split then adds up the rows of its training topics, in the order of the split, as probabilities_from_counts
+# does: the probabilities are the very same (to the last bit) of ProbFuse.fit on that split, and so are the ties.
+#
+# relevance_index: the output of build_relevance_index
+# n_segments: number of segments we want to split the data with
+# training_splits: a list of training topics lists, one per repetition
+# judged_choices: which algorithms to train, ProbFuseJudged (True) and/or ProbFuseAll (False)
+#
+# RETURNS: a dict {judged: [probability dict of the 1st split, of the 2nd split, ...]},
+# each probability dict with shape {run: {s: p}}
+@instrumented()
+def compute_repeated_probabilities(relevance_index, n_segments, training_splits, judged_choices):
+	topics = sorted(set(chain.from_iterable(training_splits)))
+	rows = {topic: i for i, topic in enumerate(topics)}
+	split_rows = [[rows[t] for t in training_topics] for training_topics in training_splits]
+	for training_rows in split_rows:
+		check_n_training_topics(len(training_rows))
+
+	probabilities = {judge: [{} for split in training_splits] for judge in judged_choices}
+	for run_idx in relevance_index:
+		# one counting pass for every split and for both algorithms
+		are_rel, arent_rel, segment_sizes = count_segment_relevances(relevance_index[run_idx], n_segments, topics)
+
+		for judge in judged_choices:
+			ratios = compute_segment_ratios(are_rel, arent_rel, segment_sizes, judge)
+
+			for r, training_rows in enumerate(split_rows):
+				s = ratios[training_rows].sum(axis=0)
+				probabilities[judge][r][run_idx] = {seg+1: float(s[seg]/len(training_rows)) for seg in range(n_segments)}
+
+	return probabilities
 
 # Given the input set (file path to it), the # of segments, the # of training queries and the judged/all algorithm type,
 # this function computes the probability p of a document in a segment s to be relevant, for each run and for each segment.
+# The segments of each topic of each run are computed on the number of documents the run has retrieved for it.
 # 
 # in_path: relative input path, string
 # n_segments: number of segments we want to split the data with
-# n_training_topics: how many training topics we've got
+# training_topics: the topics used to train the model
 # judged: if you want to perform the probFuseJudged algorithm; =False if you want ProbFuseAll
-# n_topics: Fixed at 50 for this problem; makes no sense to change this parameter in this application
-# topic_dim: Each topic, by default, has 1000 documents. For our project, it makes no sense to change this.
+# topic_dim: documents beyond topic_dim are not in any segment; None to keep every retrieved document
+# relevance_index: the output of build_relevance_index; if it's None, it is built from in_path.
+#   Build it once and pass it along when computing many configurations: every X reuses the same index.
 #
 # RETURNS: a "probability" dict; shape: {run: {s: p}},
 # where p is the probability that a document in segment is relevant (within run)
-def compute_probabilities(in_path, n_segments, training_topics, judged, n_topics, topic_dim):
-
-	# probability dictionary; shape: {run: {segment: p}},
-	# where p is the probability that a document in the segment is relevant (within the run)
-	probability_dict = {}
-	
-	# extracting all the input files from our input directory
-	file_list = [f for f in os.listdir(in_path)]
-	if len(file_list) != 10:
-		raise Exception("Expecting exactly 10 pre-processed files in "+in_path+"/, 1 per run. Got "+len(file_list)+".")
+@instrumented()
+def compute_probabilities(in_path, n_segments, training_topics, judged, *, topic_dim=None, relevance_index=None):
 
+	if relevance_index is None:
+		relevance_index = build_relevance_index(load_preprocessed_scores(in_path), topic_dim)
 
-	# As a reminder, we know that sizes are the same for each run and for each topic
-	# (we always get 1000/n_segments), so we need to do this computation just once.
-	segment_sizes = compute_segment_sizes(n_segments, topic_dim)
-
-	# for each run
-	for file in file_list:
-		# extracting the run we're analyizing from the input file:
-		# we need run_idx to be an integer index between 0 and 9.
-		run_idx = int(file.strip().split('_')[0])
-		# initialization for the current run: it must contain a dict itself
-		probability_dict[run_idx] = {}
-		# counter re-init; they should be like: {topic: [segment1count, segment2count, ...]}
-		are_rel 	= {}
-		arent_rel 	= {}
-		# file path
-		file_path = in_path+"/"+file
-
-		# document counters: "how many documents have we scanned in this topic, yet?"
-		i=0
-		# re-initialize the segment_idx every time we've done a run.
-		segment_idx=0
-
-		# For every file (run), we now count all the occurencies of "1"s (relevant) and "0"s (not relevant)
-		with open(file_path) as fp:
-			for line in fp:
-				# extract, strip and get the line from the file
-				line = line.strip()
-				elements = line.split(' ')
-
-				if not (len(elements)==3):
-					raise Exception("Something's wrong in the pre-processed files. I've got a line with "+len(elements)+" elements: "+line)
-				
-				# Since we've got topics between 351 and 400, the following number will be \in [351,400].
-				topic = int(elements[0])
-				# since we're training our algorithm, just read the topics that are \in training_topics.
-				if (topic in training_topics):
-					# Relevance scores can be either 1 (relevant), 0 (not relevant) or -1 (not graded)
-					rel_score 	= int(elements[2])
-					# If a new topic is encountered, initialize the lists: are_rel[topic] = [seg0(topic)rel_count, ...],
-					# where seg0 -> seg1, etc.
-					# Also, reset the document counter and the segment counter from zero
-					if not topic in are_rel:
-						are_rel[topic] 					= np.zeros(n_segments)
-						arent_rel[topic] 				= np.zeros(n_segments)
-						i=0
-						segment_idx=0
-
-					if (rel_score==1):
-						are_rel[topic][segment_idx]		+= 1
-					if (rel_score==0):
-						arent_rel[topic][segment_idx]	+= 1
-
-					# we've added a document to this segment: +1! :D
-					i+=1
-
-					# if we've filled this segment, go to the next one and re-initialize the doc counter
-					if(i>=segment_sizes[segment_idx]):
-						segment_idx+=1
-						i=0
-
-		# now that we have the counters, we can compute the probabilities we need,
-		# for each possible segment
-		for seg in range(n_segments):
-			# sum init
-			s = 0
-
-			# here's the main difference between ProbFuseAll and ProbFuseJudged:
-			if(judged):
-				for t in training_topics:
-					# It is likely that rel + not_rel will be > 0, or it would mean
-					# to have ALL documents unjudged in a fixed segment/topic.
-					# rel+not_rel==0 is more likely to happen with high X and low t%:
-					# therefore, we just stay cautious and avoid dividing by zero.
-					if not (are_rel[t][seg] + arent_rel[t][seg]==0):
-						s += are_rel[t][seg]/(are_rel[t][seg]+arent_rel[t][seg])
-			else:
-				for t in training_topics:
-					s += are_rel[t][seg]/(segment_sizes[seg])
+	segment_counts = compute_segment_counts(relevance_index, n_segments, training_topics)
+	return probabilities_from_counts(segment_counts, n_segments, judged)
 
-			# these "+1" are needed to let this dictionary make sense
-			# e.g. "{run1: {seg1: 0.123, seg2: 0.321, ...}, ...}"
-			# something like {run0: {seg0: ...}, ...} would be less readable in our opinion
-			probability_dict[run_idx][seg+1] = s/len(training_topics)
-
-	return probability_dict
-
-# Given the input files (the documents) and the pre-evaluated probabilities, this function will compute the  
-# the scores of all the documents retrieved by the 10 IR models.
-# Note that this function will automatically keep track of the segments the documents are in.
-# in_path: our input folder
+# Given the pre-processed runs (see load_preprocessed_scores) and the trained probabilities, this function
+# computes the scores of all the documents retrieved by the runs, for the topics that are not used for training.
+# The score a run gives to the document in a certain rank only depends on the segment of that rank
+# (the segments of a topic are computed on the number of documents the run has retrieved for it),
+# so the weights probability/segment are computed once per run; then, for each topic, the weights of
+# every run are added up per document with a single bincount over the interned doc ids.
+#
+# preprocessed: the output of load_preprocessed_scores
 # probabilities: data structure containing the probabilities {run: {segment: P(doc_in_this_segment | this_run)}}
-# training_topics: data structure containing which topics are used to perform the training process, e.g. [topic371, ...]
+# training_topics: which topics are used to perform the training process; they are not scored
 # n_segments: how many segments do we split our documents in?
-# topic_dim: how much large is a topic? (default: 1000)
+# topic_dim=None: documents beyond topic_dim are not scored; None to score every retrieved document
 #
-# RETURNS: a dict "scores" with shape {topic: {doc: its_score__within_the_topic}}
-def score_evaluate(in_path, probabilities, training_topics, n_segments, topic_dim):
-
-	file_list = [f for f in os.listdir(in_path)]
-
-	# we assume that file_list has 10 files, at this point;
-	# if there was a problem with our input files, we would have noticed by now.
+# RETURNS: a dict "scores" with shape {topic: (doc_ids, scores)}: the interned documents of the topic, in order
+# of first appearance (runs in the order of preprocessed), and their scores; see print_interned_scores_to_file
+@instrumented()
+def score_preprocessed(preprocessed, probabilities, training_topics, n_segments, topic_dim=None):
+
+	training_topics = set(training_topics)
+	# segment (from 0 to n_segments-1) of each rank, for each depth found so far
+	rank_segments = {}
+
+	# {topic: [(docs, weights) of a run, ...]}
+	entries = {}
+	for run_idx in preprocessed:
+		segment_weights = get_segment_weights(probabilities[run_idx], n_segments)
+
+		for topic in preprocessed[run_idx]:
+			# since we use the training topics to train our algorithm, it makes no sense to score them
+			if topic in training_topics:
+				continue
+
+			# the segments depend on how many documents the run has retrieved for the topic
+			docs = preprocessed[run_idx][topic][0]
+			depth = get_topic_depth(len(docs), topic_dim)
+			if not depth in rank_segments:
+				rank_segments[depth] = get_rank_segments(n_segments, depth)
+
+			if not topic in entries:
+				entries[topic] = []
+			entries[topic].append( (docs[:depth], segment_weights[rank_segments[depth]]) )
+			add_counters(docs=depth)
 
-	# output init
 	scores = {}
-	segment_sizes = compute_segment_sizes(n_segments, topic_dim)
-	# for each run:
-	for file in file_list:
-		# extracting the run we're analyizing from the input file:
-		# we need run_idx to be an integer index between 1 and 10.
-		run_idx = int(file.strip().split('_')[0])
-		
-		# file path
-		file_path = in_path+"/"+file
-
-		# document counters: "how many documents have we scanned in this topic, yet?"
-		i=0
-		# re-initialize the segment_idx every time we've done a run.
-		segment_idx=1
-		# we need to keep track of which topic we're extracting
-		current_topic=351
-		# For every file (run), we now compute the score for each document
-		with open(file_path) as fp:
-			# since we use the training topics to train our algorithm, it makes no sense
-			for line in fp:
-
-				line = line.strip()
-				elements = line.split(' ')
-				topic = int(elements[0])
-				if not (topic in training_topics):
-					doc = elements[1]
-
-					# if we've never encountered this topic, we better initialize the dict
-					if not topic in scores:
-						scores[topic] = {}
-					
-					# if the document has never been encountered in this topic, we'll initialize its score.
-					if not doc in scores[topic]:
-						scores[topic][doc] = 0
-
-					# also, with a new topic, the doc counter and the segment index should be re-initalized
-					if(topic!=current_topic):
-						i=0
-						segment_idx=1
-						current_topic = topic
-
-					scores[topic][doc] += probabilities[run_idx][segment_idx]/segment_idx
-
-					# we've added a document to this segment: +1! :D
-					i+=1
-
-					# be aware that in this case segment_idx starts at 1 and goes up to n_segments:
-					# our segment_sizes is an array, and therefore accepts indexes between 0 and n_segments-1.
-					if(i>=segment_sizes[segment_idx-1]):
-						segment_idx+=1
-						i=0
+	for topic in entries:
+		doc_ids, groups = group_by_first_appearance(np.concatenate([e[0] for e in entries[topic]]))
+		# bincount adds the weights in order, run after run: the very same sums of a dict accumulation
+		weights = np.concatenate([e[1] for e in entries[topic]])
+		scores[topic] = (doc_ids, np.bincount(groups, weights=weights, minlength=len(doc_ids)))
 
 	return scores
 
-# Our core function: it takes the input path of the 10 runs, the output path where it will write
+# The score a run gives to a document in segment s: P(relevant | s, run)/s (see score_preprocessed).
+#
+# run_probabilities: the probabilities of a run, {segment: p}
+#
+# RETURNS: a numpy array with the weight of each segment (the weight of segment s is at index s-1)
+def get_segment_weights(run_probabilities, n_segments):
+	return np.array([run_probabilities[seg]/seg for seg in range(1, n_segments+1)])
+
+# Same as score_preprocessed, but for a single query: the ranked lists of some runs, as they come
+# (e.g. from the retrieval systems behind a metasearch service), are fused on the fly.
+# The segments of a list are computed on its length, like those of a topic in score_preprocessed.
+# The doc names are numbered in a dict local to the query, not interned: a long running process would
+# otherwise keep every doc name it has ever seen.
+#
+# segment_weights: {run: numpy array of the weights of its segments} (see get_segment_weights)
+# n_segments: how many segments the weights have been computed for
+# ranked_lists: {run: [doc names, in rank order]}; the runs must be among those of segment_weights
+# depth=1000: how many documents of the fused ranking are returned
+# topic_dim=None: documents beyond topic_dim are not scored; None to score every document of the lists
+# rank_segments=None: a dict {depth: segment of each rank} kept by the caller, to compute the segments
+#   of each list length only once over many queries (see get_rank_segments)
+#
+# RETURNS: the fused ranking, a list of (doc name, score) from the best to the worst; documents with the
+# same score keep the order they're first found in (runs in the order of ranked_lists)
+def score_ranked_lists(segment_weights, n_segments, ranked_lists, depth=1000, topic_dim=None, rank_segments=None):
+	if rank_segments is None:
+		rank_segments = {}
+
+	doc_index 	= {}
+	groups 		= []
+	weights 	= []
+	for run in ranked_lists:
+		if not run in segment_weights:
+			raise Exception("Unknown run '"+str(run)+"': the probabilities are known for the runs "+str(sorted(segment_weights)))
+
+		docs = ranked_lists[run][:get_topic_depth(len(ranked_lists[run]), topic_dim)]
+		if not len(docs) in rank_segments:
+			rank_segments[len(docs)] = get_rank_segments(n_segments, len(docs))
+
+		groups.extend(doc_index.setdefault(doc, len(doc_index)) for doc in docs)
+		weights.append(segment_weights[run][rank_segments[len(docs)]])
+
+	if len(groups) == 0:
+		return []
+
+	scores = np.bincount(groups, weights=np.concatenate(weights), minlength=len(doc_index))
+	ranking = top_k_indices(scores, depth).tolist()
+	doc_names = list(doc_index)
+	return [(doc_names[i], float(scores[i])) for i in ranking]
+
+# bump this when the layout of the model files changes (see ProbFuse.save)
+probfuse_model_version = 2
+
+# how the runs given to a trained model are checked against the ones it has been trained on (see ProbFuse.check_run_sources):
+#   "content"  the very same files: same name, size and sha1
+#   "name"     files with the same names, e.g. the runs of new topics of the same systems
+#   "none"     not checked: only the run numbers must be known to the model
+run_check_levels = ["content", "name", "none"]
+
+# A trained ProbFuse model: the probability table {run: {segment: p}} of compute_probabilities, together
+# with everything needed to use it again: X, t, the algorithm (judged/all), the training topics and the runs.
+# Train it once with fit, save it, and then score new topics (or single queries, see score_ranked_lists)
+# without paying the training again:
+#
+#   model = ProbFuse(25, 0.5, judged=True).fit(preprocessed)
+#   model.save("output/probfuse_model.npz")
+#   scores = ProbFuse.load("output/probfuse_model.npz").score(new_preprocessed)
+class ProbFuse:
+
+	# n_segments: X, the number of segments
+	# training_perc: t, the % of the topics used for training
+	# judged=True: ProbFuseJudged; =False for ProbFuseAll
+	# topic_dim=None: documents beyond topic_dim are not in any segment; None to keep every retrieved document
+	def __init__(self, n_segments, training_perc, judged=True, topic_dim=None):
+		self.n_segments 		= n_segments
+		self.training_perc 		= training_perc
+		self.judged 			= judged
+		self.topic_dim 			= topic_dim
+		# set by fit (or load)
+		self.probabilities 		= None
+		self.training_topics 	= None
+		self.runs 				= None
+		self.run_sources 		= None
+
+	# Trains the model on the pre-processed (judged) runs.
+	#
+	# preprocessed: the output of load_preprocessed_scores
+	# topics=None: the topics to draw the training topics from; None for all the topics retrieved by the runs
+	# training_topics=None: the training topics; if None, int(len(topics)*t) of them are drawn with rng
+	# relevance_index=None: the output of build_relevance_index, to avoid building it again
+	# rng=random: where the training topics are drawn from (e.g. random.Random(seed))
+	# run_sources=None: the identity of the .res file of each run, {run: source} (see load_preprocessed_sources),
+	#   saved with the model to check the runs it's used on later
+	#
+	# RETURNS: the model itself
+	def fit(self, preprocessed, topics=None, training_topics=None, relevance_index=None, rng=random, run_sources=None):
+		if relevance_index is None:
+			relevance_index = build_relevance_index(preprocessed, self.topic_dim)
+		if training_topics is None:
+			if topics is None:
+				topics = get_preprocessed_topics(preprocessed)
+			training_topics = rng.sample(sorted(topics), get_n_training_topics(len(topics), self.training_perc))
+
+		self.training_topics 	= list(training_topics)
+		self.probabilities 		= probabilities_from_counts(compute_segment_counts(relevance_index, self.n_segments, self.training_topics), self.n_segments, self.judged)
+		self.runs 				= list(self.probabilities)
+		self.run_sources 		= {run_idx: (run_sources or {}).get(run_idx) for run_idx in self.runs}
+		return self
+
+	def check_fitted(self):
+		if self.probabilities is None:
+			raise Exception("The ProbFuse model has not been trained yet: call fit (or load) first")
+
+	# Checks that the runs given to the model are the ones it has been trained on: a run number is only the
+	# folder the run was found in, the same number could now be another system. A run whose identity is not
+	# known (on either side, e.g. pre-processed in text) is not checked.
+	#
+	# run_sources: the identity of each run, {run: source} (see load_preprocessed_sources, preprocessing_lib.get_run_source)
+	# check_runs="content": one of run_check_levels
+	#
+	# RETURNS: nothing; a run that doesn't match is an error
+	def check_run_sources(self, run_sources, check_runs="content"):
+		self.check_fitted()
+		if not check_runs in run_check_levels:
+			raise Exception("Unknown check of the runs '"+str(check_runs)+"', expected one of "+str(run_check_levels))
+		for run_idx in run_sources:
+			if not run_idx in self.probabilities:
+				raise Exception("Unknown run "+str(run_idx)+": the model has been trained on the runs "+str(self.runs))
+			trained, given = self.run_sources.get(run_idx), run_sources[run_idx]
+			if check_runs == "none" or trained is None or given is None:
+				continue
+			if trained["file"] != given["file"]:
+				raise Exception("Run "+str(run_idx)+" is '"+given["file"]+"', but the model has been trained on '"+trained["file"]+"' as run "+str(run_idx))
+			if check_runs == "content" and (trained["size"] != given["size"] or trained["sha1"] != given["sha1"]):
+				raise Exception("Run "+str(run_idx)+" ('"+given["file"]+"') is not the file the model has been trained on (sha1 "+trained["sha1"]+"): "
+					+"pass check_runs=\"name\" to fuse other runs of the same systems")
+
+	# Scores the topics of some pre-processed runs (their relevances aren't used), which must be among the runs of the model.
+	#
+	# preprocessed: the output of load_preprocessed_scores
+	# skip_training=True: don't score the training topics, as the batch ProbFuse does
+	# run_sources=None: the identity of the runs of preprocessed (see load_preprocessed_sources), checked with check_run_sources
+	# check_runs="content": how they're checked, one of run_check_levels
+	#
+	# RETURNS: a dict "scores" with shape {topic: (doc_ids, scores)}, see score_preprocessed
+	def score(self, preprocessed, skip_training=True, run_sources=None, check_runs="content"):
+		self.check_fitted()
+		self.check_run_sources(run_sources if run_sources is not None else {run_idx: None for run_idx in preprocessed}, check_runs)
+
+		training_topics = self.training_topics if skip_training else []
+		return score_preprocessed(preprocessed, self.probabilities, training_topics, self.n_segments, self.topic_dim)
+
+	# RETURNS: the weights of the segments of each run, {run: numpy array} (see get_segment_weights)
+	def get_segment_weights(self):
+		self.check_fitted()
+		return {run_idx: get_segment_weights(self.probabilities[run_idx], self.n_segments) for run_idx in self.runs}
+
+	# Saves the model in a numpy .npz file with the arrays:
+	#   probabilities    float64 [n_runs, n_segments], the probability of each segment of each run
+	#   runs             int64 [n_runs], the run of each row of probabilities
+	#   training_topics  int64, the topics the model has been trained on
+	#   meta             a json string with X, t, judged, topic_dim, the version of the format and the identity
+	#                    of the .res file of each run (run_sources; null when it's not known)
+	# the file is written under a temporary name and then renamed.
+	#
+	# RETURNS: nothing.
+	def save(self, path):
+		self.check_fitted()
+		meta = {
+			"version": probfuse_model_version,
+			"n_segments": self.n_segments,
+			"training_perc": self.training_perc,
+			"judged": self.judged,
+			"topic_dim": self.topic_dim,
+			"run_sources": {str(run_idx): self.run_sources.get(run_idx) for run_idx in self.runs},
+		}
+		probabilities = np.array([[self.probabilities[run_idx][seg] for seg in range(1, self.n_segments+1)] for run_idx in self.runs], dtype=np.float64).reshape(len(self.runs), self.n_segments)
+
+		if os.path.dirname(path) != "":
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path+".tmp", "wb") as fp:
+			np.savez(fp, probabilities=probabilities, runs=np.array(self.runs, dtype=np.int64), training_topics=np.array(self.training_topics, dtype=np.int64), meta=np.array(json.dumps(meta)))
+		os.replace(path+".tmp", path)
+
+	# Loads a model written by save.
+	#
+	# RETURNS: the trained ProbFuse model
+	@staticmethod
+	def load(path):
+		if not os.path.isfile(path):
+			raise Exception("Cannot find the ProbFuse model '"+path+"'.")
+		with np.load(path) as data:
+			meta = json.loads(str(data["meta"]))
+			if meta.get("version") != probfuse_model_version:
+				raise Exception("The ProbFuse model '"+path+"' has version "+str(meta.get("version"))+", "+str(probfuse_model_version)+" expected: train it again")
+			probabilities = data["probabilities"]
+			runs = data["runs"].tolist()
+			training_topics = data["training_topics"].tolist()
+
+		model = ProbFuse(meta["n_segments"], meta["training_perc"], meta["judged"], meta["topic_dim"])
+		model.runs 				= runs
+		model.training_topics 	= training_topics
+		model.run_sources 		= {run_idx: meta["run_sources"].get(str(run_idx)) for run_idx in runs}
+		model.probabilities 	= {run_idx: {seg+1: float(p) for seg, p in enumerate(probabilities[row])} for row, run_idx in enumerate(runs)}
+		return model
+
+# Name of the ProbFuse algorithm: "ProbFuseJudged" or "ProbFuseAll"
+def get_probfuse_name(judged):
+	if judged:
+		return "ProbFuseJudged"
+	return "ProbFuseAll"
+
+# Name of the output file of a ProbFuse configuration, e.g. "ProbFuseJudged_25_0.5.res"
+# (followed by compression if it's given, e.g. "ProbFuseJudged_25_0.5.res.gz" for ".gz": see compression_lib)
+def get_probfuse_output_name(n_segments, training_perc, judged, compression=None):
+	return get_probfuse_name(judged)+"_"+str(n_segments)+"_"+str(training_perc)+".res"+(compression or "")
+
+# The name, size and modification time of every pre-processed file in in_path: it changes whenever
+# the pre-processing writes them again (like the fingerprint of the qrels in trec_eval_lib.load_qrels).
+def get_preprocessed_fingerprint(in_path):
+	fingerprint = []
+	for file in sorted(os.listdir(in_path)):
+		stat = os.stat(in_path+"/"+file)
+		fingerprint.append( (file, stat.st_size, stat.st_mtime_ns) )
+	return fingerprint
+
+# Loads the data needed by a sweep in the sweep_data global of this process, unless it's already there
+# and the pre-processed files haven't changed since it was loaded.
+# It's also the initializer of the worker processes of a parallel sweep: with the "fork" start method the
+# workers inherit the data loaded by the parent, otherwise each worker loads it once.
+def load_sweep_data(in_path, topic_dim):
+	key = (in_path, topic_dim, get_preprocessed_fingerprint(in_path))
+	if sweep_data.get("key") == key:
+		return
+	preprocessed = load_preprocessed_scores(in_path)
+	sweep_data["preprocessed"] = preprocessed
+	sweep_data["relevance_index"] = build_relevance_index(preprocessed, topic_dim)
+	sweep_data["topics"] = get_preprocessed_topics(preprocessed)
+	sweep_data["key"] = key
+
+# Forgets the data of the last sweep: the next one loads the pre-processed files again.
+def reset_sweep_data():
+	sweep_data.clear()
+
+# The training topics of a configuration of a sweep. They only depend on the seed of the sweep, on (X, t)
+# and on the repetition, so a sweep gives the same results no matter how many workers it runs on, or in which order.
+# topics: all the topics of the sweep, sorted (see get_preprocessed_topics)
+def get_sweep_training_topics(seed, n_segments, training_perc, topics, repetition=1):
+	key = str(seed)+"_"+str(n_segments)+"_"+str(training_perc)
+	if repetition > 1:
+		key += "_"+str(repetition)
+	rng = random.Random(key)
+	return rng.sample(topics, get_n_training_topics(len(topics), training_perc))
+
+# Where the fused runs of a repetition are written: the first one in out_folder,
+# the others in out_folder_2, out_folder_3, ... (e.g. output/probfuse/, output/probfuse_2/, ...)
+def get_repetition_folder(out_folder, repetition):
+	if repetition == 1:
+		return out_folder
+	folder = out_folder.rstrip("/")+"_"+str(repetition)
+	if out_folder.endswith("/"):
+		folder += "/"
+	return folder
+
+# Runs one (X, t) configuration of a sweep, for every algorithm in judged_choices and for every
+# repetition, on the data in sweep_data.
+#
+# RETURNS: a dict {(X, t, judged, repetition): path of the fused run}
+def run_sweep_configuration(out_folder, x, t, judged_choices, seed, topic_dim, out_depth, n_repetitions=1, out_precision=None, out_compression=None):
+	preprocessed = sweep_data["preprocessed"]
+	relevance_index = sweep_data["relevance_index"]
+
+	# the stages of the functions called here are recorded for this configuration
+	with instrumented_stage("probfuse_configuration", x=x, t=t):
+		training_splits = [get_sweep_training_topics(seed, x, t, sweep_data["topics"], r) for r in range(1, n_repetitions+1)]
+		# all the repetitions, ProbFuseJudged and ProbFuseAll are trained from the same counting pass
+		probabilities = compute_repeated_probabilities(relevance_index, x, training_splits, judged_choices)
+		add_counters(training_topics=sum(len(training_topics) for training_topics in training_splits))
+
+		out_paths = {}
+		for r, training_topics in enumerate(training_splits):
+			repetition_folder = get_repetition_folder(out_folder, r+1)
+			for judge in judged_choices:
+				out_path = os.path.join(repetition_folder, get_probfuse_output_name(x, t, judge, out_compression))
+				sc = score_preprocessed(preprocessed, probabilities[judge][r], training_topics, x, topic_dim)
+				print_interned_scores_to_file(out_path, sc, out_depth, out_precision)
+				out_paths[(x, t, judge, r+1)] = out_path
+
+	return out_paths
+
+# The sweep engine: it runs ProbFuse for every (X, t, judged) configuration, but it reads the
+# pre-processed data only once and evaluates the whole grid against it.
+# For each (X, t) a single training split is drawn: ProbFuseJudged and ProbFuseAll share it,
+# together with the segment counting pass they're trained from.
+#
+# The configurations are independent, so with n_workers > 1 they are spread over a pool of processes.
+# The most expensive ones (large X, small t: more topics to score) are scheduled first.
+# Each configuration draws its training topics from its own seed, derived from 'seed' (see
+# get_sweep_training_topics): the same seed always gives the same fused runs, serial or parallel.
+#
+# With n_repetitions > 1, every configuration is repeated on that many training splits, to average
+# its results over them: the probabilities of all the splits come from a single counting pass
+# (see compute_repeated_probabilities) and repetition r is written in out_folder_r (see get_repetition_folder).
+#
+# in_path: relative input path, string
+# out_folder: where the fused runs are written, as out_folder/ProbFuse{Judged,All}_X_t.res
+# x_choices: list of the number of segments to try
+# t_choices: list of the % of training queries to try
+# judged_choices=None: which algorithms to run, ProbFuseJudged (True) and/or ProbFuseAll (False); None for both, [True, False]
+# topic_dim, out_depth: same as prob_fuse
+# n_workers=1: how many processes to use
+# seed=None: seed of the sweep; if None a random one is drawn (and printed, to reproduce the sweep)
+# n_repetitions=1: how many training splits to draw for each configuration
+# out_precision=None: same as prob_fuse
+# out_compression=None: ".gz", ".bz2" or ".xz" to write the fused runs compressed (see get_probfuse_output_name)
+#
+# The topics (all those retrieved by at least one run) and their depths in each run are found in the
+# pre-processed data, so there's no assumption on how many runs, topics and documents there are.
+#
+# RETURNS: a dict {(X, t, judged, repetition): path of the fused run}
+def prob_fuse_sweep(in_path, out_folder, x_choices, t_choices, judged_choices=None, topic_dim=None, out_depth=1000, n_workers=1, seed=None, n_repetitions=1, out_precision=None, out_compression=None):
+
+	if judged_choices is None:
+		judged_choices = [True, False]
+	if seed is None:
+		seed = random.randrange(2**32)
+		print("Sweep seed: "+str(seed))
+
+	load_sweep_data(in_path, topic_dim)
+	n_topics = len(sweep_data["topics"])
+	# a t that gives no training topics stops the sweep before any configuration runs
+	for t in t_choices:
+		get_n_training_topics(n_topics, t)
+	for r in range(1, n_repetitions+1):
+		os.makedirs(get_repetition_folder(out_folder, r), exist_ok=True)
+
+	configurations = [(x, t) for x in x_choices for t in t_choices]
+	configurations.sort(key=lambda c: (-c[0], c[1]))
+
+	out_paths = {}
+	if n_workers <= 1:
+		for x, t in configurations:
+			print ("Combinining with parameters: N_SEGMENTS="+str(x)+", TRAINING_TOPICS="+str(int(n_topics*t)))
+			out_paths.update( run_sweep_configuration(out_folder, x, t, judged_choices, seed, topic_dim, out_depth, n_repetitions, out_precision, out_compression) )
+		return out_paths
+
+	with ProcessPoolExecutor(max_workers=n_workers, initializer=load_sweep_data, initargs=(in_path, topic_dim)) as executor:
+		futures = {}
+		for x, t in configurations:
+			args = (out_folder, x, t, judged_choices, seed, topic_dim, out_depth, n_repetitions, out_precision, out_compression)
+			if is_instrumentation_enabled():
+				# the stages of the workers are recorded there and sent back with the fused runs
+				future = executor.submit(run_instrumented, run_sweep_configuration, args, get_stage_config())
+			else:
+				future = executor.submit(run_sweep_configuration, *args)
+			futures[future] = (x, t)
+
+		for future in as_completed(futures):
+			x, t = futures[future]
+			if is_instrumentation_enabled():
+				result, records = future.result()
+				merge_instrumentation_records(records)
+				out_paths.update( result )
+			else:
+				out_paths.update( future.result() )
+			print ("Done parameters: N_SEGMENTS="+str(x)+", TRAINING_TOPICS="+str(int(n_topics*t)))
+
+	return out_paths
+
+# Our core function: it takes the input path of the runs, the output path where it will write
 # its output (which is a TREC-format fused run), the number of segments, the % of topics
 # it'll use to train the model and the "judged" parameter to choose whichever algorithm we want.
 # 
-# All other parameters are fixed parameters that shouldn't be changed (problem requirements).
+# The topics, and how many documents each run has retrieved for each of them, are found in the pre-processed data.
 #
 # This function calles the function that computes the probabilities required by the studied paper,
 # calls the score evaluation function and, finally, prints the output in the desired out_path/file.
@@ -345,30 +873,83 @@ def score_evaluate(in_path, probabilities, training_topics, n_segments, topic_di
 # n_segments: number of segments we want to split the data with
 # training_perc: how much % do we want to take out for the training process
 # judged=True: if you want to perform the probFuseJudged algorithm; =False if you want ProbFuseAll
-# n_topics=50: Fixed at 50 for this problem; makes no sense to change this parameter in this application
-# topic_dim=1000: Each topic, by default, has 1000 documents. For our project, it makes no sense to change this.
+# the other parameters can only be given by name (the 6th positional one used to be n_topics):
+# topics=None: the topics to split in training and test topics; None for all the topics retrieved by the runs
+# topic_dim=None: documents beyond topic_dim are ignored; None to use every retrieved document. The segments of
+#   a topic in a run are computed on its depth: the number of documents the run has retrieved for it, at most topic_dim.
+# out_depth=1000: how many documents of each topic are written in the fused run.
+# preprocessed=None: the output of load_preprocessed_scores, to avoid reading in_path again for every call.
+# relevance_index=None: the output of build_relevance_index, to avoid building it again for every call.
+# (to run many configurations, prob_fuse_sweep does all of this for you)
+# model_path=None: if it's given, the trained model is saved there (see ProbFuse.save), to score new topics
+#   later without training it again (see prob_fuse_with_model); with the identity of the runs of in_path
+# out_precision=None: decimals of the scores in the fused run; None to write them in full (see run_writer_lib)
 #
-# RETURNS: nothing.
+# RETURNS: the trained ProbFuse model.
 
-def prob_fuse(in_path, out_path, n_segments, training_perc, judged=True, n_topics=50, topic_dim = 1000):
+def prob_fuse(in_path, out_path, n_segments, training_perc, judged=True, *, topics = None, topic_dim = None, out_depth = 1000, preprocessed = None, relevance_index = None, model_path = None, out_precision = None):
 
-	
-	# picking training_perc*n_topics training queries (topics), to train our ProbFuse algorithm.
-	n_training_topics = int(n_topics*training_perc)
-	# sampling n_training_topics amount of topics from our dataset, from 351 to 400
-	possible_topics = range(351,400+1)
-	# our training_topics is a vector of randomly chosen topics: [topicX, topicY, ..., topicZ]
-	training_topics = random.sample(possible_topics, n_training_topics)
+	# the pre-processed files are read just once, both for training and scoring
+	if preprocessed is None:
+		preprocessed = load_preprocessed_scores(in_path)
+
+	# picking training_perc*n_topics training queries (topics) among all the topics (or the given ones), to train our ProbFuse algorithm.
+	# reminder; the probabilities of the model have the following shape: {run: {segment: probability_a_doc_is_in_segment}}
+	run_sources = load_preprocessed_sources(in_path) if model_path is not None else None
+	model = ProbFuse(n_segments, training_perc, judged, topic_dim).fit(preprocessed, topics, relevance_index=relevance_index, run_sources=run_sources)
+	if model_path is not None:
+		model.save(model_path)
 
-	# reminder; pr has the following shape: {run: {segment: probability_a_doc_is_in_segment}}
-	pr = compute_probabilities(in_path, n_segments, training_topics, judged, n_topics, topic_dim)
-	
 	# With these probabilities is now possible to evaluate our scores
 	# scores will have the following shape:
-	# {topic: {doc: score}}
-	sc = score_evaluate(in_path, pr, training_topics, n_segments, topic_dim)
+	# {topic: (doc_ids, scores)}
+	sc = model.score(preprocessed)
 
 	# and print them out.
 	# Printing means saving the output file at out_path with the following format:
 	# <N_TOPIC> <Q0> <DOC_NAME> <INV_IDX> <SCORE> <FUSION_NAME>
-	print_scores_to_file(out_path, sc)
\ No newline at end of file
+	print_interned_scores_to_file(out_path, sc, out_depth, out_precision)
+
+	return model
+
+# Fuses the runs of in_path (e.g. the pre-processed runs of new topics) with a model trained and saved before
+# (see prob_fuse and ProbFuse.save): no training at all, only the scoring. The training topics of the model are not scored.
+# check_runs="content": the runs must be the very ones the model has been trained on; "name" for other runs
+#   of the same systems (e.g. new topics), "none" to not check them (see run_check_levels)
+#
+# RETURNS: nothing.
+def prob_fuse_with_model(model_path, in_path, out_path, out_depth=1000, out_precision=None, check_runs="content"):
+	model = ProbFuse.load(model_path)
+	scores = model.score(load_preprocessed_scores(in_path), run_sources=load_preprocessed_sources(in_path), check_runs=check_runs)
+	print_interned_scores_to_file(out_path, scores, out_depth, out_precision)
+
+# Streaming version of prob_fuse_with_model, straight from the .res runs: they're read in lock-step, one topic at a time
+# (see basic_retrieval_helpers.iterate_merged_topic_blocks), and each topic is fused and written before reading the next.
+# The memory holds a single topic of each run, no matter how large the runs are. The output is the same of
+# prob_fuse_with_model on the pre-processed runs.
+#
+# run_files: the .res files of the runs, each in the folder of its run (e.g. input/ten_models/run3/ for run 3 of the model)
+# check_runs="content": how the runs are checked against the ones of the model, as in prob_fuse_with_model
+#
+# RETURNS: nothing.
+def prob_fuse_stream(model_path, run_files, out_path, out_depth=1000, out_precision=None, check_runs="content"):
+	model = ProbFuse.load(model_path)
+	segment_weights = model.get_segment_weights()
+	training_topics = set(str(topic) for topic in model.training_topics)
+	run_names = [get_run_name(path) for path in run_files]
+	run_ids = [int(name) if name.isdigit() else name for name in run_names]
+	# the sha1 of the runs is only read if it's checked
+	model.check_run_sources({run_id: get_run_source(path, with_hash=check_runs == "content") for run_id, path in zip(run_ids, run_files)}, check_runs)
+	# segment of each rank, for each depth found so far
+	rank_segments = {}
+
+	with TrecRunWriter(out_path, "ProbFuse2006", out_precision, atomic=True) as writer:
+		for topic_id, blocks in iterate_merged_topic_blocks(run_files):
+			# the training topics are not scored, as in the batch ProbFuse
+			if topic_id in training_topics:
+				continue
+
+			ranked_lists = {run_ids[position]: doc_names for position, doc_names, scores in blocks}
+			ranking = score_ranked_lists(segment_weights, model.n_segments, ranked_lists, out_depth, model.topic_dim, rank_segments)
+
+			writer.write_topic(topic_id, [doc for doc, score in ranking], [score for doc, score in ranking])
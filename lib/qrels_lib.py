@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# compact, indexed store of a qrels file.
+#
+# the qrels are parsed only once and stored, like the runs (see run_cache_lib), in a folder of the cache:
+#   topic_ids.npy      the topic ids (strings), sorted
+#   topic_offsets.npy  int64, the judgments of topic_ids[i] are the rows topic_offsets[i]:topic_offsets[i+1]
+#   topics.npy         int32, for each judgment the index of its topic in topic_ids.npy
+#   docs.npy           int32, for each judgment the index of its document in doc_names.npy
+#   relevances.npy     int8, the graded relevance of each judgment
+#   doc_names.npy      the judged doc ids (strings), sorted
+#   meta.json          size, mtime and sha1 of the qrels file the arrays come from
+#
+# the judgments are sorted by (topic, doc): since doc_names is sorted too, the documents of a topic
+# are sorted by name, and looking up a document is a binary search. when a (topic, doc) couple is
+# judged more than once, the last judgment of the file wins (like a dict would do).
+# the arrays are loaded with mmap, so a warm start reads only the pages it needs.
+
+import os
+import numpy as np
+from lib.run_cache_lib import get_cache_entry_folder, get_file_fingerprint, is_cache_entry_valid, write_cache_entry
+from lib.doc_ids_lib import intern_doc_ids
+from lib.tokenizer_lib import parse_qrels_text_columns
+
+default_qrels_cache_folder = "output/cache/qrels"
+
+# bump this when the layout of the qrels store changes, old entries will be rebuilt
+qrels_format_version = 1
+
+qrels_arrays = ["topic_ids", "topic_offsets", "topics", "docs", "relevances", "doc_names"]
+
+
+# parse a qrels file into the arrays of its index (see the top of this file)
+def parse_qrels_columns(path):
+	# each line has: topic_id, iteration, doc_id, relevance (see tokenizer_lib.parse_qrels_text_columns)
+	columns = parse_qrels_text_columns(path)
+
+	relevances = columns["relevances"]
+	if len(relevances) > 0 and (relevances.min() < -128 or relevances.max() > 127):
+		raise Exception("Relevance grades in '"+path+"' don't fit in an int8: found "+str(relevances.min())+" to "+str(relevances.max()))
+
+	# the names come numbered in order of appearance: sort them, and number them again in that order
+	topic_ids, topics = np.unique(columns["topic_ids"], return_inverse=True)
+	unique_doc_names, docs = np.unique(columns["doc_ids"], return_inverse=True)
+	topics = topics.reshape(-1)[columns["topics"]]
+	docs = docs.reshape(-1)[columns["docs"]]
+
+	# sort by (topic, doc); lexsort is stable, so the last of the duplicated judgments is the last one of its group
+	order = np.lexsort((docs, topics))
+	topics = topics[order]
+	docs = docs[order]
+	relevances = relevances[order]
+	last = np.ones(len(order), dtype=bool)
+	last[:-1] = (topics[1:] != topics[:-1]) | (docs[1:] != docs[:-1])
+
+	topics = topics[last]
+	topic_offsets = np.searchsorted(topics, np.arange(len(topic_ids)+1)).astype(np.int64)
+
+	return {
+		"topic_ids": topic_ids,
+		"topic_offsets": topic_offsets,
+		"topics": topics.astype(np.int32),
+		"docs": docs[last].astype(np.int32),
+		"relevances": relevances[last].astype(np.int8),
+		"doc_names": unique_doc_names,
+	}
+
+
+# convert a qrels file into its index in entry_folder
+def build_qrels_index(path, entry_folder):
+	fingerprint = get_file_fingerprint(path)
+	arrays = parse_qrels_columns(path)
+
+	meta = dict(fingerprint)
+	meta["version"] = qrels_format_version
+	meta["source"] = os.path.abspath(path)
+	meta["judgments"] = int(len(arrays["relevances"]))
+	write_cache_entry(entry_folder, arrays, meta)
+
+
+# return the index of a qrels file (a dict {name: array}, see the top of this file), building it if needed.
+# the arrays are memory-mapped and read only.
+def load_qrels_index(path, cache_folder=default_qrels_cache_folder):
+	if not os.path.isfile(path):
+		raise Exception("Cannot find the qrels file '"+path+"'.")
+
+	entry_folder = get_cache_entry_folder(path, cache_folder)
+	if not is_cache_entry_valid(path, entry_folder, qrels_arrays, qrels_format_version):
+		build_qrels_index(path, entry_folder)
+
+	qrels_index = {}
+	for name in qrels_arrays:
+		qrels_index[name] = np.load(entry_folder + "/" + name + ".npy", mmap_mode="r")
+	return qrels_index
+
+
+# RETURNS: the position of topic_id in the topic ids of the index, or -1 if the topic has no judgments
+def get_topic_position(qrels_index, topic_id):
+	topic_ids = qrels_index["topic_ids"]
+	position = int(np.searchsorted(topic_ids, str(topic_id)))
+	if position < len(topic_ids) and topic_ids[position] == str(topic_id):
+		return position
+	return -1
+
+
+def has_topic(qrels_index, topic_id):
+	return get_topic_position(qrels_index, topic_id) >= 0
+
+
+# the judgments of a topic
+#
+# RETURNS: two arrays, the judged doc names of the topic (sorted) and their relevances
+def get_topic_judgments(qrels_index, topic_id):
+	position = get_topic_position(qrels_index, topic_id)
+	if position < 0:
+		return np.zeros(0, dtype=qrels_index["doc_names"].dtype), np.zeros(0, dtype=np.int8)
+
+	start, end = qrels_index["topic_offsets"][position:position+2]
+	return qrels_index["doc_names"][qrels_index["docs"][start:end]], qrels_index["relevances"][start:end]
+
+
+# RETURNS: how many documents of the topic have a relevance >= 1
+def count_topic_relevant(qrels_index, topic_id):
+	return int(np.count_nonzero(get_topic_judgments(qrels_index, topic_id)[1] >= 1))
+
+
+# the relevances of some documents of a topic, looked up by name with a binary search
+#
+# RETURNS: a numpy int8 array with the relevance of each name in doc_names, 'missing' for the unjudged ones
+def lookup_topic_relevances(qrels_index, topic_id, doc_names, missing=0):
+	judged_names, judged_relevances = get_topic_judgments(qrels_index, topic_id)
+	relevances = np.full(len(doc_names), missing, dtype=np.int8)
+	if len(judged_names) == 0 or len(doc_names) == 0:
+		return relevances
+
+	doc_names = np.asarray(doc_names, dtype=str)
+	positions = np.minimum(np.searchsorted(judged_names, doc_names), len(judged_names)-1)
+	found = judged_names[positions] == doc_names
+	relevances[found] = judged_relevances[positions[found]]
+	return relevances
+
+
+# for each interned doc id (see doc_ids_lib), the index of the document in the doc names of the qrels, or -1.
+# it's computed once per process and kept in the index.
+def get_interned_doc_positions(qrels_index):
+	if not "interned_doc_positions" in qrels_index:
+		interned = intern_doc_ids(qrels_index["doc_names"].tolist())
+		positions = np.full(int(interned.max())+1 if len(interned) > 0 else 0, -1, dtype=np.int64)
+		positions[interned] = np.arange(len(interned))
+		qrels_index["interned_doc_positions"] = positions
+	return qrels_index["interned_doc_positions"]
+
+
+# the (topic, doc) couple of each judgment as a single int64 key: topic * number of docs + doc.
+# the judgments are sorted by topic first, then by doc, so the keys are sorted too.
+# they're computed once per process and kept in the index.
+def get_judgment_keys(qrels_index):
+	if not "judgment_keys" in qrels_index:
+		n_docs = len(qrels_index["doc_names"])
+		qrels_index["judgment_keys"] = qrels_index["topics"].astype(np.int64) * n_docs + qrels_index["docs"]
+	return qrels_index["judgment_keys"]
+
+
+# bulk join of many (topic, doc) couples with the qrels: one binary search over the sorted judgments,
+# instead of a dict lookup for each couple.
+#
+# topic_ids: the topic of each couple (a list or array of strings)
+# doc_ids: the interned doc id of each couple (see doc_ids_lib)
+# missing: the relevance given to the couples without a judgment
+#
+# RETURNS: a numpy int8 array with the relevance of each couple
+def lookup_relevances(qrels_index, topic_ids, doc_ids, missing=-1):
+	topic_ids = np.asarray(topic_ids, dtype=str)
+	doc_ids = np.asarray(doc_ids, dtype=np.int64)
+	relevances = np.full(len(doc_ids), missing, dtype=np.int8)
+	if len(doc_ids) == 0 or len(qrels_index["relevances"]) == 0:
+		return relevances
+
+	judged_topics = qrels_index["topic_ids"]
+	topics = np.minimum(np.searchsorted(judged_topics, topic_ids), len(judged_topics)-1)
+	known = judged_topics[topics] == topic_ids
+
+	doc_positions = get_interned_doc_positions(qrels_index)
+	docs = np.full(len(doc_ids), -1, dtype=np.int64)
+	in_range = doc_ids < len(doc_positions)
+	docs[in_range] = doc_positions[doc_ids[in_range]]
+	known &= docs >= 0
+
+	n_docs = len(qrels_index["doc_names"])
+	judged_keys = get_judgment_keys(qrels_index)
+	keys = topics[known] * n_docs + docs[known]
+	positions = np.minimum(np.searchsorted(judged_keys, keys), len(judged_keys)-1)
+	found = judged_keys[positions] == keys
+
+	known_rows = np.flatnonzero(known)
+	relevances[known_rows[found]] = qrels_index["relevances"][positions[found]]
+	return relevances
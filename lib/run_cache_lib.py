@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# binary columnar cache of the parsed TREC .res runs.
+#
+# each run is parsed only once and stored in its own folder inside the cache folder:
+#   topics.npy      int32, for each line the index of its topic in topic_ids.npy
+#   docs.npy        int32, for each line the index of its document in doc_ids.npy (docs are interned)
+#   ranks.npy       int32, the rank column
+#   scores.npy      float64, the score column (the exact scores of the text: CombX sums and compares them)
+#   topic_min.npy   float64, the min score of each topic of topic_ids.npy
+#   topic_max.npy   float64, the max score of each topic of topic_ids.npy
+#   topic_ids.npy   the topic ids (strings), in order of appearance
+#   doc_ids.npy     the doc ids (strings), in order of appearance
+#   meta.json       size, mtime and sha1 of the .res file the arrays come from
+#
+# the arrays are loaded with mmap, so that a warm start doesn't parse any text at all.
+# a cache entry is rebuilt as soon as the size or the content (sha1) of its .res file changes;
+# when only the mtime changes (e.g. the file has been touched or copied) the sha1 is checked again.
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+from lib.doc_ids_lib import intern_doc_ids
+from lib.tokenizer_lib import parse_run_columns, group_lines_by_topic, get_topic_score_range_dict
+from lib.instrumentation_lib import instrumented, add_counters
+
+default_cache_folder = "output/cache/runs"
+
+# bump this when the layout of the cache changes, old entries will be rebuilt
+cache_format_version = 3
+
+cache_arrays = ["topics", "docs", "ranks", "scores", "topic_ids", "doc_ids", "topic_min", "topic_max"]
+
+
+# sha1 of a file, read in chunks to avoid loading it all in memory
+def file_sha1(path, chunk_size=1 << 20):
+	sha1 = hashlib.sha1()
+	with open(path, "rb") as fp:
+		for chunk in iter(lambda: fp.read(chunk_size), b""):
+			sha1.update(chunk)
+	return sha1.hexdigest()
+
+
+# the folder of the cache entry of a run: a readable name plus a digest of the absolute path,
+# so that two runs with the same file name in different folders don't collide
+def get_cache_entry_folder(path_to_file, cache_folder=default_cache_folder):
+	abs_path = os.path.abspath(path_to_file)
+	digest = hashlib.sha1(abs_path.encode("utf-8")).hexdigest()[:16]
+	return cache_folder + "/" + os.path.basename(abs_path) + "_" + digest
+
+
+# read the size, mtime and sha1 of a run: these are the fields used to invalidate its cache entry
+def get_file_fingerprint(path_to_file, with_hash=True):
+	stat = os.stat(path_to_file)
+	fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+	if with_hash:
+		fingerprint["sha1"] = file_sha1(path_to_file)
+	return fingerprint
+
+
+# tell if the cache entry in entry_folder still describes path_to_file
+# (and refresh its mtime if the file has been touched without changing its content).
+# arrays and version are those of the entry, by default the ones of a cached run.
+def is_cache_entry_valid(path_to_file, entry_folder, arrays=cache_arrays, version=cache_format_version):
+	meta_path = entry_folder + "/meta.json"
+	if not os.path.isfile(meta_path):
+		return False
+
+	with open(meta_path) as fp:
+		meta = json.load(fp)
+
+	if meta.get("version") != version:
+		return False
+	for name in arrays:
+		if not os.path.isfile(entry_folder + "/" + name + ".npy"):
+			return False
+
+	fingerprint = get_file_fingerprint(path_to_file, with_hash=False)
+	if fingerprint["size"] != meta["size"]:
+		return False
+	if fingerprint["mtime_ns"] == meta["mtime_ns"]:
+		return True
+
+	# same size but different mtime: the content decides
+	if file_sha1(path_to_file) != meta["sha1"]:
+		return False
+
+	meta["mtime_ns"] = fingerprint["mtime_ns"]
+	with open(meta_path, "w") as fp:
+		json.dump(meta, fp)
+	return True
+
+
+# parse a .res file into the columns stored by the cache (see tokenizer_lib.parse_run_columns)
+def parse_res_file_columns(path_to_file):
+	columns = parse_run_columns(path_to_file)
+	return {
+		"topics": columns["topics"],
+		"docs": columns["docs"],
+		"ranks": columns["ranks"].astype(np.int32),
+		"scores": columns["scores"].astype(np.float64),
+		"topic_ids": columns["topic_ids"],
+		"doc_ids": columns["doc_ids"],
+		"topic_min": columns["topic_min"],
+		"topic_max": columns["topic_max"],
+	}
+
+
+# convert a run into its cache entry
+@instrumented()
+def build_run_cache(path_to_file, entry_folder):
+	fingerprint = get_file_fingerprint(path_to_file)
+	columns = parse_res_file_columns(path_to_file)
+	add_counters(lines=len(columns["topics"]), files_opened=1, bytes_read=fingerprint["size"])
+
+	meta = dict(fingerprint)
+	meta["version"] = cache_format_version
+	meta["source"] = os.path.abspath(path_to_file)
+	meta["lines"] = int(len(columns["topics"]))
+	write_cache_entry(entry_folder, columns, meta)
+
+
+# write the arrays (a dict {name: numpy array}) and the meta of a cache entry in entry_folder.
+# the arrays are written in a temporary folder which is renamed at the end,
+# so that an interrupted build never leaves a half written entry behind.
+def write_cache_entry(entry_folder, arrays, meta):
+	tmp_folder = entry_folder + ".tmp"
+	if os.path.isdir(tmp_folder):
+		shutil.rmtree(tmp_folder)
+	os.makedirs(tmp_folder)
+
+	for name in arrays:
+		np.save(tmp_folder + "/" + name + ".npy", arrays[name])
+
+	with open(tmp_folder + "/meta.json", "w") as fp:
+		json.dump(meta, fp)
+
+	if os.path.isdir(entry_folder):
+		shutil.rmtree(entry_folder)
+	os.replace(tmp_folder, entry_folder)
+
+
+# return the cached columns of a run (see the top of this file), building them if needed.
+# the arrays are memory-mapped and read only.
+def load_cached_run(path_to_file, cache_folder=default_cache_folder):
+	if not os.path.isfile(path_to_file):
+		raise Exception("Cannot cache '"+path_to_file+"': file not found.")
+
+	entry_folder = get_cache_entry_folder(path_to_file, cache_folder)
+	if is_cache_entry_valid(path_to_file, entry_folder):
+		add_counters(run_cache_hits=1)
+	else:
+		add_counters(run_cache_misses=1)
+		build_run_cache(path_to_file, entry_folder)
+
+	columns = {}
+	for name in cache_arrays:
+		columns[name] = np.load(entry_folder + "/" + name + ".npy", mmap_mode="r")
+	add_counters(files_opened=len(cache_arrays))
+	return columns
+
+
+# same output of basic_retrieval_helpers.parse_res_file, but read from the cache.
+#
+# RETURNS: a dict {topic_id: [(doc_id, score), ...]} (and the score ranges, with_score_ranges=True, as parse_res_file)
+def parse_res_file_cached(path_to_file, cache_folder=default_cache_folder, with_score_ranges=False):
+	columns = load_cached_run(path_to_file, cache_folder)
+
+	topic_ids = columns["topic_ids"].tolist()
+	doc_ids = columns["doc_ids"].tolist()
+	topics = columns["topics"]
+	docs = columns["docs"]
+	scores = columns["scores"].tolist()
+
+	buckets = {}
+	if len(topics) == 0:
+		return (buckets, {}) if with_score_ranges else buckets
+
+	# the lines of a topic are contiguous in a TREC run; split the columns where the topic changes
+	changes = np.flatnonzero(topics[1:] != topics[:-1]) + 1
+	starts = [0] + changes.tolist()
+	ends = changes.tolist() + [len(topics)]
+
+	for start, end in zip(starts, ends):
+		topic_id = topic_ids[topics[start]]
+		entries = [ (doc_ids[d], score) for d, score in zip(docs[start:end].tolist(), scores[start:end]) ]
+		if topic_id in buckets:
+			buckets[topic_id].extend(entries)
+		else:
+			buckets[topic_id] = entries
+	if with_score_ranges:
+		return buckets, get_topic_score_range_dict(columns["topic_ids"], columns["topic_min"], columns["topic_max"])
+	return buckets
+
+
+# same output of basic_retrieval_helpers.parse_res_file_interned, but read from the cache:
+# the docs of the run are interned all at once, then the lines just index their ids.
+#
+# RETURNS: a dict {topic_id: (doc_ids, scores)}, doc_ids a numpy int32 array and scores a float64 one
+# (and the score ranges, with_score_ranges=True, as parse_res_file)
+@instrumented()
+def parse_res_file_cached_interned(path_to_file, cache_folder=default_cache_folder, with_score_ranges=False):
+	columns = load_cached_run(path_to_file, cache_folder)
+	add_counters(docs=len(columns["topics"]))
+
+	topic_ids = columns["topic_ids"].tolist()
+	topics = columns["topics"]
+	docs = intern_doc_ids(columns["doc_ids"].tolist())[columns["docs"]]
+	scores = np.asarray(columns["scores"], dtype=np.float64)
+
+	buckets = {}
+	for topic, lines in enumerate(group_lines_by_topic(topics, len(topic_ids))):
+		if len(lines) > 0:
+			buckets[topic_ids[topic]] = (docs[lines], scores[lines])
+	if with_score_ranges:
+		return buckets, get_topic_score_range_dict(columns["topic_ids"], columns["topic_min"], columns["topic_max"])
+	return buckets
+
+
+# yield the couples (topic_id, doc_id) of every line of a cached run, in file order.
+# the doc ids are interned (see doc_ids_lib)
+def iterate_cached_topic_doc_pairs(path_to_file, cache_folder=default_cache_folder):
+	columns = load_cached_run(path_to_file, cache_folder)
+	topic_ids = columns["topic_ids"].tolist()
+	docs = intern_doc_ids(columns["doc_ids"].tolist())[columns["docs"]]
+	for topic, doc in zip(columns["topics"].tolist(), docs.tolist()):
+		yield topic_ids[topic], doc
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# writer of the TREC runs we produce (the base combinations and the ProbFuse fusions).
+#
+# a run is written one topic at a time: the lines of a whole topic are formatted at once, from a single
+# line template, and go to a file kept open (in binary, with a large buffer) until the run is done,
+# so a run of 50 topics costs one open and a few large writes instead of a reopen and a write per topic.
+#
+# the scores are written as str(score) (the shortest text that reads back the same float) unless a precision
+# is given: then with that many decimals, e.g. precision=6 gives 0.123457. that's shorter and faster to write,
+# but the scores that differ after the last decimal become ties for trec_eval, that breaks them by doc id.
+#
+# atomic=True writes the run in path+".tmp" and renames it to path only when it's closed: a run that stops
+# in the middle (an error, a killed sweep) never leaves a truncated run that looks complete.
+#
+# a run whose path ends with .gz, .bz2 or .xz is written compressed (see compression_lib).
+
+import os
+import contextlib
+from lib.instrumentation_lib import instrumented, add_counters
+from lib.compression_lib import open_binary_file
+
+# bytes buffered before a write to the file
+default_write_buffer = 1 << 20
+
+
+# RETURNS: the line template of the topic topic_id of the run model_name, for a tuple (doc_name, rank, score)
+def get_trec_line_format(topic_id, model_name, precision=None):
+	score_format = "%s" if precision is None else "%."+str(int(precision))+"f"
+	# the names go in the template as they are: a '%' in them must not be taken for a format
+	return str(topic_id).replace("%", "%%")+" Q0 %s %d "+score_format+" "+str(model_name).replace("%", "%%")+"\n"
+
+
+# formats the lines of a topic: "topic_id Q0 doc_name rank score model_name", ranks from first_rank on
+#
+# RETURNS: the text of the lines, a string
+def format_trec_run_block(topic_id, doc_names, scores, model_name, precision=None, first_rank=0):
+	line_format = get_trec_line_format(topic_id, model_name, precision)
+	if not isinstance(scores, list):
+		scores = scores.tolist()
+	return "".join([line_format % line for line in zip(doc_names, range(first_rank, first_rank+len(scores)), scores)])
+
+
+# a TREC run being written, e.g.
+#   with TrecRunWriter(path, "combSUM") as writer:
+#       writer.write_topic(topic_id, doc_names, scores)
+# the ranks of each topic start from 0, in the order of doc_names (best first).
+# with a "with" the run is closed at the end, and discarded if there's an error (see abort).
+class TrecRunWriter:
+
+	def __init__(self, path, model_name, precision=None, atomic=False, buffer_size=default_write_buffer):
+		self.path = path
+		self.model_name = model_name
+		self.precision = precision
+		self.atomic = atomic
+		self.write_path = path+".tmp" if atomic else path
+		# the codec comes from the final name of the run, not from the temporary one
+		self.writer = open_binary_file(self.write_path, "wb", buffer_size, name=path)
+		self.lines = 0
+		add_counters(files_opened=1)
+
+	@instrumented("write_run_topic")
+	def write_topic(self, topic_id, doc_names, scores):
+		text = format_trec_run_block(topic_id, doc_names, scores, self.model_name, self.precision).encode("utf-8")
+		self.writer.write(text)
+		self.lines += len(doc_names)
+		add_counters(lines=len(doc_names), bytes_written=len(text))
+
+	# flushes the run and, if atomic, gives it its name
+	def close(self):
+		if self.writer is None:
+			return
+		self.writer.close()
+		self.writer = None
+		if self.atomic:
+			os.replace(self.write_path, self.path)
+
+	# closes the run without keeping it: an atomic run is removed, the file of a run that isn't atomic is left as it is
+	def abort(self):
+		if self.writer is None:
+			return
+		self.writer.close()
+		self.writer = None
+		if self.atomic and os.path.exists(self.write_path):
+			os.remove(self.write_path)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self.abort()
+		return False
+
+
+# the writers of a group of runs written side by side, e.g. the six base combinations of a topic:
+#   with open_run_writers(output_folder, comb_technique_names) as writers:
+#       writers["combSUM"].write_topic(topic_id, doc_names, scores)
+# each run is output_folder+model_name+".res", followed by compression if it's given (".gz", ".bz2" or ".xz").
+# they're all closed at the end (and all aborted on an error)
+@contextlib.contextmanager
+def open_run_writers(output_folder, model_names, precision=None, atomic=False, buffer_size=default_write_buffer, compression=None):
+	writers = {}
+	try:
+		for model_name in model_names:
+			path = output_folder+model_name+".res"+(compression or "")
+			writers[model_name] = TrecRunWriter(path, model_name, precision, atomic, buffer_size)
+		yield writers
+	except BaseException:
+		for model_name in writers:
+			writers[model_name].abort()
+		raise
+	for model_name in writers:
+		writers[model_name].close()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# synthetic TREC collections, to measure how the fusion scales with the number of runs, topics and documents.
+#
+# the files are written in the very same formats of the real ones:
+#   <runs_folder>/run<r>/model<r>.res   "topic Q0 doc rank score Model<r>" lines (see parse_res_file)
+#   <qrels file>                        "topic 0 doc relevance" lines (see extract_ground_truth)
+#   <params file>                       "x\t=\t[...]" and "t\t=\t[...]" (see prob_fuse_lib.extract_params)
+#
+# every topic has a pool of pool_size documents, a relevance_density fraction of them relevant.
+# a run ranks the whole pool of each topic by a noisy key, where the relevant documents get a boost (the quality
+# of the run), and retrieves the top depth documents: the overlap between two runs grows with depth/pool_size.
+# part of the noise (run_correlation) is shared by all the runs, as real systems agree on many non relevant documents too.
+# the scores are drawn from score_distribution, with a different scale for each run (that's what the
+# normalization of CombX is for). the qrels judge the top judged_depth documents of every run, plus all the
+# relevant ones, as a TREC pool would do.
+#
+# the random numbers of each (run, topic) come from their own stream, derived from the seed: runs and qrels
+# are generated independently, one topic at a time, in bounded memory, and a seed always gives the same collection.
+
+import os
+import numpy as np
+from lib.compression_lib import open_text_file
+
+score_distributions = ["normal", "exponential", "uniform"]
+
+
+# the description of a synthetic collection: everything needed to generate its runs and qrels.
+#
+# n_runs, n_topics: how many runs and topics; the topics are first_topic, first_topic+1, ...
+# depth: how many documents each run retrieves for a topic; if min_depth is given, the depth of each
+#   (run, topic) is drawn between min_depth and depth
+# pool_size: how many documents each topic has, at least depth
+# relevance_density: the fraction of the pool of a topic that is relevant
+# judged_depth: the documents of each run judged in the qrels, from the top
+# score_distribution: "normal", "exponential" (a long tail, like BM25) or "uniform"
+# min_quality, max_quality: the range of the boost of the relevant documents in the ranking of a run
+# run_correlation: the fraction (0 to 1) of the variance of the ranking noise shared by all the runs
+# seed: seed of the whole collection
+#
+# RETURNS: a dict with the parameters of the collection
+def make_synthetic_collection(n_runs=10, n_topics=50, first_topic=351, depth=1000, min_depth=None, pool_size=4000,
+		relevance_density=0.02, judged_depth=100, score_distribution="normal", min_quality=0.8, max_quality=2.0, run_correlation=0.7, seed=0):
+	if pool_size < depth:
+		raise Exception("The pool of a topic ("+str(pool_size)+" documents) can't be smaller than the depth of the runs ("+str(depth)+")")
+	if min_depth is not None and not (1 <= min_depth <= depth):
+		raise Exception("min_depth should be between 1 and depth ("+str(depth)+"), got: "+str(min_depth))
+	if not (0 < relevance_density <= 1):
+		raise Exception("relevance_density should be in (0, 1], got: "+str(relevance_density))
+	if not (0 <= run_correlation <= 1):
+		raise Exception("run_correlation should be between 0 and 1, got: "+str(run_correlation))
+	if not score_distribution in score_distributions:
+		raise Exception("Unknown score distribution '"+score_distribution+"', expected one of "+str(score_distributions))
+
+	return {
+		"n_runs": n_runs,
+		"topics": list(range(first_topic, first_topic+n_topics)),
+		"depth": depth,
+		"min_depth": depth if min_depth is None else min_depth,
+		"pool_size": pool_size,
+		"n_relevant": max(1, int(round(relevance_density*pool_size))),
+		"judged_depth": judged_depth,
+		"score_distribution": score_distribution,
+		"min_quality": min_quality,
+		"max_quality": max_quality,
+		"run_correlation": run_correlation,
+		"seed": seed,
+	}
+
+
+# the name of document number d of the pool of a topic is this prefix + "%06d" % d, e.g. DOC-351-000042
+def get_synthetic_doc_prefix(topic):
+	return "DOC-"+str(topic)+"-"
+
+
+# the documents of a topic that are relevant, and the part of the ranking noise shared by all the runs
+#
+# RETURNS: a boolean numpy array over the pool of the topic, True for the relevant documents, and a float one with the shared noise
+def get_topic_profile(collection, topic):
+	rng = np.random.default_rng([collection["seed"], 0, topic])
+	relevant = np.zeros(collection["pool_size"], dtype=bool)
+	relevant[rng.choice(collection["pool_size"], collection["n_relevant"], replace=False)] = True
+	return relevant, rng.normal(size=collection["pool_size"])
+
+
+# the parameters of a run (runs are numbered from 1): the quality and the scale of its scores
+def get_run_profile(collection, run):
+	rng = np.random.default_rng([collection["seed"], run])
+	return {
+		"quality": rng.uniform(collection["min_quality"], collection["max_quality"]),
+		"location": rng.uniform(5, 30),
+		"scale": rng.uniform(1, 5),
+	}
+
+
+# the ranking of a run for a topic
+#
+# topic_profile: the output of get_topic_profile for the topic
+# profile: the output of get_run_profile for the run
+#
+# RETURNS: two numpy arrays, the documents (indices in the pool of the topic) in rank order and their decreasing scores
+def get_synthetic_ranking(collection, run, topic, topic_profile, profile):
+	relevant, shared_noise = topic_profile
+	rng = np.random.default_rng([collection["seed"], run, topic])
+	depth = collection["depth"]
+	if collection["min_depth"] < depth:
+		depth = int(rng.integers(collection["min_depth"], depth+1))
+
+	correlation = collection["run_correlation"]
+	noise = np.sqrt(correlation)*shared_noise + np.sqrt(1-correlation)*rng.normal(size=collection["pool_size"])
+	key = noise + profile["quality"]*relevant
+	docs = np.argsort(-key, kind="stable")[:depth]
+
+	if collection["score_distribution"] == "normal":
+		scores = rng.normal(profile["location"], profile["scale"], depth)
+	elif collection["score_distribution"] == "exponential":
+		scores = rng.exponential(profile["scale"], depth) + profile["location"]
+	else:
+		scores = rng.uniform(profile["location"], profile["location"]+profile["scale"]*10, depth)
+	scores = np.round(-np.sort(-scores), 4)
+
+	return docs, scores
+
+
+# writes run number 'run' of the collection, in TREC format, one topic at a time
+def write_synthetic_run(collection, run, path):
+	profile = get_run_profile(collection, run)
+	model = "Model"+str(run)
+
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	# compressed if path ends with .gz, .bz2 or .xz (see compression_lib)
+	with open_text_file(path, 'w') as writer:
+		for topic in collection["topics"]:
+			docs, scores = get_synthetic_ranking(collection, run, topic, get_topic_profile(collection, topic), profile)
+			# topic Q0 doc rank score model; %r writes a float as str does
+			line_format = str(topic)+" Q0 "+get_synthetic_doc_prefix(topic)+"%06d %d %r "+model+"\n"
+			writer.write("".join([line_format % line for line in zip(docs.tolist(), range(len(docs)), scores.tolist())]))
+
+
+# writes the qrels of the collection: for each topic, the top judged_depth documents of every run and all the
+# relevant documents, 1 if relevant and 0 otherwise. the rankings are generated again, topic by topic.
+def write_synthetic_qrels(collection, path):
+	profiles = [get_run_profile(collection, run) for run in range(1, collection["n_runs"]+1)]
+
+	if os.path.dirname(path) != "":
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open_text_file(path, 'w') as writer:
+		for topic in collection["topics"]:
+			topic_profile = get_topic_profile(collection, topic)
+			relevant = topic_profile[0]
+			judged = relevant.copy()
+			for run in range(1, collection["n_runs"]+1):
+				docs, scores = get_synthetic_ranking(collection, run, topic, topic_profile, profiles[run-1])
+				judged[docs[:collection["judged_depth"]]] = True
+
+			line_format = str(topic)+" 0 "+get_synthetic_doc_prefix(topic)+"%06d %d\n"
+			judged_docs = np.flatnonzero(judged)
+			writer.write("".join([line_format % line for line in zip(judged_docs.tolist(), relevant[judged_docs].astype(int).tolist())]))
+
+
+# writes the X and t parameters of ProbFuse, in the format of extract_params
+def write_xt_params(path, x_choices, t_choices):
+	with open(path, 'w') as writer:
+		writer.write("x\t=\t["+", ".join(str(x) for x in x_choices)+"]\n")
+		writer.write("t\t=\t["+", ".join(str(t) for t in t_choices)+"]\n")
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bulk tokenizer of the TREC text files: runs ("topic Q0 doc rank score model") and qrels ("topic iteration doc relevance").
+#
+# a file is read as bytes and split in columns with numpy: the offsets of the tokens come from the
+# whitespace of the raw bytes, and the tokens of each column are copied into a numpy array of bytes, which numpy
+# converts to numbers in bulk. there's no Python code running for each line, nor a Python object for each token.
+# the lines are checked in bulk too: the tokens of each line are counted with numpy over the raw bytes, and a line
+# with a wrong number of elements (or a rank, score or relevance that is not a number) is an error that says
+# which line of the file it is. blank lines are skipped.
+#
+# the names (topics and documents) are numbered in order of first appearance: every column of names is
+# an int32 array of indices in a small array with the distinct names, which are the only ones decoded to str.
+# the callers that intern the doc ids (see doc_ids_lib) take them as they are instead (number_docs=False).
+# the min and max score of each topic of a run come out of the same pass, for the normalization of CombX.
+# a file is split one chunk of whole lines at a time (see compression_lib.iterate_line_chunks; the next chunk of a
+# compressed file is decompressed while this one is split): the columns of each chunk are converted to their numpy
+# arrays as soon as it arrives, and only those arrays are kept, not the text of the file.
+
+import numpy as np
+from lib.compression_lib import iterate_line_chunks
+
+
+# RETURNS: the text of line line_index (from 0) of data, for the error messages
+def get_line_text(data, line_index):
+	return data.split(b"\n")[line_index].decode("utf-8", "replace").strip()
+
+
+# finds the tokens of data, at once
+#
+# RETURNS: two numpy arrays, with the offset of the first byte of each token in data and the offset after its last one
+def get_token_bounds(data):
+	raw = np.frombuffer(data, dtype=np.uint8)
+	# the bytes bytes.split() splits on: space, \t, \n, \x0b, \x0c and \r
+	is_token = (raw != 32) & ((raw < 9) | (raw > 13))
+	# a token starts where a token byte follows a space (or the start of the file), and ends where a space follows it
+	edges = np.flatnonzero(np.diff(np.concatenate(([False], is_token, [False]))))
+	return edges[0::2], edges[1::2]
+
+
+# counts the tokens of every line of data, from the offsets of get_token_bounds
+#
+# RETURNS: a numpy array with the number of tokens of each line of data (line i, from 0, at index i)
+def count_line_tokens(data, starts):
+	newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n"))
+	# the line after a final newline is empty
+	return np.bincount(np.searchsorted(newlines, starts), minlength=len(newlines)+1)
+
+
+# copies the tokens between starts and ends of data into a numpy array of bytes, as wide as the longest of them:
+# one byte of every token at a time, so there's no Python code running for each token
+#
+# RETURNS: a numpy array of bytes (dtype "S")
+def get_token_array(data, starts, ends):
+	raw = np.frombuffer(data, dtype=np.uint8)
+	lengths = ends - starts
+	width = max(int(lengths.max()), 1) if len(lengths) > 0 else 1
+	chars = np.zeros((len(starts), width), dtype=np.uint8)
+	for offset in range(width):
+		inside = np.flatnonzero(lengths > offset)
+		chars[inside, offset] = raw[starts[inside]+offset]
+	return chars.view("S"+str(width)).reshape(-1)
+
+
+# splits a chunk of whole lines (bytes) of the file path in its columns, checking that every non blank line has
+# n_columns tokens; first_line is the line number (from 1) of its first line in the file, for the error messages.
+# columns has the (index from 0, dtype, name) of each column wanted: with dtype bytes its tokens are kept as they
+# are, in a numpy array of bytes, any other dtype converts them to numbers (see convert_number_column)
+#
+# RETURNS: a list with the numpy array of each column of columns, one entry per non blank line
+def split_chunk_columns(path, data, first_line, n_columns, columns):
+	starts, ends = get_token_bounds(data)
+	line_tokens = count_line_tokens(data, starts)
+
+	wrong = np.flatnonzero((line_tokens != n_columns) & (line_tokens != 0))
+	if len(wrong) > 0:
+		line_index = int(wrong[0])
+		raise Exception("Found a line in '"+path+"' (line "+str(first_line+line_index)+") with "+str(line_tokens[line_index])+" elements, "
+			+str(n_columns)+" expected: "+get_line_text(data, line_index))
+
+	# every non blank line has n_columns tokens: the tokens of a column are one every n_columns
+	line_indices = np.flatnonzero(line_tokens)
+	arrays = []
+	for column, dtype, column_name in columns:
+		tokens = get_token_array(data, starts[column::n_columns], ends[column::n_columns])
+		if dtype is not bytes:
+			tokens = convert_number_column(tokens, dtype, column_name, path, data, first_line, line_indices)
+		arrays.append(tokens)
+	return arrays
+
+
+# splits the text of a file (plain or compressed) in its columns, one chunk at a time (see split_chunk_columns)
+#
+# RETURNS: a list with the numpy array of each column of columns, one entry per non blank line of the file
+def read_text_columns(path, n_columns, columns):
+	chunk_arrays = []
+	first_line = 1
+	for chunk in iterate_line_chunks(path):
+		chunk_arrays.append(split_chunk_columns(path, chunk, first_line, n_columns, columns))
+		first_line += chunk.count(b"\n")
+
+	if len(chunk_arrays) == 0:
+		return split_chunk_columns(path, b"", 1, n_columns, columns)
+	if len(chunk_arrays) == 1:
+		return chunk_arrays[0]
+	# (the arrays of bytes of the chunks may have different widths: the result has the widest one)
+	return [np.concatenate(arrays) for arrays in zip(*chunk_arrays)]
+
+
+# converts a column of tokens of data to numbers; a token that is not a number is an error that says which line of the
+# file it comes from (the line line_indices[i] of data, from 0, for the token i)
+#
+# RETURNS: a numpy array of dtype
+def convert_number_column(tokens, dtype, column_name, path, data, first_line, line_indices):
+	# numpy parses the whole array of bytes at once
+	try:
+		return tokens.astype(dtype)
+	except (ValueError, OverflowError):
+		convert = int if np.issubdtype(dtype, np.integer) else float
+		for i, token in enumerate(tokens.tolist()):
+			try:
+				dtype(convert(token))
+			except (ValueError, OverflowError):
+				line_index = int(line_indices[i])
+				raise Exception("Found a line in '"+path+"' (line "+str(first_line+line_index)+") with a "+column_name+" that is not a number ('"
+					+token.decode("utf-8", "replace")+"'): "+get_line_text(data, line_index))
+		raise
+
+
+# RETURNS: the list of the names (str) of a column of tokens (a numpy array of bytes), decoded all at once
+def decode_names(tokens):
+	if len(tokens) == 0:
+		return []
+	# a token has no spaces in it, so the names can go through a single string
+	return b" ".join(tokens.tolist()).decode("utf-8").split(" ")
+
+
+# numbers the names of a column in order of first appearance
+#
+# RETURNS: the distinct names (a numpy array of str) and, for each token, the index of its name, a numpy int32 array
+def number_names(tokens):
+	if len(tokens) == 0:
+		return np.zeros(0, dtype=str), np.zeros(0, dtype=np.int32)
+	unique, first, inverse = np.unique(np.array(tokens, dtype=bytes), return_index=True, return_inverse=True)
+	order = np.argsort(first, kind="stable")
+	index_of_unique = np.empty(len(order), dtype=np.int32)
+	index_of_unique[order] = np.arange(len(order), dtype=np.int32)
+
+	names = unique[order]
+	try:
+		# all at once if the names are ascii (they always are in TREC), one by one otherwise
+		names = names.astype(str)
+	except UnicodeDecodeError:
+		names = np.array([name.decode("utf-8") for name in names.tolist()], dtype=str)
+	return names, index_of_unique[inverse.reshape(-1)]
+
+
+# same as number_names, for the topics of a run or of a qrels: they come in blocks of consecutive lines
+# (all the lines of a topic, usually), so only the first name of each block is looked at
+def number_topic_names(tokens):
+	if len(tokens) == 0:
+		return number_names(tokens)
+	# the blocks start where a token differs from the one before, compared all at once
+	tokens = np.array(tokens, dtype=bytes)
+	block_starts = np.concatenate(([0], np.flatnonzero(tokens[1:] != tokens[:-1])+1))
+	names, block_topics = number_names(tokens[block_starts])
+	return names, np.repeat(block_topics, np.diff(np.append(block_starts, len(tokens))))
+
+
+# the min and the max score of each topic, from the columns of a run
+#
+# RETURNS: two numpy float64 arrays, with the min and the max of each topic of topic_ids
+def get_topic_score_ranges(topics, scores, n_topics):
+	topic_min = np.full(n_topics, np.inf)
+	topic_max = np.full(n_topics, -np.inf)
+	if len(topics) == 0:
+		return topic_min, topic_max
+
+	# the lines of a topic are contiguous in a TREC run: reduce each block at once, then the blocks of the same topic
+	block_starts = np.concatenate(([0], np.flatnonzero(topics[1:] != topics[:-1])+1))
+	np.minimum.at(topic_min, topics[block_starts], np.minimum.reduceat(scores, block_starts))
+	np.maximum.at(topic_max, topics[block_starts], np.maximum.reduceat(scores, block_starts))
+	return topic_min, topic_max
+
+
+# the score ranges of get_topic_score_ranges by topic id, as the parsers of the runs give them
+# (see basic_retrieval_helpers.parse_res_file_interned)
+#
+# RETURNS: a dict {topic_id: (min score, max score)}
+def get_topic_score_range_dict(topic_ids, topic_min, topic_max):
+	return {topic_id: (low, high) for topic_id, low, high in zip(topic_ids.tolist(), topic_min.tolist(), topic_max.tolist())}
+
+
+# parses a TREC run, "topic_id Q0 doc_id rank score model" lines, into its columns
+#
+# RETURNS: a dict of numpy arrays, one entry per line in file order
+#   topics      int32, the index of the topic of each line in topic_ids
+#   docs        int32, the index of the document of each line in doc_ids
+#   ranks       int64, the rank column (checked on every line, even if most callers don't need it)
+#   scores      float64, the score column
+#   topic_ids   the topic ids (str), in order of appearance
+#   doc_ids     the doc ids (str), in order of appearance
+#   topic_min, topic_max    float64, the min and max score of each topic of topic_ids (see normalization_lib.normalize_segments)
+# with number_docs=False, docs and doc_ids are replaced by doc_names: the list of the doc id (str) of each line,
+# for the callers that intern them anyway (see doc_ids_lib.intern_doc_ids) and don't need them numbered twice
+def parse_run_columns(path, number_docs=True):
+	topic_tokens, doc_tokens, ranks, scores = read_text_columns(path, 6, [(0, bytes, "topic"), (2, bytes, "doc"), (3, np.int64, "rank"), (4, np.float64, "score")])
+
+	topic_ids, topics = number_topic_names(topic_tokens)
+	topic_min, topic_max = get_topic_score_ranges(topics, scores, len(topic_ids))
+
+	columns = {
+		"topics": topics,
+		"ranks": ranks,
+		"scores": scores,
+		"topic_ids": topic_ids,
+		"topic_min": topic_min,
+		"topic_max": topic_max,
+	}
+	if number_docs:
+		columns["doc_ids"], columns["docs"] = number_names(doc_tokens)
+	else:
+		columns["doc_names"] = decode_names(doc_tokens)
+	return columns
+
+
+# parses a qrels file, "topic_id iteration doc_id relevance" lines, into its columns
+#
+# RETURNS: a dict, one entry per judgment in file order
+#   topics      int32, the index of the topic of each judgment in topic_ids
+#   docs        int32, the index of the document of each judgment in doc_ids
+#   relevances  int64, the relevance grade of each judgment
+#   topic_ids, doc_ids      the names (str), in order of appearance, numpy arrays
+# number_docs=False: docs and doc_ids are replaced by doc_names, as in parse_run_columns
+def parse_qrels_text_columns(path, number_docs=True):
+	topic_tokens, doc_tokens, relevances = read_text_columns(path, 4, [(0, bytes, "topic"), (2, bytes, "doc"), (3, np.int64, "relevance")])
+
+	topic_ids, topics = number_topic_names(topic_tokens)
+	columns = {
+		"topics": topics,
+		"relevances": relevances,
+		"topic_ids": topic_ids,
+	}
+	if number_docs:
+		columns["doc_ids"], columns["docs"] = number_names(doc_tokens)
+	else:
+		columns["doc_names"] = decode_names(doc_tokens)
+	return columns
+
+
+# the lines of each topic of a run (see parse_run_columns), in file order
+#
+# RETURNS: a list with a numpy array of line indices for each topic, in the order of topic_ids
+def group_lines_by_topic(topics, n_topics):
+	order = np.argsort(topics, kind="stable")
+	return np.split(order, np.cumsum(np.bincount(topics, minlength=n_topics))[:-1])
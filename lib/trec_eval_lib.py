@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# a native, in-process replacement of the trec_eval calls we need.
+#
+# it follows trec_eval 9.0 (default options):
+#   - the documents of a topic are ranked by decreasing score, ties broken by decreasing docno
+#     (the rank column of the run is ignored, exactly as trec_eval does);
+#   - a document is relevant if its relevance in the qrels is >= 1;
+#   - only the topics that are both in the run and in the qrels are evaluated;
+#   - the summary ("all") line of each measure is the mean over the evaluated topics,
+#     or the sum for the counters (num_ret, num_rel, num_rel_ret).
+# the output has the same format of trec_eval, so it can be parsed by the helpers in plotutils
+# (get_score_from_trec_eval_output, extract_features, ...).
+
+import os
+import threading
+import shutil
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from lib.eval_cache_lib import *
+from lib.qrels_lib import *
+from lib.compression_lib import open_text_file, decompressed_path
+from lib.instrumentation_lib import instrumented, add_counters, get_stage_context, run_in_stage_context
+
+# pass this instead of the path of the trec_eval executable to use the native evaluator
+native_trec_eval_command = "native"
+
+# bump this when the computed measures change (it's part of the key of cached evaluations)
+native_trec_eval_version = "native-1"
+
+precision_cutoffs = [5, 10, 15, 20, 30, 100, 200, 500, 1000]
+# as strings, to get the very same doubles trec_eval gets when it parses its parameters
+recall_levels = ["0.00", "0.10", "0.20", "0.30", "0.40", "0.50", "0.60", "0.70", "0.80", "0.90", "1.00"]
+
+# qrels already loaded by this process: {path: ((size, mtime), qrels index)}
+loaded_qrels = {}
+# the evaluations may run on many threads: the qrels must be loaded by only one of them
+loaded_qrels_lock = threading.Lock()
+
+
+# the indexed qrels of qrels_lib (see load_qrels_index), loaded only once per process
+# (and again only if the file changes).
+def load_qrels(path):
+	with loaded_qrels_lock:
+		return load_qrels_unlocked(path)
+
+def load_qrels_unlocked(path):
+	stat = os.stat(path)
+	fingerprint = (stat.st_size, stat.st_mtime_ns)
+	if path in loaded_qrels and loaded_qrels[path][0] == fingerprint:
+		return loaded_qrels[path][1]
+
+	qrels = load_qrels_index(path)
+	loaded_qrels[path] = (fingerprint, qrels)
+	return qrels
+
+
+# read a run file into the rankings accepted by evaluate_rankings
+#
+# RETURNS: the run id (6th column of the first line) and a dict {topic_id: [(doc_id, score), ...]}
+def load_run_rankings(path):
+	rankings = {}
+	run_id = ""
+	with open_text_file(path) as fp:
+		for line in fp:
+			# a line contains: topic_id Q0 doc_id rank score model
+			el = line.split()
+			if len(el) == 0:
+				continue
+			if len(el) != 6:
+				raise Exception("Found a line in '"+path+"' with "+str(len(el))+" elements, 6 expected: "+line.strip())
+			if run_id == "":
+				run_id = el[5]
+			if not el[0] in rankings:
+				rankings[el[0]] = []
+			rankings[el[0]].append( (el[2], float(el[4])) )
+	return run_id, rankings
+
+
+# compute the trec_eval measures of some rankings, vectorized over all the topics.
+#
+# rankings: {topic_id: [(doc_id, score), ...]} or {topic_id: {doc_id: score}} (e.g. the scores of ProbFuse);
+#   topic ids are compared as strings with the ones in the qrels
+# qrels: the output of load_qrels (an index of qrels_lib)
+#
+# RETURNS: a dict {measure: value} with the summary of every measure
+def evaluate_rankings(rankings, qrels):
+	topics = sorted(str(t) for t in rankings if has_topic(qrels, t))
+	rankings = {str(t): rankings[t] for t in rankings}
+
+	relevance_rows = []
+	num_rel = np.zeros(len(topics))
+	num_ret = np.zeros(len(topics), dtype=np.int64)
+	for i, topic in enumerate(topics):
+		entries = rankings[topic]
+		if isinstance(entries, dict):
+			entries = entries.items()
+		# decreasing score, ties broken by decreasing docno (like trec_eval)
+		entries = sorted(entries, key=lambda e: (float(e[1]), e[0]), reverse=True)
+
+		relevance_rows.append( lookup_topic_relevances(qrels, topic, [doc for doc, score in entries]) >= 1 )
+		num_rel[i] = count_topic_relevant(qrels, topic)
+		num_ret[i] = len(entries)
+
+	depth = max([len(row) for row in relevance_rows] + [1])
+	relevant = np.zeros((len(topics), depth), dtype=bool)
+	for i, row in enumerate(relevance_rows):
+		relevant[i, :len(row)] = row
+
+	# relevant documents retrieved up to each rank, and precision at each rank
+	rel_so_far = np.cumsum(relevant, axis=1)
+	ranks = np.arange(1, depth+1)
+	precision = rel_so_far / ranks
+	num_rel_ret = rel_so_far[:, -1]
+
+	# a topic without relevant documents scores zero everywhere
+	has_rel = num_rel > 0
+	safe_num_rel = np.where(has_rel, num_rel, 1.0)
+
+	measures = {}
+	measures["num_q"] = len(topics)
+	measures["num_ret"] = int(num_ret.sum())
+	measures["num_rel"] = int(num_rel.sum())
+	measures["num_rel_ret"] = int(num_rel_ret.sum())
+
+	average_precision = np.where(has_rel, (precision * relevant).sum(axis=1) / safe_num_rel, 0.0)
+	measures["map"] = average_precision
+
+	# precision after num_rel documents (counting the missing ones as not relevant)
+	r_cut = np.clip(num_rel.astype(np.int64), 1, depth) - 1
+	r_prec = np.where(has_rel, rel_so_far[np.arange(len(topics)), r_cut] / safe_num_rel, 0.0)
+	measures["Rprec"] = r_prec
+
+	# interpolated precision: the best precision at any rank with a recall >= the level
+	recall = rel_so_far / safe_num_rel[:, None]
+	best_precision_after = np.maximum.accumulate(precision[:, ::-1], axis=1)[:, ::-1]
+	for level in recall_levels:
+		reached = has_rel[:, None] & relevant & (recall >= float(level))
+		first = np.argmax(reached, axis=1)
+		measures["iprec_at_recall_"+level] = np.where(reached.any(axis=1), best_precision_after[np.arange(len(topics)), first], 0.0)
+
+	for cutoff in precision_cutoffs:
+		measures["P_"+str(cutoff)] = rel_so_far[:, min(cutoff, depth)-1] / float(cutoff)
+
+	# from per topic values to the summary value of each measure
+	for name in measures:
+		if isinstance(measures[name], np.ndarray):
+			measures[name] = float(measures[name].mean()) if len(topics) > 0 else 0.0
+
+	return measures
+
+
+# format the measures as trec_eval does
+def format_trec_eval_output(measures, run_id):
+	order = ["num_q", "num_ret", "num_rel", "num_rel_ret", "map", "Rprec"]
+	order += ["iprec_at_recall_"+level for level in recall_levels]
+	order += ["P_"+str(cutoff) for cutoff in precision_cutoffs]
+
+	lines = ["%-22s\t%s\t%s" % ("runid", "all", run_id)]
+	for name in order:
+		if isinstance(measures[name], int):
+			lines.append("%-22s\t%s\t%d" % (name, "all", measures[name]))
+		else:
+			lines.append("%-22s\t%s\t%6.4f" % (name, "all", measures[name]))
+	return "\n".join(lines)+"\n"
+
+
+# evaluate a run file against a qrels file
+#
+# RETURNS: the measures, see evaluate_rankings
+def evaluate_run_file(run_file, qrels_file):
+	run_id, rankings = load_run_rankings(run_file)
+	measures = evaluate_rankings(rankings, load_qrels(qrels_file))
+	measures["runid"] = run_id
+	return measures
+
+
+# drop-in replacement of the output of "trec_eval qrels_file run_file"
+def native_trec_eval(run_file, qrels_file):
+	measures = evaluate_run_file(run_file, qrels_file)
+	return format_trec_eval_output(measures, measures["runid"])
+
+
+# run trec_eval on res_file and return its output.
+# if trec_eval_command is native_trec_eval_command ("native") the in-process evaluator above
+# is used instead of spawning the trec_eval executable: the qrels are then loaded only once.
+# raises an exception if trec_eval fails or doesn't print anything.
+@instrumented()
+def run_trec_eval(res_file, trec_eval_command, qrels_file):
+	add_counters(evaluations=1, files_opened=1, bytes_read=os.path.getsize(res_file))
+	if trec_eval_command == native_trec_eval_command:
+		return native_trec_eval(res_file, qrels_file)
+
+	# command line to evaluate is:
+	# "./path/to/trec_eval  ./qrels.trec7.txt ./path/to/BM25b0.75_1.res"
+	# (trec_eval reads plain text only: a compressed run or qrels is given to it as a plain temporary copy)
+	with decompressed_path(qrels_file) as plain_qrels_file, decompressed_path(res_file) as plain_res_file:
+		command = [trec_eval_command, plain_qrels_file, plain_res_file]
+		result = subprocess.run( command, stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+	output = result.stdout.decode('utf-8') # get result from trec_eval command
+
+	if result.returncode != 0 or output.strip() == "":
+		error = result.stderr.decode('utf-8').strip()
+		raise Exception("trec_eval failed on '"+res_file+"' (exit code "+str(result.returncode)+"): "+error)
+	return output
+
+
+# the version of the evaluator, used in the key of the cached evaluations:
+# native_trec_eval_version for the native evaluator, the sha1 of the executable for trec_eval
+def get_evaluator_version(trec_eval_command):
+	if trec_eval_command == native_trec_eval_command:
+		return native_trec_eval_version
+
+	executable = shutil.which(trec_eval_command)
+	if executable is None:
+		raise Exception("trec_eval not found: "+str(trec_eval_command))
+	return "trec_eval_" + get_memoized_sha1(executable)
+
+
+# same as run_trec_eval, but the output is looked up in the evaluation cache first
+# (see lib/eval_cache_lib.py) and stored there after a real evaluation.
+# with cache_folder None the cache is not used at all.
+@instrumented()
+def run_trec_eval_cached(res_file, trec_eval_command, qrels_file, cache_folder=default_eval_cache_folder):
+	if cache_folder is None:
+		return run_trec_eval(res_file, trec_eval_command, qrels_file)
+
+	evaluator_version = get_evaluator_version(trec_eval_command)
+	key = get_evaluation_key(res_file, qrels_file, evaluator_version)
+	output = load_cached_evaluation(key, cache_folder)
+	if output is None:
+		add_counters(eval_cache_misses=1)
+		output = run_trec_eval(res_file, trec_eval_command, qrels_file)
+		description = {"res_file": res_file, "qrels_file": qrels_file, "evaluator": evaluator_version}
+		store_evaluation(key, output, cache_folder, description=description)
+	else:
+		add_counters(eval_cache_hits=1)
+	return output
+
+
+# evaluate many runs at once, on a pool of n_workers threads: each thread waits for its own trec_eval
+# process, so up to n_workers of them run at the same time.
+# the output of each evaluation is written to its file as soon as it's done; a failing evaluation
+# doesn't stop the others and its output file is not written at all.
+#
+# jobs: a list of couples (res_file, out_file)
+# trec_eval_command: the path of trec_eval, or native_trec_eval_command
+# qrels_file: the ground truth
+# n_workers: how many evaluations can run at the same time
+# cache_folder: where the evaluations are cached (see run_trec_eval_cached), None to always evaluate
+#
+# RETURNS: a list of couples (res_file, error message), one for each failed evaluation
+def evaluate_files_parallel(jobs, trec_eval_command, qrels_file, n_workers=4, cache_folder=None):
+	failures = []
+
+	def evaluate_job(res_file, out_file):
+		output = run_trec_eval_cached(res_file, trec_eval_command, qrels_file, cache_folder)
+		os.makedirs(os.path.dirname(out_file) or ".", exist_ok=True)
+		with open(out_file, "w") as writer:
+			writer.write(output)
+
+	# the counters of the threads (evaluations, cache hits, ...) go to the stages running here
+	context = get_stage_context()
+	with ThreadPoolExecutor(max_workers=n_workers) as executor:
+		futures = {}
+		for res_file, out_file in jobs:
+			futures[executor.submit(run_in_stage_context, context, evaluate_job, res_file, out_file)] = res_file
+
+		for future in as_completed(futures):
+			res_file = futures[future]
+			try:
+				future.result()
+				print("Evaluated "+res_file)
+			except Exception as e:
+				print("--- ERROR: evaluation of "+res_file+" failed ---")
+				failures.append( (res_file, str(e)) )
+
+	return failures
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# the whole project without any prompt (e.g. for a nightly job): combine, preprocess, ProbFuse sweep, evaluate
+# and select the best model, each step run again only when its inputs or parameters have changed
+# (see lib/pipeline_lib.py).
+
+# helper functions to keep code organized
+from lib.pipeline_lib import *
+from lib.instrumentation_lib import *
+
+def main():
+	# the same folders and parameters of RUNME.py; change them here, e.g. make_pipeline_config(n_repetitions=5)
+	config = make_pipeline_config(
+		runs_folder = "input/ten_models",
+		qrels_file = "input/qrels.trec7.txt",
+		params_file = "input/Xtparams.txt",
+		seed = 2006,					# seed of the sweep: changing it runs the sweep (and what follows) again
+	)
+	# the stages to bring up to date (None: all of them) and the ones to run even if they're up to date,
+	# e.g. targets = ["probfuse"], force = ["evaluate"]
+	targets = None
+	force = []
+	state_file = default_pipeline_state
+	# the time and the counters of the stages that ran, in json; None to turn it off
+	instrumentation_report = "output/instrumentation_pipeline.json"
+
+	if instrumentation_report is not None:
+		enable_instrumentation()
+
+	outcome = run_pipeline(config, targets, force, state_file)
+
+	if instrumentation_report is not None:
+		write_instrumentation_report(instrumentation_report)
+	print()
+	print("Pipeline done: "+", ".join(name+" "+outcome[name] for name in outcome))
+
+if __name__ == '__main__':
+   main()
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 from lib.plotutils import *
+from lib.prob_fuse_lib import get_repetition_folder
 
 def main():
 	# options
@@ -30,8 +31,10 @@ def main():
 
 
 
-	# change these as needed, used to plot probfuse
-	probfuse_res_folders = ["output/probfuse/","output/probfuse_2/","output/probfuse_3/","output/probfuse_4/","output/probfuse_5/"]
+	# change these as needed, used to plot probfuse:
+	# the repetitions written by prob_fuse_sweep are in output/probfuse/, output/probfuse_2/, ...
+	probfuse_n_repetitions = 5
+	probfuse_res_folders = [get_repetition_folder("output/probfuse/", r) for r in range(1, probfuse_n_repetitions+1)]
 	probfuse_plot_sort_by = "score" # you can sort by ["name", "x", "t", "score", "adjacent"] (x is number of segments)
 
 	# plot side by side comb with max and minmax normalization
@@ -39,18 +42,11 @@ def main():
 	comb_minmax_folder = "output/ten_models/20171229_180835"
 
 	# plot 11pt rp curve
-	rp_curve_probfusejudged_files = [  "output/probfuse/ProbFuseJudged_25_0.5.res",
-								"output/probfuse_2/ProbFuseJudged_25_0.5.res",
-								"output/probfuse_3/ProbFuseJudged_25_0.5.res",
-								"output/probfuse_4/ProbFuseJudged_25_0.5.res",
-								"output/probfuse_5/ProbFuseJudged_25_0.5.res" ]
-	rp_curve_probfuseall_files = [  "output/probfuse/ProbFuseAll_25_0.5.res",
-								"output/probfuse_2/ProbFuseAll_25_0.5.res",
-								"output/probfuse_3/ProbFuseAll_25_0.5.res",
-								"output/probfuse_4/ProbFuseAll_25_0.5.res",
-								"output/probfuse_5/ProbFuseAll_25_0.5.res" ]
-
-	trec_eval_command = "./../materialeDelCorso/trec_eval.8.1/trec_eval"
+	rp_curve_probfusejudged_files = [folder+"ProbFuseJudged_25_0.5.res" for folder in probfuse_res_folders]
+	rp_curve_probfuseall_files = [folder+"ProbFuseAll_25_0.5.res" for folder in probfuse_res_folders]
+
+	# "native" uses the built-in evaluator (lib/trec_eval_lib.py), or put here the path to a compiled trec_eval
+	trec_eval_command = "native" # e.g. "./../materialeDelCorso/trec_eval.8.1/trec_eval"
 	qrels3_file = "./input/qrels.trec3.txt"
 	qrels5_file = "./input/qrels.trec5.txt"
 	qrels7_file = "./input/qrels.trec7.txt"
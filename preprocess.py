@@ -4,12 +4,15 @@
 # plot library for our purposes
 from lib.basic_retrieval_helpers import check_folders_exist
 from lib.basic_retrieval_helpers import get_res_files
+from lib.basic_retrieval_helpers import get_run_name
 from lib.preprocessing_lib import *
 
 def main():
 	ground_truth_path 	= "input/qrels.trec7.txt"
 	input_folder_path 	= "input/ten_models"
 	output_folder_path 	= "output/preprocessed_scores"
+	# binary cache of the runs (see run_cache_lib); None to parse the .res text files every time
+	run_cache_folder 	= "output/cache/runs"
 
 	# verifying and extracting inputs
 	check_folders_exist(input_folder_path)
@@ -22,8 +25,9 @@ def main():
 	# our .res files (obviously) don't have the ground truth for each document extracted.
 	# we must create our own set of input files compatible with the probFuse algorithm.
 
-	# then, we extract the ground truth from the file in a proper data structure.
-	gndt = extract_ground_truth(ground_truth_path)
+	# then, we extract the ground truth from the file in a proper data structure:
+	# an index of the qrels, built once and kept in output/cache/qrels (see qrels_lib)
+	gndt = load_qrels_index(ground_truth_path)
 
 	# then, we extract all the ten runs, properly, but we're just interested at the couple
 	# doc/relevance, rather than its score, etc.
@@ -34,10 +38,10 @@ def main():
 
 		# removes everything but the number of the run.
 		# what we want, for example, is just "1", so that we can give the correct output name just below
-		run_name = filepath[20:].split('/')[0]
+		run_name = get_run_name(filepath)
 
 		# this will write our "new" input file in the output folder, such that it'll be like: topic_id, doc_id, rel/notrel.
-		evaluate_run(filepath, gndt, output_folder_path+"/"+run_name+"_preprocessed.txt")
+		evaluate_run(filepath, gndt, output_folder_path+"/"+run_name+"_preprocessed.npz", run_cache_folder)
 
 	print ("Done!")
 
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# helper functions to keep code organized
+from lib.prob_fuse_lib import *
+from lib.fusion_service_lib import run_fusion_service
+
+def main():
+	# define folders used
+	input_folder_path = "output/preprocessed_scores" # generated by preprocess.py, to train the model
+	model_file = "output/probfuse_model.npz"
+	# the model: X segments, t% training queries, ProbFuseJudged (True) or ProbFuseAll (False)
+	n_segments = 25
+	training_perc = 0.5
+	judged = True
+	# seed of the training split (None: a new random one)
+	seed = None
+	# where the service listens: host and port, or a Unix socket if unix_socket is not None
+	host = "127.0.0.1"
+	port = 8080
+	unix_socket = None
+	# how many documents a fused ranking has, when the request doesn't say it
+	output_depth = 1000
+
+	# the model is trained only if there isn't one yet: delete the model file to train it again
+	if not os.path.isfile(model_file):
+		print("Training ProbFuse on "+input_folder_path+"...")
+		check_relevances_exist(input_folder_path)
+		model = ProbFuse(n_segments, training_perc, judged)
+		model.fit(load_preprocessed_scores(input_folder_path), rng=random.Random(seed), run_sources=load_preprocessed_sources(input_folder_path))
+		model.save(model_file)
+
+	# the model is loaded once, then every query is fused in memory
+	run_fusion_service(model_file, host, port, unix_socket, output_depth)
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+# the tests import the lib package from the root of the repository, as the scripts do
+import os
+import sys
+import pytest
+
+repository_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repository_root)
+
+from lib.synthetic_lib import make_synthetic_collection, write_synthetic_run, write_synthetic_qrels, write_xt_params
+
+
+# a small synthetic collection in the default folders of the scripts (input/ten_models, input/qrels.trec7.txt,
+# input/Xtparams.txt), inside a temporary folder that is the working directory of the test
+@pytest.fixture
+def synthetic_collection(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	collection = make_synthetic_collection(n_runs=4, n_topics=8, depth=60, pool_size=300, judged_depth=20, seed=1)
+	for run in range(1, collection["n_runs"]+1):
+		write_synthetic_run(collection, run, "input/ten_models/run"+str(run)+"/model"+str(run)+".res")
+	write_synthetic_qrels(collection, "input/qrels.trec7.txt")
+	write_xt_params("input/Xtparams.txt", [2, 5], [0.5])
+	return collection
@@ -0,0 +1,9 @@
+401 Q0 d3 4 0.9 tiny
+401 Q0 d2 3 0.8 tiny
+401 Q0 x1 2 0.7 tiny
+401 Q0 d1 1 0.5 tiny
+401 Q0 d5 0 0.5 tiny
+402 Q0 y1 0 1.0 tiny
+402 Q0 e1 1 2.0 tiny
+402 Q0 e2 2 3.0 tiny
+405 Q0 e1 0 1.0 tiny
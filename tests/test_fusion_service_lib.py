@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import json
+import asyncio
+import pytest
+from lib.fusion_service_lib import handle_connection, max_line_bytes, max_request_headers
+
+
+# collects what the service writes on a connection
+class ResponseWriter:
+	def __init__(self):
+		self.data = b""
+		self.closed = False
+
+	def write(self, data):
+		self.data += data
+
+	async def drain(self):
+		pass
+
+	def close(self):
+		self.closed = True
+
+
+# RETURNS: the status and the json payload of the first response of the service to the bytes of request
+def serve_bytes(request):
+	async def serve():
+		reader = asyncio.StreamReader(limit=max_line_bytes)
+		reader.feed_data(request)
+		reader.feed_eof()
+		writer = ResponseWriter()
+		await handle_connection(reader, writer)
+		return writer
+
+	writer = asyncio.run(serve())
+	assert writer.closed
+	head, _, body = writer.data.partition(b"\r\n\r\n")
+	return int(head.split()[1]), json.loads(body)
+
+
+# the requests too large to read get an answer, not a dropped connection
+@pytest.mark.parametrize("request_bytes,status,error", [
+	(b"GET /" + b"x"*max_line_bytes + b" HTTP/1.1\r\n\r\n", 400, "request line exceeds"),
+	(b"GET /health HTTP/1.1\r\nX-Big: " + b"x"*max_line_bytes + b"\r\n\r\n", 431, "header line exceeds"),
+	(b"GET /health HTTP/1.1\r\n" + b"X-Many: 1\r\n"*(max_request_headers+1) + b"\r\n", 431, "more than "+str(max_request_headers)+" headers"),
+])
+def test_oversized_requests(request_bytes, status, error):
+	response_status, payload = serve_bytes(request_bytes)
+	assert response_status == status
+	assert error in payload["error"]
+
+
+# as many headers as allowed are still fine
+def test_headers_up_to_the_limit():
+	status, payload = serve_bytes(b"GET /nowhere HTTP/1.1\r\n" + b"X-Many: 1\r\n"*(max_request_headers-1) + b"Connection: close\r\n\r\n")
+	assert status == 404
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import pytest
+from lib import instrumentation_lib
+from lib.instrumentation_lib import enable_instrumentation, reset_instrumentation, instrumented_stage, get_instrumentation_report
+from lib.trec_eval_lib import evaluate_files_parallel, native_trec_eval_command
+from lib.basic_retrieval_helpers import iterate_res_file_topic_blocks
+
+
+@pytest.fixture
+def instrumentation():
+	enable_instrumentation()
+	reset_instrumentation()
+	yield
+	reset_instrumentation()
+	instrumentation_lib.instrumentation["enabled"] = False
+
+
+def get_record(stage, **config):
+	for record in get_instrumentation_report()["stages"]:
+		if record["stage"] == stage and all(record["config"].get(k) == v for k, v in config.items()):
+			return record
+	raise AssertionError("no record of the stage "+stage)
+
+
+# the counters of the evaluations, done on a pool of threads, reach the stage that started them,
+# and the stages of the threads inherit its configuration
+def test_evaluation_threads_count_in_the_enclosing_stage(synthetic_collection, instrumentation):
+	jobs = [("input/ten_models/run"+str(run)+"/model"+str(run)+".res", "output/eval/"+str(run)+".txt") for run in range(1, 5)]
+	with instrumented_stage("evaluate", with_io=True, step="test"):
+		failures = evaluate_files_parallel(jobs, native_trec_eval_command, "input/qrels.trec7.txt", n_workers=2)
+	assert failures == []
+
+	record = get_record("evaluate", step="test")
+	assert record["counters"]["evaluations"] == len(jobs)
+	assert get_record("run_trec_eval_cached", step="test")["calls"] == len(jobs)
+
+
+# a with_io stage counts the CPU of the whole process, not only of its own thread
+def test_coarse_stage_counts_the_cpu_of_other_threads(instrumentation):
+	def spin():
+		end = time.process_time() + 0.2
+		while time.process_time() < end:
+			pass
+
+	with instrumented_stage("coarse", with_io=True):
+		thread = threading.Thread(target=spin)
+		thread.start()
+		thread.join()
+	assert get_record("coarse")["cpu_seconds"] >= 0.15
+
+
+# the streaming reader counts every line of the run once
+def test_streaming_reader_counts_lines(synthetic_collection, instrumentation):
+	with instrumented_stage("read"):
+		blocks = list(iterate_res_file_topic_blocks("input/ten_models/run1/model1.res"))
+	assert get_record("read")["counters"]["lines"] == sum(len(doc_names) for _, doc_names, _ in blocks)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from lib.normalization_lib import normalize_segments, normalize_run_topics, normalization_methods
+
+
+# the normalization of the scores of a single topic, one score at a time (see the top of normalization_lib)
+def naive_normalization(scores, method):
+	scores = [float(s) for s in scores]
+	n = len(scores)
+	if method == "max":
+		return [s / max(scores) for s in scores]
+	if method == "min_max":
+		return [(s - min(scores)) / (max(scores) - min(scores)) for s in scores]
+	if method == "sum":
+		total = sum(s - min(scores) for s in scores)
+		return [(s - min(scores)) / total for s in scores]
+	if method == "z_score":
+		mean = sum(scores) / n
+		std = (sum((s - mean)**2 for s in scores) / n) ** 0.5
+		return [(s - mean) / std for s in scores]
+	# rank: by decreasing score, ties in the order of the run
+	order = sorted(range(n), key=lambda i: -scores[i])
+	normalized = [0.0] * n
+	for rank, i in enumerate(order):
+		normalized[i] = 1 - rank / n
+	return normalized
+
+
+def make_topics(seed=0, n_topics=6):
+	rng = np.random.RandomState(seed)
+	sizes = rng.randint(1, 30, size=n_topics)
+	# positive scores, with some ties
+	scores = np.round(rng.uniform(0.5, 10.0, size=sizes.sum()), 1)
+	starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+	return scores, starts, sizes
+
+
+@pytest.mark.parametrize("method", normalization_methods)
+def test_methods_match_the_formulas(method):
+	scores, starts, sizes = make_topics()
+	# a topic of a single entry is constant: keep only the larger ones here
+	keep = np.repeat(sizes > 1, sizes)
+	sizes = sizes[sizes > 1]
+	scores = scores[keep]
+	starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+	normalized = normalize_segments(scores, starts, method)
+	for start, size in zip(starts, sizes):
+		np.testing.assert_allclose(normalized[start:start+size], naive_normalization(scores[start:start+size], method), rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize("method,fill", [("max", 1.0), ("min_max", 1.0), ("sum", 1.0/3), ("z_score", 0.0), ("rank", None)])
+def test_constant_topic_is_filled(method, fill):
+	scores = np.array([3.0, 1.0, 2.0, 5.0, 5.0, 5.0])
+	normalized = normalize_segments(scores, [0, 3], method)
+	np.testing.assert_allclose(normalized[:3], naive_normalization(scores[:3], method))
+	if fill is None:
+		# the ranks don't look at the scores: the ties keep the order of the run
+		np.testing.assert_allclose(normalized[3:], [1.0, 2.0/3, 1.0/3])
+	else:
+		np.testing.assert_allclose(normalized[3:], [fill]*3)
+
+
+# (for max a topic is constant only if its max score is zero, see test_max_of_zero_is_constant)
+@pytest.mark.parametrize("method", ["min_max", "sum", "z_score"])
+def test_constant_topic_error(method):
+	with pytest.raises(Exception, match="Cannot normalize"):
+		normalize_segments(np.array([3.0, 1.0, 5.0, 5.0]), [0, 2], method, constant_scores="error")
+
+
+def test_max_of_zero_is_constant():
+	np.testing.assert_allclose(normalize_segments(np.array([2.0, 1.0, 0.0, 0.0]), [0, 2], "max"), [1.0, 0.5, 1.0, 1.0])
+	with pytest.raises(Exception, match="max == min"):
+		normalize_segments(np.array([0.0, 0.0]), [0], "max", constant_scores="error")
+
+
+def test_unknown_method_and_policy():
+	with pytest.raises(Exception, match="Unknown normalization method"):
+		normalize_segments(np.array([1.0]), [0], "l2")
+	with pytest.raises(Exception, match="Unknown policy"):
+		normalize_segments(np.array([1.0]), [0], "max", constant_scores="ignore")
+
+
+# the precision of the scores is kept
+def test_float32_scores_stay_float32():
+	scores, starts, sizes = make_topics()
+	for method in normalization_methods:
+		assert normalize_segments(scores.astype(np.float32), starts, method).dtype == np.float32
+
+
+# the score ranges found by the parser give the same result as the ones searched again
+def test_run_topics_with_score_ranges():
+	scores, starts, sizes = make_topics()
+	run = {}
+	score_ranges = {}
+	for topic, (start, size) in enumerate(zip(starts, sizes)):
+		topic_scores = scores[start:start+size]
+		run[str(topic)] = (np.arange(size, dtype=np.int32), topic_scores)
+		score_ranges[str(topic)] = (float(topic_scores.min()), float(topic_scores.max()))
+
+	for method in normalization_methods:
+		searched = normalize_run_topics(run, method)
+		given = normalize_run_topics(run, method, score_ranges=score_ranges)
+		for topic in run:
+			assert np.array_equal(searched[topic][1], given[topic][1])
+			assert np.array_equal(given[topic][0], run[topic][0])
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import glob
+import shutil
+import hashlib
+import subprocess
+import pytest
+from conftest import repository_root
+from lib.pipeline_lib import make_pipeline_config, run_pipeline
+
+
+def get_probfuse_digests(config):
+	paths = sorted(glob.glob(config["probfuse_folder"]+"*.res"))
+	assert len(paths) > 0
+	return {os.path.basename(path): hashlib.sha1(open(path, "rb").read()).hexdigest() for path in paths}
+
+
+# flips the relevance of every third judgment
+def change_qrels(path):
+	lines = open(path).read().splitlines()
+	for i in range(0, len(lines), 3):
+		elements = lines[i].split()
+		elements[3] = "1" if elements[3] == "0" else "0"
+		lines[i] = " ".join(elements)
+	with open(path, "w") as fp:
+		fp.write("\n".join(lines)+"\n")
+
+
+# a second run_pipeline in the same process, after the qrels changed, writes the same fused runs
+# as a pipeline that starts from scratch in another process
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_second_run_in_process_matches_fresh_process(synthetic_collection, n_workers):
+	config = make_pipeline_config(n_workers=n_workers)
+	run_pipeline(config, ["probfuse"])
+	first = get_probfuse_digests(config)
+
+	change_qrels(config["qrels_file"])
+	outcome = run_pipeline(config, ["probfuse"])
+	assert outcome["preprocess"] == "ran"
+	assert outcome["probfuse"] == "ran"
+	in_process = get_probfuse_digests(config)
+	assert in_process != first
+
+	shutil.rmtree("output")
+	script = "from lib.pipeline_lib import *; run_pipeline(make_pipeline_config(n_workers="+str(n_workers)+"), ['probfuse'])"
+	environment = dict(os.environ, PYTHONPATH=repository_root)
+	subprocess.run([sys.executable, "-c", script], check=True, env=environment, stdout=subprocess.DEVNULL)
+	assert get_probfuse_digests(config) == in_process
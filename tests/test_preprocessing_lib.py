@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from lib.preprocessing_lib import evaluate_run
+from lib.qrels_lib import load_qrels_index
+
+
+# a topic id that is not a number can't be pre-processed: the error names it and the run, in both formats
+@pytest.mark.parametrize("output_file", ["output/1_preprocessed.npz", "output/1_preprocessed.txt"])
+def test_topic_id_that_is_not_a_number(synthetic_collection, output_file):
+	run_file = "input/ten_models/run1/model1.res"
+	lines = open(run_file).read().splitlines(True)
+	lines[3] = "topic-x" + lines[3][lines[3].index(" "):]
+	with open(run_file, "w") as writer:
+		writer.write("".join(lines))
+
+	with pytest.raises(Exception, match="The topic id 'topic-x' of the run '"+run_file+"' is not a number"):
+		evaluate_run(run_file, load_qrels_index("input/qrels.trec7.txt"), output_file)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import shutil
+import pytest
+from lib.pipeline_lib import make_pipeline_config, run_pipeline
+from lib.prob_fuse_lib import prob_fuse, prob_fuse_with_model, prob_fuse_stream, prob_fuse_sweep, ProbFuse
+from lib.prob_fuse_lib import load_preprocessed_scores, build_relevance_index, compute_repeated_probabilities, get_sweep_training_topics, get_preprocessed_topics
+from lib.synthetic_lib import make_synthetic_collection, write_synthetic_run
+
+
+@pytest.fixture
+def trained_model(synthetic_collection):
+	config = make_pipeline_config()
+	run_pipeline(config, ["preprocess"])
+	prob_fuse(config["preprocessed_folder"], "output/fused.res", 5, 0.5, model_path="output/model.npz")
+	return config
+
+
+def get_run_files():
+	return sorted(glob.glob("input/ten_models/run*/*.res"))
+
+
+# the model keeps the name and the sha1 of the .res file of each run
+def test_model_keeps_the_run_files(trained_model):
+	model = ProbFuse.load("output/model.npz")
+	assert sorted(model.run_sources) == [1, 2, 3, 4]
+	assert model.run_sources[3]["file"] == "model3.res"
+	assert len(model.run_sources[3]["sha1"]) == 40
+
+
+# the very same runs are fused as the batch ProbFuse does
+def test_same_runs_are_accepted(trained_model):
+	prob_fuse_with_model("output/model.npz", trained_model["preprocessed_folder"], "output/with_model.res")
+	prob_fuse_stream("output/model.npz", get_run_files(), "output/stream.res")
+	assert open("output/with_model.res").read() == open("output/fused.res").read()
+	assert open("output/stream.res").read() == open("output/fused.res").read()
+
+
+# another run in the folder of run 3 is refused, unless only the names are checked
+def test_changed_run_is_refused(trained_model):
+	other = make_synthetic_collection(n_runs=4, n_topics=8, depth=60, pool_size=300, judged_depth=20, seed=2)
+	write_synthetic_run(other, 3, "input/ten_models/run3/model3.res")
+
+	with pytest.raises(Exception, match="not the file the model has been trained on"):
+		prob_fuse_stream("output/model.npz", get_run_files(), "output/stream.res")
+	assert not os.path.exists("output/stream.res")
+	prob_fuse_stream("output/model.npz", get_run_files(), "output/stream.res", check_runs="name")
+
+	shutil.move("input/ten_models/run3/model3.res", "input/ten_models/run3/other.res")
+	with pytest.raises(Exception, match="has been trained on 'model3.res'"):
+		prob_fuse_stream("output/model.npz", get_run_files(), "output/stream.res", check_runs="name")
+	prob_fuse_stream("output/model.npz", get_run_files(), "output/stream.res", check_runs="none")
+
+
+# the pre-processed runs of another run are refused too
+def test_changed_preprocessed_run_is_refused(trained_model):
+	other = make_synthetic_collection(n_runs=4, n_topics=8, depth=60, pool_size=300, judged_depth=20, seed=2)
+	write_synthetic_run(other, 2, "input/ten_models/run2/model2.res")
+	run_pipeline(trained_model, ["preprocess"])
+
+	with pytest.raises(Exception, match="not the file the model has been trained on"):
+		prob_fuse_with_model("output/model.npz", trained_model["preprocessed_folder"], "output/with_model.res")
+	prob_fuse_with_model("output/model.npz", trained_model["preprocessed_folder"], "output/with_model.res", check_runs="name")
+
+
+# the probabilities of the sweep, for many splits at once, are the very same (to the last bit) of ProbFuse.fit on each split
+def test_repeated_probabilities_match_fit(trained_model):
+	preprocessed = load_preprocessed_scores(trained_model["preprocessed_folder"])
+	relevance_index = build_relevance_index(preprocessed)
+	topics = get_preprocessed_topics(preprocessed)
+	splits = [get_sweep_training_topics(7, 5, 0.75, topics, r) for r in range(1, 4)]
+
+	probabilities = compute_repeated_probabilities(relevance_index, 5, splits, [True, False])
+	for judged in (True, False):
+		for r, training_topics in enumerate(splits):
+			model = ProbFuse(5, 0.75, judged).fit(preprocessed, training_topics=training_topics, relevance_index=relevance_index)
+			assert probabilities[judged][r] == model.probabilities
+
+
+# a t that leaves no training topic (int(8*0.1) = 0) is an error, not probabilities of 0/0
+def test_no_training_topics(trained_model):
+	with pytest.raises(ValueError, match="No training topics"):
+		prob_fuse(trained_model["preprocessed_folder"], "output/none.res", 5, 0.1)
+	with pytest.raises(ValueError, match="No training topics"):
+		prob_fuse_sweep(trained_model["preprocessed_folder"], "output/sweep/", [5], [0.5, 0.1], seed=1)
+	assert not os.path.exists("output/none.res")
+	assert not os.path.exists("output/sweep/")
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import re
+import gzip
+import functools
+import numpy as np
+import pytest
+from lib import tokenizer_lib
+from lib.compression_lib import iterate_line_chunks
+from lib.tokenizer_lib import parse_run_columns, parse_qrels_text_columns, number_topic_names
+
+run_lines = [
+	"351 Q0 d1 0 3.5 m\n",
+	"351 Q0 d2 1 2.5 m\n",
+	"352 Q0 d1 0 9.0 m\n",
+	"352 Q0 d3 1 1.0 m\n",
+]
+
+
+def write_file(path, lines):
+	opener = gzip.open if str(path).endswith(".gz") else open
+	with opener(str(path), "wt") as writer:
+		writer.write("".join(lines))
+	return str(path)
+
+
+@pytest.mark.parametrize("name", ["run.res", "run.res.gz"])
+def test_run_columns(tmp_path, name):
+	path = write_file(tmp_path / name, run_lines[:2] + ["\n"] + run_lines[2:])
+	columns = parse_run_columns(path)
+	assert columns["topic_ids"].tolist() == ["351", "352"]
+	assert columns["topics"].tolist() == [0, 0, 1, 1]
+	assert columns["doc_ids"].tolist() == ["d1", "d2", "d3"]
+	assert columns["docs"].tolist() == [0, 1, 0, 2]
+	assert columns["ranks"].tolist() == [0, 1, 0, 1]
+	assert columns["scores"].tolist() == [3.5, 2.5, 9.0, 1.0]
+	assert columns["topic_min"].tolist() == [2.5, 1.0]
+	assert columns["topic_max"].tolist() == [3.5, 9.0]
+
+
+@pytest.mark.parametrize("name", ["run.res", "run.res.gz"])
+def test_line_with_wrong_number_of_elements(tmp_path, name):
+	path = write_file(tmp_path / name, run_lines[:2] + ["352 Q0 d1 0 9.0\n"] + run_lines[3:])
+	with pytest.raises(Exception, match=r"\(line 3\) with 5 elements, 6 expected: 352 Q0 d1 0 9.0$"):
+		parse_run_columns(path)
+
+
+@pytest.mark.parametrize("name", ["run.res", "run.res.gz"])
+def test_score_that_is_not_a_number(tmp_path, name):
+	path = write_file(tmp_path / name, run_lines[:3] + ["352 Q0 d3 1 high m\n"])
+	with pytest.raises(Exception, match=r"\(line 4\) with a score that is not a number \('high'\): 352 Q0 d3 1 high m$"):
+		parse_run_columns(path)
+
+
+# the ranks are checked even if only the cache keeps them
+@pytest.mark.parametrize("rank", ["first", "1.0", "99999999999999999999"])
+def test_rank_that_is_not_a_number(tmp_path, rank):
+	path = write_file(tmp_path / "run.res", ["351 Q0 d1 "+rank+" 3.5 m\n"] + run_lines[1:])
+	with pytest.raises(Exception, match=r"\(line 1\) with a rank that is not a number \('"+re.escape(rank)+r"'\)"):
+		parse_run_columns(path)
+
+
+# a file read in many chunks gives the same columns, and the lines of its errors are counted across the chunks
+@pytest.mark.parametrize("name", ["run.res", "run.res.gz"])
+def test_columns_of_many_chunks(tmp_path, monkeypatch, name):
+	lines = run_lines + ["\n"] + [run_lines[2].replace("d1", "document"+str(i)) for i in range(10)]
+	path = write_file(tmp_path / name, lines)
+	columns = parse_run_columns(path)
+	monkeypatch.setattr(tokenizer_lib, "iterate_line_chunks", functools.partial(iterate_line_chunks, chunk_size=16))
+	chunked = parse_run_columns(path)
+	for key in columns:
+		assert chunked[key].tolist() == columns[key].tolist()
+
+	path = write_file(tmp_path / name, lines + ["352 Q0 d9 0 none m\n"])
+	with pytest.raises(Exception, match=r"\(line 16\) with a score that is not a number \('none'\): 352 Q0 d9 0 none m$"):
+		parse_run_columns(path)
+
+
+def test_qrels_errors(tmp_path):
+	path = write_file(tmp_path / "qrels.txt", ["351 0 d1 1\n", "351 0 d2\n"])
+	with pytest.raises(Exception, match=r"\(line 2\) with 3 elements, 4 expected"):
+		parse_qrels_text_columns(path)
+
+	path = write_file(tmp_path / "qrels.txt", ["351 0 d1 1\n", "351 0 d2 yes\n"])
+	with pytest.raises(Exception, match=r"\(line 2\) with a relevance that is not a number \('yes'\)"):
+		parse_qrels_text_columns(path)
+
+
+# the topics are numbered in order of first appearance, also when a topic comes back after another one
+def test_number_topic_names():
+	names, topics = number_topic_names([b"352", b"352", b"351", b"352", b"400"])
+	assert names.tolist() == ["352", "351", "400"]
+	assert topics.tolist() == [0, 0, 1, 0, 2]
+	assert topics.dtype == np.int32
+
+	names, topics = number_topic_names([])
+	assert len(names) == 0 and len(topics) == 0
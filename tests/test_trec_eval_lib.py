@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import os
+import gzip
+import shutil
+from conftest import repository_root
+from lib.trec_eval_lib import native_trec_eval, evaluate_run_file
+
+data_folder = os.path.join(repository_root, "tests", "data")
+qrels_file = os.path.join(data_folder, "tiny_qrels.txt")
+run_file = os.path.join(data_folder, "tiny_run.res")
+# the values that "trec_eval tiny_qrels.txt tiny_run.res" (trec_eval 9.0, default options) should give for the measures
+# we compute, worked out by hand from the definitions of trec_eval: they were not produced by a real trec_eval binary.
+# the run covers what trec_eval does on its own: the rank column is ignored (the documents are sorted by
+# decreasing score, ties by decreasing docno: d5 before d1), a relevance of 2 is relevant, an unjudged
+# document (x1, y1) is not, topic 403 (qrels only) and topic 405 (run only) are not evaluated
+expected_output_file = os.path.join(data_folder, "tiny_run.expected.txt")
+
+
+# RETURNS: {measure: value (str)} of a trec_eval output
+def parse_trec_eval_output(text):
+	measures = {}
+	for line in text.splitlines():
+		measure, topic, value = line.split()
+		assert topic == "all"
+		measures[measure] = value
+	return measures
+
+
+def test_native_trec_eval_matches_expected_values():
+	expected = open(expected_output_file).read()
+	assert parse_trec_eval_output(native_trec_eval(run_file, qrels_file)) == parse_trec_eval_output(expected)
+
+
+def test_native_trec_eval_per_measure():
+	measures = evaluate_run_file(run_file, qrels_file)
+	assert measures["num_q"] == 2
+	assert measures["num_rel"] == 4
+	# (1/1 + 2/5)/3 for topic 401, 1/2 for topic 402
+	assert abs(measures["map"] - (1.4/3 + 0.5)/2) < 1e-12
+
+
+def test_compressed_files_give_the_same_output(tmp_path):
+	for path in (qrels_file, run_file):
+		with open(path, "rb") as reader, gzip.open(str(tmp_path / os.path.basename(path))+".gz", "wb") as writer:
+			shutil.copyfileobj(reader, writer)
+	output = native_trec_eval(str(tmp_path / "tiny_run.res.gz"), str(tmp_path / "tiny_qrels.txt.gz"))
+	assert output == native_trec_eval(run_file, qrels_file)